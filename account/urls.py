@@ -5,5 +5,5 @@ from . import views
 app_name = 'account'
 
 urlpatterns = [
-    path('register/', views.register, name='register'),
+    path('register/', views.register_user, name='register'),
 ]
\ No newline at end of file
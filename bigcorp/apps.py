@@ -0,0 +1,6 @@
+from django.apps import AppConfig
+
+
+class BigcorpConfig(AppConfig):
+    name = 'bigcorp'
+    verbose_name = 'BIG CORP'
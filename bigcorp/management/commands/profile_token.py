@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bigcorp.profiling import MODES, make_token
+
+
+class Command(BaseCommand):
+    help = 'Prints a signed X-Profile header value that profiles the requests sending it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, default=MODES[0])
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'X-Profile: {make_token(options["mode"])}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds. Profiles are listed at /admin/profiles/.'))
@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from bigcorp.replay import DEFAULT_HOST, replay, summarize
+
+
+class Command(BaseCommand):
+    help = 'Replays a JSON Lines access log against bigcorp.wsgi.application and reports latencies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='JSON Lines access log.')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--mode', choices=('threads', 'processes'), default='threads')
+        parser.add_argument('--host', default=DEFAULT_HOST, help='Host header, which must be in ALLOWED_HOSTS.')
+        parser.add_argument('--output', default=None, help='Path of the JSON report.')
+
+    def handle(self, *args, **options):
+        result, elapsed = replay(options['log'], options['concurrency'], options['mode'], options['host'])
+        report = summarize(result, elapsed)
+
+        latency = report['latency_ms']
+        self.stdout.write(f'{report["requests"]} requests in {report["elapsed_s"]}s, {report["throughput_rps"]} req/s')
+        self.stdout.write(f'latency p50 {latency["p50"]}ms, p90 {latency["p90"]}ms, p99 {latency["p99"]}ms')
+        for bucket, count in report['histogram'].items():
+            self.stdout.write(f'  {bucket:>10} {count}')
+        self.stdout.write(f'statuses {report["statuses"]}, error rates {report["error_rate"]}')
+        if report['skipped_lines']:
+            self.stdout.write(self.style.WARNING(f'Skipped {report["skipped_lines"]} malformed log lines.'))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote the report to {options["output"]}.'))
@@ -0,0 +1,326 @@
+"""
+Per-request query, latency and cache instrumentation.
+
+RequestMetricsMiddleware measures every request: the number of SQL
+queries and their total time, the time spent rendering templates, the
+cache hits and misses and the total duration. The numbers are sent back
+in a ``Server-Timing`` header, attached to the response as
+``response.metrics`` and added to per-view totals, keyed by the resolved
+view name such as ``shop:products``, which metrics_view exposes in the
+Prometheus text format.
+
+Queries are counted by a wrapper installed on every database connection
+and templates and cache reads by wrapping the template and the cache
+backend classes. All of them record into the metrics of the current
+request, found through a context variable, so the ORM calls that async
+views run in threads are counted too.
+
+``QUERY_BUDGETS`` maps view names to the most queries a request may
+take. Going over it is logged, or raises QueryBudgetExceeded when
+``QUERY_BUDGETS_STRICT`` is set, which the tests do.
+"""
+import contextvars
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template.base import Template
+
+
+logger = logging.getLogger(__name__)
+
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a view runs more queries than its budget allows and
+    budgets are strict.
+    """
+
+
+class RequestMetrics:
+    """
+    What one request spent, filled in while the request runs.
+    """
+
+    __slots__ = ('queries', 'sql_time', 'template_time', 'cache_hits', 'cache_misses', 'duration', '_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.duration = 0.0
+        self._depth = {}
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={self.duration * 1000:.1f}',
+        ])
+
+
+class ViewStats:
+    """
+    Totals of every request served by one view in this process.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+    def add(self, metrics):
+        self.requests += 1
+        self.queries += metrics.queries
+        self.sql_time += metrics.sql_time
+        self.template_time += metrics.template_time
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+        self.duration += metrics.duration
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if metrics.duration <= bound:
+                self.buckets[index] += 1
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record(view_name, metrics):
+    with _stats_lock:
+        _stats.setdefault(view_name, ViewStats()).add(metrics)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _nested(metrics, kind):
+    """
+    Tells whether a call of this kind is already being measured further
+    up the stack, so included templates, or cache reads made by other
+    cache methods, are not counted twice.
+    """
+    return metrics._depth.get(kind, 0) > 0
+
+
+def _instrument_template_render():
+    render = Template.render
+
+    def timed_render(self, context):
+        metrics = _current.get()
+        if metrics is None or _nested(metrics, 'template'):
+            return render(self, context)
+        metrics._depth['template'] = 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+            metrics._depth['template'] = 0
+
+    Template.render = timed_render
+
+
+def _instrument_cache_reads(backend_class):
+    get, get_many = backend_class.get, backend_class.get_many
+    missing = object()
+
+    def counted_get(self, key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None or _nested(metrics, 'cache'):
+            return get(self, key, default, version)
+        metrics._depth['cache'] = 1
+        try:
+            value = get(self, key, missing, version)
+        finally:
+            metrics._depth['cache'] = 0
+        if value is missing:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+    def counted_get_many(self, keys, version=None):
+        metrics = _current.get()
+        if metrics is None or _nested(metrics, 'cache'):
+            return get_many(self, keys, version)
+        keys = list(keys)
+        metrics._depth['cache'] = 1
+        try:
+            values = get_many(self, keys, version)
+        finally:
+            metrics._depth['cache'] = 0
+        metrics.cache_hits += len(values)
+        metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    backend_class.get, backend_class.get_many = counted_get, counted_get_many
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_time += time.perf_counter() - started
+        metrics.queries += 1
+
+
+def _install_query_wrapper(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    """
+    Installs the template, cache and database hooks once per process.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _instrument_template_render()
+        _instrument_cache_reads(type(caches['default']))
+        connection_created.connect(_install_query_wrapper, dispatch_uid='bigcorp_metrics_queries')
+        for connection in connections.all(initialized_only=True):
+            _install_query_wrapper(None, connection)
+        _installed = True
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else UNRESOLVED_VIEW
+
+
+def _finish(request, response, metrics, started):
+    metrics.duration = time.perf_counter() - started
+    view_name = _view_name(request)
+    record(view_name, metrics)
+    response['Server-Timing'] = metrics.server_timing()
+    response.metrics = metrics
+
+    budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+    if budget is not None and metrics.queries > budget:
+        message = f'{view_name} ran {metrics.queries} queries, over its budget of {budget}.'
+        if getattr(settings, 'QUERY_BUDGETS_STRICT', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures every request, see the module docstring. Place it first,
+    so the work of every other middleware is measured as well.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _finish(request, response, metrics, started)
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    """
+    Renders the per-view totals in the Prometheus text format.
+    """
+    with _stats_lock:
+        stats = {view: vars(view_stats).copy() for view, view_stats in _stats.items()}
+
+    counters = (
+        ('bigcorp_view_requests_total', 'Requests served.', 'requests'),
+        ('bigcorp_view_db_queries_total', 'SQL queries run.', 'queries'),
+        ('bigcorp_view_db_seconds_total', 'Time spent in SQL queries.', 'sql_time'),
+        ('bigcorp_view_template_seconds_total', 'Time spent rendering templates.', 'template_time'),
+        ('bigcorp_view_cache_hits_total', 'Cache reads that found a value.', 'cache_hits'),
+        ('bigcorp_view_cache_misses_total', 'Cache reads that found nothing.', 'cache_misses'),
+    )
+    lines = []
+    for name, help_text, field in counters:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for view, values in sorted(stats.items()):
+            lines.append(f'{name}{{view="{_escape_label(view)}"}} {values[field]}')
+
+    name = 'bigcorp_view_duration_seconds'
+    lines += [f'# HELP {name} Request duration.', f'# TYPE {name} histogram']
+    for view, values in sorted(stats.items()):
+        label = f'view="{_escape_label(view)}"'
+        for bound, count in zip(DURATION_BUCKETS, values['buckets']):
+            lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{label},le="+Inf"}} {values["requests"]}')
+        lines.append(f'{name}_sum{{{label}}} {values["duration"]}')
+        lines.append(f'{name}_count{{{label}}} {values["requests"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Serves the per-view totals of this process to scrapers running on
+    the same machine, as listed in ``METRICS_ALLOWED_IPS``.
+    """
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        raise PermissionDenied
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
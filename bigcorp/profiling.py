@@ -0,0 +1,343 @@
+"""
+On-demand profiling of single requests.
+
+ProfilingMiddleware profiles a request only when asked to, by either:
+
+* an ``X-Profile`` header holding a token signed with the secret key, as
+  made by ``python manage.py profile_token``, which works for anyone
+  holding a fresh token, signed in or not;
+* a ``profile`` query parameter sent by a staff user.
+
+The requested mode is ``cprofile``, which records every call with
+cProfile and is exact but slows the request down, or ``sample``, which
+takes the stack of the request thread from another thread every
+``PROFILING_SAMPLE_INTERVAL`` seconds and barely slows it down. Every
+other request only pays for a header and a query string lookup.
+
+Profiles are written to ``PROFILING_DIR``: a pstats file or a file of
+collapsed stacks, which flame graph tools read, next to a JSON summary
+with the request and its slowest frames, shown by profiles_view in the
+admin. Only the newest ``PROFILING_KEEP`` profiles are kept. The id of
+the profile is sent back in an ``X-Profile-Id`` header.
+
+Under ASGI the profile covers the event loop thread, so it includes the
+coroutines of other requests and misses the ORM calls run in threads.
+"""
+import cProfile
+import functools
+import json
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.core import signing
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+from django.utils import timezone
+
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+MODES = (CPROFILE, SAMPLE)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+
+TOKEN_SALT = 'bigcorp.profiling'
+
+TOP_FRAMES = 15
+
+_PROFILE_NAME = re.compile(r'^\d{8}-\d{6}-\d{6}-[0-9a-f]{4}$')
+
+
+def make_token(mode=CPROFILE):
+    """
+    Returns a token that enables profiling in the given mode when sent
+    in the ``X-Profile`` header, until ``PROFILING_TOKEN_MAX_AGE``
+    seconds have passed.
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(mode)
+
+
+def _header_mode(request):
+    token = request.META.get(PROFILE_HEADER)
+    if not token:
+        return None
+    try:
+        mode = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return mode if mode in MODES else None
+
+
+def _param_mode(request):
+    value = request.GET.get(PROFILE_PARAM)
+    if value is None:
+        return None
+    return value if value in MODES else CPROFILE
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def _frame_label(filename, line, function):
+    if filename == '~':
+        # A built-in function, as cProfile names them.
+        return function
+    return f'{function} ({_short_path(filename)}:{line})'
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename):
+    for prefix in sorted({str(settings.BASE_DIR), *sys.path}, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + '/'):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread and counts
+    the collapsed stacks, outermost frame first.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code.co_filename, code.co_firstlineno, code.co_name)
+        return label
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+class Capture:
+    """
+    One profile of the current thread, in either mode. cProfile falls
+    back to sampling when another profiler is already running.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.profiler = None
+        self.sampler = None
+
+    def start(self):
+        if self.mode == CPROFILE:
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+                return
+            except ValueError:
+                self.profiler, self.mode = None, SAMPLE
+        self.sampler = StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+        self.sampler.start()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        else:
+            self.sampler.stop()
+
+    def save(self, path):
+        """
+        Writes the profile and returns its slowest frames as
+        ``(frame, self seconds, total seconds)``.
+        """
+        if self.profiler is not None:
+            stats = pstats.Stats(self.profiler)
+            stats.dump_stats(path)
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FRAMES]
+            return [
+                (_frame_label(*function), own, total)
+                for function, (calls, primitive_calls, own, total, callers) in rows
+            ]
+
+        interval = self.sampler.interval
+        own, total = Counter(), Counter()
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in self.sampler.stacks.most_common():
+                output.write(f'{stack} {count}\n')
+                frames = stack.split(';')
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    total[frame] += count
+        return [(frame, count * interval, total[frame] * interval) for frame, count in own.most_common(TOP_FRAMES)]
+
+
+def _directory():
+    directory = Path(settings.PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def save_profile(capture, request, response, duration):
+    """
+    Writes a finished capture and its summary and prunes old profiles.
+
+    Returns:
+        str: The id of the profile.
+    """
+    directory = _directory()
+    created = timezone.now()
+    # Names sort by creation time, which pruning relies on.
+    name = f'{created:%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:4]}'
+    data_file = f'{name}.prof' if capture.mode == CPROFILE else f'{name}.collapsed'
+    frames = capture.save(directory / data_file)
+
+    match = getattr(request, 'resolver_match', None)
+    summary = {
+        'id': name,
+        'file': data_file,
+        'mode': capture.mode,
+        'created': created.isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': match.view_name if match is not None else None,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'top_frames': [
+            {'frame': frame, 'self_ms': round(own * 1000, 3), 'total_ms': round(total * 1000, 3)}
+            for frame, own, total in frames
+        ],
+    }
+    (directory / f'{name}.json').write_text(json.dumps(summary), encoding='utf-8')
+    prune_profiles(directory, settings.PROFILING_KEEP)
+    return name
+
+
+def prune_profiles(directory, keep):
+    for summary in sorted(directory.glob('*.json'), reverse=True)[keep:]:
+        for path in directory.glob(f'{summary.stem}.*'):
+            path.unlink(missing_ok=True)
+
+
+def recent_profiles(limit=None):
+    """
+    Returns the summaries of the newest profiles, newest first.
+    """
+    directory = Path(settings.PROFILING_DIR)
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.json'), reverse=True)[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests that ask for it, see the module docstring.
+    Place it after AuthenticationMiddleware, which the staff check
+    needs.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        mode = _header_mode(request)
+        if mode is None:
+            mode = _param_mode(request)
+            if mode is not None and not _is_staff(request):
+                mode = None
+        if mode is None:
+            return self.get_response(request)
+
+        capture = Capture(mode)
+        started = time.perf_counter()
+        capture.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            capture.stop()
+        response['X-Profile-Id'] = save_profile(capture, request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        mode = _header_mode(request)
+        if mode is None:
+            mode = _param_mode(request)
+            if mode is not None and not await sync_to_async(_is_staff)(request):
+                mode = None
+        if mode is None:
+            return await self.get_response(request)
+
+        capture = Capture(mode)
+        started = time.perf_counter()
+        capture.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            capture.stop()
+        duration = time.perf_counter() - started
+        response['X-Profile-Id'] = await sync_to_async(save_profile)(capture, request, response, duration)
+        return response
+
+
+def profiles_view(request):
+    """
+    Lists the recent profiles with their slowest frames in the admin.
+    """
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': recent_profiles(settings.PROFILING_KEEP),
+    }
+    return TemplateResponse(request, 'admin/profiles.html', context)
+
+
+def profile_download_view(request, name):
+    """
+    Serves the pstats or collapsed stacks file of a profile.
+    """
+    if not _PROFILE_NAME.match(name):
+        raise Http404
+    for path in Path(settings.PROFILING_DIR).glob(f'{name}.*'):
+        if path.suffix in ('.prof', '.collapsed'):
+            return FileResponse(path.open('rb'), as_attachment=True, filename=path.name)
+    raise Http404
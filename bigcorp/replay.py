@@ -0,0 +1,271 @@
+"""
+Replays a recorded access log against the WSGI application in-process.
+
+Each line of the log is a JSON object::
+
+    {"method": "POST", "path": "/cart/add/", "body": "action=post&product_id=3&product_quantity=1",
+     "session": "a1b2", "content_type": "application/x-www-form-urlencoded"}
+
+``body`` may also be an object, which is form-encoded, and ``session``
+and ``content_type`` may be left out. Requests are sent straight to
+``bigcorp.wsgi.application`` without a network or a server.
+
+Every session is replayed in order by a single worker, which keeps the
+cookies the application sets for it, so cart flows behave as they did
+for the recorded visitor. Sessions are spread over the workers by a
+hash of their id, and every worker streams the log on its own and skips
+the sessions of the others, so memory use does not grow with the log.
+Lines that are not JSON objects are skipped with a warning and counted
+in the report.
+
+Usage::
+
+    python manage.py replay_log access.jsonl --concurrency 8 --mode processes --output replay.json
+"""
+import bisect
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import unquote_to_bytes, urlencode
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_HOST = 'localhost'
+
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def partition(session, workers):
+    """
+    Returns the index of the worker that replays the session.
+    """
+    return zlib.crc32(session.encode()) % workers
+
+
+def read_log(path, index, workers):
+    """
+    Yields the records of the log that belong to the given worker.
+    Requests without a session are spread by their line number, and so
+    are malformed lines, which are yielded as None.
+    """
+    with open(path, encoding='utf-8') as log:
+        for line_num, line in enumerate(log):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                if line_num % workers == index:
+                    logger.warning('Skipping malformed line %d of %s', line_num + 1, path)
+                    yield None
+                continue
+            session = record.get('session')
+            owner = partition(str(session), workers) if session else line_num % workers
+            if owner == index:
+                yield record
+
+
+def build_environ(record, cookies, host):
+    """
+    Builds the WSGI environ of a recorded request sent with the given
+    cookies.
+    """
+    from django.conf import settings
+
+    path, _, query = record['path'].partition('?')
+    body = record.get('body') or b''
+    if isinstance(body, dict):
+        body = urlencode(body, doseq=True)
+    if isinstance(body, str):
+        body = body.encode()
+    content_type = record.get('content_type') or ('application/x-www-form-urlencoded' if body else '')
+
+    environ = {
+        'REQUEST_METHOD': record.get('method', 'GET').upper(),
+        'PATH_INFO': unquote_to_bytes(path).decode('iso-8859-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': host,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if cookies:
+        environ['HTTP_COOKIE'] = '; '.join(f'{name}={value}' for name, value in cookies.items())
+    # A browser sends back the CSRF cookie of an earlier page as a header.
+    csrf_token = cookies.get(settings.CSRF_COOKIE_NAME)
+    if csrf_token:
+        environ['HTTP_X_CSRFTOKEN'] = csrf_token
+    return environ
+
+
+def update_cookies(cookies, headers):
+    for name, value in headers:
+        if name.lower() != 'set-cookie':
+            continue
+        for morsel in SimpleCookie(value).values():
+            if morsel['max-age'] == '0':
+                cookies.pop(morsel.key, None)
+            else:
+                cookies[morsel.key] = morsel.value
+
+
+class WorkerResult:
+    """
+    What one worker measured: the latency of every request in
+    milliseconds, the number of responses of each status and the number
+    of malformed log lines it skipped.
+    """
+
+    def __init__(self):
+        self.latencies = array('d')
+        self.statuses = Counter()
+        self.failures = 0
+        self.skipped = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.statuses.update(other.statuses)
+        self.failures += other.failures
+        self.skipped += other.skipped
+
+
+def replay_partition(path, index, workers, host=DEFAULT_HOST):
+    """
+    Replays the sessions of one worker in log order.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bigcorp.settings')
+    from django.conf import settings
+    from django.middleware.csrf import _get_new_csrf_string
+
+    from bigcorp.wsgi import application
+
+    result = WorkerResult()
+    jars = {}
+    for record in read_log(path, index, workers):
+        if record is None:
+            result.skipped += 1
+            continue
+        session = record.get('session')
+        cookies = jars.setdefault(session, {}) if session else {}
+        cookies.setdefault(settings.CSRF_COOKIE_NAME, _get_new_csrf_string())
+        environ = build_environ(record, cookies, host)
+        response_status = []
+
+        def start_response(status, headers, exc_info=None):
+            response_status.append(int(status.split(' ', 1)[0]))
+            update_cookies(cookies, headers)
+
+        started = time.perf_counter()
+        try:
+            response = application(environ, start_response)
+            try:
+                for _ in response:
+                    pass
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        except Exception:
+            result.failures += 1
+            continue
+        result.latencies.append((time.perf_counter() - started) * 1000)
+        result.statuses[response_status[0]] += 1
+    return result
+
+
+def _replay_worker(path, index, workers, host):
+    from django.db import connections
+
+    try:
+        return replay_partition(path, index, workers, host)
+    finally:
+        connections.close_all()
+
+
+def replay(path, concurrency=1, mode='threads', host=DEFAULT_HOST):
+    """
+    Replays the whole log with ``concurrency`` workers, which are
+    threads or processes.
+
+    Returns:
+        tuple: The merged WorkerResult and the elapsed seconds.
+    """
+    executor = ThreadPoolExecutor
+    if mode == 'processes':
+        from django.db import connections
+
+        # Forked workers must not inherit the connections of this process.
+        connections.close_all()
+        executor = ProcessPoolExecutor
+    result = WorkerResult()
+    started = time.perf_counter()
+    with executor(max_workers=concurrency) as pool:
+        futures = [pool.submit(_replay_worker, path, index, concurrency, host) for index in range(concurrency)]
+        for future in futures:
+            result.merge(future.result())
+    return result, time.perf_counter() - started
+
+
+def summarize(result, elapsed):
+    """
+    Returns the throughput, latency percentiles, latency histogram,
+    error rates and skipped log lines of a replay as a JSON-serializable
+    dict.
+    """
+    latencies = sorted(result.latencies)
+    total = len(latencies) + result.failures
+
+    def percentile(fraction):
+        return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)], 3) if latencies else None
+
+    histogram, previous = {}, 0
+    for bound in HISTOGRAM_BUCKETS_MS:
+        upto = bisect.bisect_right(latencies, bound)
+        histogram[f'<={bound}ms'] = upto - previous
+        previous = upto
+    histogram[f'>{HISTOGRAM_BUCKETS_MS[-1]}ms'] = len(latencies) - previous
+
+    server_errors = sum(count for status, count in result.statuses.items() if status >= 500)
+    client_errors = sum(count for status, count in result.statuses.items() if 400 <= status < 500)
+    return {
+        'requests': total,
+        'skipped_lines': result.skipped,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'mean': round(statistics.fmean(latencies), 3) if latencies else None,
+        },
+        'histogram': histogram,
+        'statuses': {str(status): count for status, count in sorted(result.statuses.items())},
+        'error_rate': {
+            '5xx': round(server_errors / total, 4) if total else 0,
+            '4xx': round(client_errors / total, 4) if total else 0,
+            'failures': round(result.failures / total, 4) if total else 0,
+        },
+    }
+
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 
@@ -25,22 +26,30 @@ INSTALLED_APPS = [
     'django_email_verification',
 
     #MY_APPS
+    'bigcorp.apps.BigcorpConfig',
     'shop.apps.ShopConfig',
     'cart.apps.CartConfig',
     'account.apps.AccountConfig',
 ]
 
 MIDDLEWARE = [
+    'bigcorp.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bigcorp.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'bigcorp.urls'
+# asgi.py sets BIGCORP_ASYNC_VIEWS so that ASGI servers route the catalog
+# and the cart to their async views; WSGI keeps the sync ones.
+if os.environ.get('BIGCORP_ASYNC_VIEWS') == '1':
+    ROOT_URLCONF = 'bigcorp.urls_async'
+else:
+    ROOT_URLCONF = 'bigcorp.urls'
 
 TEMPLATES = [
     {
@@ -57,6 +66,7 @@ TEMPLATES = [
                 # MY_CONTEXT_PROCESSORS
                 'shop.context_processors.categories',
                 'cart.context_processors.cart',
+                'shop.context_processors.page_cache_holes',
 
             ],
         },
@@ -68,12 +78,35 @@ WSGI_APPLICATION = 'bigcorp.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # Benchmarks point this at a separate database, see generate_catalog.
+        'NAME': os.environ.get('BIGCORP_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+
+# CACHE
+# Cache invalidation relies on version counters that every worker has to
+# see, so deployments with more than one process must point REDIS_URL at
+# a shared Redis. The local-memory cache is only suitable for a single
+# development process.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'bigcorp',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bigcorp',
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -107,6 +140,36 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 
 
+TEST_RUNNER = 'bigcorp.test_runner.TestRunner'
+
+
 # CUSTOM SETTINGS
+# Scheme and host used for absolute URLs written outside of a request,
+# such as the sitemap files.
+SITE_URL = os.environ.get('SITE_URL', 'http://127.0.0.1:8000')
+
+# REQUEST METRICS
+# Most SQL queries a request to each view may run, see bigcorp.metrics.
+QUERY_BUDGETS = {
+    'shop:products': 5,
+    'shop:search': 3,
+    'shop:product_detail': 3,
+    'shop:category_list': 4,
+    'cart:cart-view': 7,
+    'cart:add-to-cart': 12,
+    'cart:update-to-cart': 10,
+    'cart:delete-to-cart': 9,
+    'cart:batch-cart': 5,
+}
+QUERY_BUDGETS_STRICT = False
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# REQUEST PROFILING
+# Requests profiled on demand, see bigcorp.profiling.
+PROFILING_DIR = os.environ.get('BIGCORP_PROFILING_DIR', BASE_DIR / 'profiles')
+PROFILING_KEEP = 50
+PROFILING_SAMPLE_INTERVAL = 0.002
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
@@ -0,0 +1,29 @@
+"""
+Test runner of the project, set as ``TEST_RUNNER``.
+"""
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with a temporary ``MEDIA_ROOT``, so the images,
+    renditions and imported files they write never land in the media
+    directory of the project, and with strict query budgets, so every
+    request made through the test client must stay within the budget of
+    its view (see ``QUERY_BUDGETS``).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._media_root = tempfile.TemporaryDirectory(prefix='bigcorp-test-media-')
+        self._test_settings = override_settings(
+            MEDIA_ROOT=self._media_root.name, QUERY_BUDGETS_STRICT=True)
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        self._media_root.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -3,14 +3,32 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('shop/', include('shop.urls', namespace = 'shop')),
-    path('cart/', include('cart.urls', namespace = 'cart')),
-    path('account/', include('account.urls', namespace = 'account')),
-]
+from shop.views import sitemap_view
 
-if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root = settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root = settings.MEDIA_ROOT)
-    
\ No newline at end of file
+from .metrics import metrics_view
+from .profiling import profile_download_view, profiles_view
+
+def build_urlpatterns(shop_urls='shop.urls', cart_urls='cart.urls'):
+    """
+    Returns the project routes with the shop and cart apps included from
+    the given URLconfs, so the ASGI URLconf only swaps those two.
+    """
+    patterns = [
+        path('admin/profiles/', admin.site.admin_view(profiles_view), name='admin-profiles'),
+        path('admin/profiles/<str:name>/', admin.site.admin_view(profile_download_view), name='admin-profile-download'),
+        path('admin/', admin.site.urls),
+        path('shop/', include(shop_urls, namespace = 'shop')),
+        path('cart/', include(cart_urls, namespace = 'cart')),
+        path('account/', include('account.urls', namespace = 'account')),
+        path('sitemap.xml', sitemap_view, name='sitemap'),
+        path('sitemaps/<slug:name>.xml', sitemap_view, name='sitemap-chunk'),
+        path('metrics', metrics_view, name='metrics'),
+    ]
+
+    if settings.DEBUG:
+        patterns += static(settings.STATIC_URL, document_root = settings.STATIC_ROOT)
+        patterns += static(settings.MEDIA_URL, document_root = settings.MEDIA_ROOT)
+    return patterns
+
+
+urlpatterns = build_urlpatterns()
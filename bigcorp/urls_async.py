@@ -0,0 +1,8 @@
+"""
+URL configuration served under ASGI: the same routes as bigcorp.urls,
+with the catalog and cart backed by their async views.
+"""
+from .urls import build_urlpatterns
+
+
+urlpatterns = build_urlpatterns(shop_urls='shop.async_urls', cart_urls='cart.async_urls')
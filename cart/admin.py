@@ -1,3 +1,17 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import CartItem, UserCart
+
+
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    raw_id_fields = ('product',)
+    extra = 0
+
+
+@admin.register(UserCart)
+class UserCartAdmin(admin.ModelAdmin):
+    list_display = ('user', 'quantity', 'total', 'updated_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    inlines = (CartItemInline,)
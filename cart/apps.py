@@ -6,3 +6,11 @@ class CartConfig(AppConfig):
     name = 'cart'
     verbose_name = 'Корзина'
     verbose_name_plural = 'Корзины'
+
+    def ready(self):
+        from shop.page_cache import register_hole
+
+        from . import signals  # noqa: F401
+        from .cart import Cart
+
+        register_hole('cart_quantity', lambda request: len(Cart(request)))
@@ -0,0 +1,8 @@
+"""
+The routes of cart.urls served by the async views.
+"""
+from . import async_views
+from .urls import app_name, build_urlpatterns  # noqa: F401
+
+
+urlpatterns = build_urlpatterns(async_views)
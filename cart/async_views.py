@@ -0,0 +1,104 @@
+"""
+Async versions of the cart views, served under ASGI.
+
+Carts are created with Cart.acreate(), which resolves the session and
+the user in one thread hop and then uses the async ORM.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import render
+
+from .cart import Cart
+from .views import INVALID_LINE_ERROR, INVALID_PRODUCT_ERROR, _parse_batch, _posted_line, _repriced_json
+
+
+async def cart_view(request):
+    """
+    Async version of cart.views.cart_view. The products are hydrated
+    up front, so the template only reads memoized data.
+    """
+    cart = await Cart.acreate(request)
+    repriced = await cart.arefresh_prices()
+    return await sync_to_async(render)(request, 'cart/cart-view.html', {'cart': cart, 'repriced': repriced})
+
+
+async def cart_add(request):
+    """
+    Async version of cart.views.cart_add.
+    """
+    cart = await Cart.acreate(request)
+
+    if request.POST.get('action') == 'post':
+        line = _posted_line(request)
+        if line is None:
+            return JsonResponse({'errors': [INVALID_LINE_ERROR]}, status=400)
+        product_id, product_quantity = line
+
+        product = await cart.aget_product(product_id)
+        if product is None:
+            raise Http404('No product matches the given query.')
+
+        repriced = await cart.arefresh_price(product_id)
+        await cart.aapply([('add', product.id, product_quantity, product)])
+
+        return JsonResponse({'quantity': len(cart), 'product': product.title, 'repriced': _repriced_json(repriced)})
+
+
+async def cart_delete(request):
+    """
+    Async version of cart.views.cart_delete.
+    """
+    cart = await Cart.acreate(request)
+
+    if request.POST.get('action') == 'post':
+        line = _posted_line(request, with_quantity=False)
+        if line is None:
+            return JsonResponse({'errors': [INVALID_PRODUCT_ERROR]}, status=400)
+        product_id, _ = line
+
+        await cart.adelete(product=product_id)
+
+        return JsonResponse({'quantity': len(cart), 'total': cart.get_total_price(), 'repriced': []})
+
+
+async def cart_update(request):
+    """
+    Async version of cart.views.cart_update.
+    """
+    cart = await Cart.acreate(request)
+
+    if request.POST.get('action') == 'post':
+        line = _posted_line(request)
+        if line is None:
+            return JsonResponse({'errors': [INVALID_LINE_ERROR]}, status=400)
+        product_id, product_quantity = line
+
+        await cart.aupdate(product=product_id, quantity=product_quantity)
+        repriced = await cart.arefresh_price(product_id)
+
+        return JsonResponse({
+            'quantity': len(cart), 'total': cart.get_total_price(), 'repriced': _repriced_json(repriced)})
+
+
+async def cart_batch(request):
+    """
+    Async version of cart.views.cart_batch. The method is checked here
+    because ``require_POST`` does not support async views in Django 4.2.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    parsed, errors = _parse_batch(request.body)
+
+    cart = await Cart.acreate(request)
+    added_ids = {product_id for op, product_id, quantity in parsed if op == 'add'}
+    products = await cart.aget_products(added_ids)
+    errors += [f'Product {product_id} is not available.' for product_id in sorted(added_ids - products.keys())]
+
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    await cart.aapply([(op, product_id, quantity, products.get(product_id)) for op, product_id, quantity in parsed])
+    repriced = await cart.arefresh_prices()
+
+    return JsonResponse({'quantity': len(cart), 'total': cart.get_total_price(), 'repriced': _repriced_json(repriced)})
@@ -1,7 +1,62 @@
 from decimal import Decimal
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
 
 from shop.models import ProductProxy
 
+from .stores import (  # noqa: F401
+    CART_SESSION_KEY,
+    CART_SUMMARY_SESSION_KEY,
+    DatabaseCartStore,
+    SessionCartStore,
+    from_minor_units,
+    to_minor_units,
+)
+
+
+QUANTITY, PRICE, PRICE_VERSION = 0, 1, 2
+
+CART_PRODUCT_FIELDS = ('id', 'title', 'slug', 'price', 'price_version', 'image', 'renditions')
+
+
+class CartLine(NamedTuple):
+    """
+    An immutable view of one cart item joined with its product.
+    """
+    product: ProductProxy
+    quantity: int
+    price: Decimal
+    total_price: Decimal
+
+
+class CartRepricing(NamedTuple):
+    """
+    A cart line whose price was updated to the current product price.
+    """
+    product: ProductProxy
+    old_price: Decimal
+    new_price: Decimal
+
+    def as_dict(self):
+        return {
+            'product_id': self.product.id,
+            'title': self.product.title,
+            'old_price': self.old_price,
+            'new_price': self.new_price,
+        }
+
+
+def _resolve_request_state(request):
+    """
+    Loads the session and the user of the request, which Django 4.2 can
+    only do synchronously.
+    """
+    request.session.items()
+    user = getattr(request, 'user', None)
+    if user is not None:
+        user.is_authenticated
+
 
 class Cart:
 
@@ -9,71 +64,206 @@ class Cart:
         """
         Initializes a new instance of the Cart class.
 
-        Initializes the session attribute with the session object
-        from the request. Retrieves the value of the "session_key" key 
-        from the session object. If the value is None, sets the 
-        "session_key" key in the session object to an empty dictionary.
-        Assigns the retrieved or created cart dictionary to the cart 
-        attribute.
+        The cart of an authenticated user is kept in the database, the
+        cart of an anonymous visitor in their session under the
+        "session_key" key. Nothing is written for visitors who never
+        add anything, so they do not get a session saved.
+
+        Every item is stored compactly as ``[quantity, price,
+        price_version]`` with the price in integer minor units and the
+        price version of the product it was captured from, and the cart
+        keeps its total count and price in ``self.quantity`` and
+        ``self.total``, which are maintained incrementally by every
+        mutation. The items themselves are only loaded once they are
+        needed, so the badge is rendered from the summary alone.
+        """
+        self._bind(request)
+        self._set_summary(self.store.load_summary())
+
+
+    @classmethod
+    async def acreate(cls, request):
+        """
+        Creates a Cart from an async view.
+
+        Django 4.2 has no async session or user API, so both are resolved
+        with a single thread hop. Everything after that, including the
+        queries of the database store, uses the async ORM. Use the
+        ``a``-prefixed methods on a cart created this way.
         """
+        await sync_to_async(_resolve_request_state)(request)
+        cart = cls.__new__(cls)
+        cart._bind(request)
+        summary = await cart.store.aload_summary()
+        if summary is None:
+            await cart._aload_items()
+        cart._set_summary(summary)
+        return cart
 
+
+    def _bind(self, request):
         self.session = request.session
+        self._products = request.__dict__.setdefault('_cart_products', {})
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            self.store = DatabaseCartStore(user)
+        else:
+            self.store = SessionCartStore(self.session)
+
+        self._items = None
+        self._changed = set()
+
 
-        cart = self.session.get("session_key")
+    def _set_summary(self, summary):
+        if summary is not None:
+            self.quantity, self.total = summary
+        else:
+            self.quantity = sum(item[QUANTITY] for item in self.cart.values())
+            self.total = sum(item[QUANTITY] * item[PRICE] for item in self.cart.values())
+
+
+    @property
+    def cart(self):
+        """
+        Returns the items of the cart, loading them from the store on
+        first access.
+        """
+        if self._items is None:
+            self._items = self.store.load_items()
+        return self._items
 
-        if not cart:
-            cart = self.session["session_key"] = {}
 
-        self.cart = cart
+    async def _aload_items(self):
+        if self._items is None:
+            self._items = await self.store.aload_items()
+        return self._items
 
 
     def __len__(self):
         """
-        Calculates the total count of items in the cart based on the 
-        quantity of each item.
-        Returns the total count as an integer.
+        Returns the total count of items in the cart.
+
+        The count is maintained incrementally, so rendering the badge
+        never iterates the cart.
+        """
+        return self.quantity
+
+
+    def _save(self):
         """
-        return sum(item["quantity"] for item in self.cart.values())
+        Writes the changed items and the summary back to the store. The
+        session store removes both once the cart is empty. The database
+        store returns the totals it recomputed, which also count changes
+        made meanwhile by another request.
+        """
+        self._saved(self.store.save(self.cart, [self.quantity, self.total], self._changed))
+
+
+    async def _asave(self):
+        self._saved(await self.store.asave(self.cart, [self.quantity, self.total], self._changed))
+
+
+    def _saved(self, summary):
+        if summary is not None:
+            self.quantity, self.total = summary
+        self._changed = set()
+
+
+    def _set(self, product_id, quantity, price, price_version):
+        """
+        Stores an item and moves the totals by the difference from its
+        previous state.
+        """
+        old_quantity, old_price, _ = self.cart.get(product_id, (0, 0, 0))
+        self.quantity += quantity - old_quantity
+        self.total += quantity * price - old_quantity * old_price
+        self.cart[product_id] = [quantity, price, price_version]
+        self._changed.add(product_id)
+
+
+    def _hydrate(self, extra_ids=()):
+        """
+        Returns the products of the cart keyed by their string ids.
+
+        Products are memoized on the request, so however many times and
+        through however many Cart instances the cart is iterated, each
+        product is fetched at most once, with a single query restricted
+        to the columns the cart needs. ``extra_ids`` are fetched in the
+        same query.
+        """
+        return self._load_products([*self.cart, *(str(product_id) for product_id in extra_ids)])
+
+
+    async def _ahydrate(self, extra_ids=()):
+        await self._aload_items()
+        return await self._aload_products([*self.cart, *(str(product_id) for product_id in extra_ids)])
+
+
+    def _load_products(self, product_ids):
+        """
+        Fetches the given products that are not memoized yet with one
+        query and returns the memo.
+        """
+        missing = self._missing_products(product_ids)
+        if missing:
+            self._remember_products(missing, self._products_query(missing))
+        return self._products
+
+
+    async def _aload_products(self, product_ids):
+        missing = self._missing_products(product_ids)
+        if missing:
+            self._remember_products(missing, [product async for product in self._products_query(missing)])
+        return self._products
+
+
+    def _missing_products(self, product_ids):
+        return [product_id for product_id in product_ids if product_id not in self._products]
+
+
+    def _products_query(self, product_ids):
+        return ProductProxy.objects.filter(id__in=product_ids).only(*CART_PRODUCT_FIELDS)
+
+
+    def _remember_products(self, product_ids, products):
+        for product in products:
+            self._products[str(product.id)] = product
+        for product_id in product_ids:
+            self._products.setdefault(product_id, None)
 
 
     def __iter__(self):
         """
-        Iterates over the items in the cart and yields a dictionary for each item.
-        
+        Iterates over the items in the cart and yields a line for each item.
+
+        The session payload is only read, never modified, so viewing the
+        cart does not make the session dirty. Items whose product is no
+        longer available are skipped.
+
         Yields:
-            dict: A dictionary containing information about each item in the cart.
-                The dictionary has the following keys:
+            CartLine: An immutable line with the following attributes:
                 - 'product' (ProductProxy): The product object associated with the item.
-                - 'price' (Decimal): The price of the item.
                 - 'quantity' (int): The quantity of the item.
+                - 'price' (Decimal): The price of the item.
                 - 'total_price' (Decimal): The total price of the item (price * quantity).
         """
-        product_ids = self.cart.keys()
-        products = ProductProxy.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-
-        for product in products:
-            cart[str(product.id)]["product"] = product
+        products = self._hydrate()
 
-        for item in cart.values():
-            item["price"] = Decimal(item["price"])
-            item["total_price"] = item["price"] * item["quantity"]
-            yield item
+        for product_id, (quantity, price, _) in self.cart.items():
+            product = products.get(product_id)
+            if product is not None:
+                yield CartLine(product, quantity, from_minor_units(price), from_minor_units(price * quantity))
 
 
 
     def add(self, product, quantity):
         """
-        Adds a product to the cart.
+        Adds a product to the cart, or sets its quantity when it is
+        already there. The current price and price version of the
+        product are captured at the time of adding.
         """
-        product_id = str(product.id)
-
-        if product_id not in self.cart:
-            self.cart[product_id] = {"quantity": quantity, "price": str(product.price)}
-
-        self.cart[product_id]['quantity'] = quantity
-
-        self.session.modified = True 
+        self.apply([('add', product.id, quantity, product)])
 
 
     def delete(self, product):
@@ -81,25 +271,17 @@ class Cart:
         Deletes a product from the cart.
 
         Args:
-            product (ProductProxy): The product to be deleted.
-            quantity (int): The quantity of the product to be deleted.
-
-        This function deletes a product from the cart by removing 
-        it from the `self.cart` dictionary. It first converts the `product.id` to a string and checks if it 
-        exists in the `self.cart` dictionary. If it does, the product 
-        is deleted from the dictionary and the `self.session.modified` 
-        flag is set to True.
-
-        Note: This function assumes that the `self.cart` dictionary 
-        is a dictionary where the keys are strings representing the 
-        product IDs and the values are dictionaries containing the 
-        quantity and price of the product.
+            product (int): The id of the product to be deleted.
+
+        This function deletes a product from the cart by removing
+        it from the `self.cart` dictionary. It first converts the product id to a string and checks if it
+        exists in the `self.cart` dictionary. If it does, its quantity
+        and price are subtracted from the totals, the product is
+        deleted from the dictionary and the cart is saved back to the
+        session together with its summary.
         """
-        product_id = str(product)
-
-        if product_id in self.cart:
-            del self.cart[product_id]
-            self.session.modified = True
+        if str(product) in self.cart:
+            self.apply([('delete', product, 0, None)])
 
 
     def update(self, product, quantity):
@@ -111,31 +293,192 @@ class Cart:
             quantity: The new quantity of the product.
 
         This function updates the quantity of a product in the cart.
-        It first converts the product ID to a string and then checks 
-        if the product exists in the cart. If it does, the quantity 
-        of the product is updated, and the session modification flag 
-        is set to True.
+        It first converts the product ID to a string and then checks
+        if the product exists in the cart. If it does, the quantity
+        of the product is updated together with the totals, and the
+        cart is saved back to the session with its summary.
         """
 
-        product_id = str(product)
+        if str(product) in self.cart:
+            self.apply([('update', product, quantity, None)])
 
-        if product_id in self.cart:
-            self.cart[product_id]["quantity"] = quantity
-            self.session.modified = True
 
+    async def adelete(self, product):
+        """
+        Async version of delete().
+        """
+        if str(product) in await self._aload_items():
+            await self.aapply([('delete', product, 0, None)])
 
 
+    async def aupdate(self, product, quantity):
+        """
+        Async version of update().
+        """
+        if str(product) in await self._aload_items():
+            await self.aapply([('update', product, quantity, None)])
 
-    def get_total_price(self):
+
+
+
+    def apply(self, operations):
+        """
+        Applies a list of already validated operations and saves the
+        cart once.
+
+        Args:
+            operations: ``(op, product_id, quantity, product)`` tuples,
+                where ``op`` is 'add', 'update' or 'delete' and
+                ``product`` is only required for 'add'.
         """
-        Calculates and returns the total price of all items in the cart.
+        self._apply_operations(operations)
+        self._save()
+
+
+    async def aapply(self, operations):
+        """
+        Async version of apply().
+        """
+        await self._aload_items()
+        self._apply_operations(operations)
+        await self._asave()
+
+
+    def _apply_operations(self, operations):
+        for op, product_id, quantity, product in operations:
+            product_id = str(product_id)
+            if op == 'add':
+                self._set(product_id, quantity, to_minor_units(product.price), product.price_version)
+                self._products.setdefault(product_id, product)
+            elif product_id not in self.cart:
+                continue
+            elif op == 'update':
+                self._set(product_id, quantity, self.cart[product_id][PRICE], self.cart[product_id][PRICE_VERSION])
+            else:
+                self._set(product_id, 0, 0, 0)
+                del self.cart[product_id]
+
+
+    def get_products(self, product_ids):
+        """
+        Returns the available products with the given ids keyed by their
+        integer ids, loading them in the same single query that hydrates
+        the cart lines.
+        """
+        return self._select_products(self._hydrate(product_ids), product_ids)
+
+
+    async def aget_products(self, product_ids):
+        """
+        Async version of get_products().
+        """
+        return self._select_products(await self._ahydrate(product_ids), product_ids)
+
+
+    def get_product(self, product_id):
+        """
+        Returns the available product with the given id, or None. Only
+        that product is fetched, so the cost does not grow with the cart.
+        """
+        return self._load_products([str(product_id)]).get(str(product_id))
+
+
+    async def aget_product(self, product_id):
+        """
+        Async version of get_product().
+        """
+        return (await self._aload_products([str(product_id)])).get(str(product_id))
+
+
+    def _select_products(self, products, product_ids):
+        return {
+            product_id: products[str(product_id)]
+            for product_id in product_ids if products.get(str(product_id)) is not None
+        }
+
+
+    def refresh_prices(self):
+        """
+        Re-prices the lines whose product price changed since they were
+        added.
+
+        The price version of every line is compared with the version of
+        its hydrated product, so all lines are checked with at most one
+        query, shared with iterating the cart. Only stale lines are
+        rewritten and the cart is saved only when one was found.
+
+        Returns:
+            list: A CartRepricing for every line whose price changed.
+        """
+        changes = self._reprice(self._hydrate())
+        if self._changed:
+            self._save()
+        return changes
+
+
+    async def arefresh_prices(self):
+        """
+        Async version of refresh_prices().
+        """
+        changes = self._reprice(await self._ahydrate())
+        if self._changed:
+            await self._asave()
+        return changes
+
+
+    def refresh_price(self, product_id):
+        """
+        Re-prices the line of one product if its price changed, fetching
+        only that product. The AJAX views check just the line they touch
+        this way and leave the rest of the cart to the cart page.
 
         Returns:
-            Decimal: The total price of all items in the cart.
+            list: A CartRepricing if the line was re-priced.
+        """
+        product_id = str(product_id)
+        if product_id not in self.cart:
+            return []
+        changes = self._reprice(self._load_products([product_id]), [product_id])
+        if self._changed:
+            self._save()
+        return changes
+
+
+    async def arefresh_price(self, product_id):
         """
-        return sum(
-            Decimal(item['price']) * item['quantity'] 
-            for item in self.cart.values())
+        Async version of refresh_price().
+        """
+        product_id = str(product_id)
+        if product_id not in await self._aload_items():
+            return []
+        changes = self._reprice(await self._aload_products([product_id]), [product_id])
+        if self._changed:
+            await self._asave()
+        return changes
+
 
+    def _reprice(self, products, product_ids=None):
+        changes = []
+        for product_id in list(self.cart if product_ids is None else product_ids):
+            quantity, price, price_version = self.cart[product_id]
+            product = products.get(product_id)
+            if product is None or product.price_version == price_version:
+                continue
+            new_price = to_minor_units(product.price)
+            self._set(product_id, quantity, new_price, product.price_version)
+            if new_price != price:
+                changes.append(CartRepricing(product, from_minor_units(price), from_minor_units(new_price)))
+        return changes
 
-            
\ No newline at end of file
+
+
+
+    def get_total_price(self):
+        """
+        Returns the total price of all items in the cart.
+
+        Returns:
+            Decimal: The total price of all items in the cart, read
+            from the incrementally maintained total.
+        """
+        return from_minor_units(self.total)
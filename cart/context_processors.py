@@ -1,13 +1,16 @@
+from django.utils.functional import SimpleLazyObject
+
 from .cart import Cart
 
 
 def cart(request):
     """
-    Initializes and returns a dictionary containing a Cart object.
+    Returns a dictionary containing a lazily created Cart object.
 
     Returns:
-        dict: A dictionary with a single key-value pair. 
-        The key is 'cart' and the value is a Cart object initialized 
-        with the given request.
+        dict: The key 'cart' holds a Cart object that is only
+        initialized with the given request when a template uses it,
+        and 'cart_quantity' its item count for the badge.
     """
-    return{'cart': Cart(request)}
\ No newline at end of file
+    cart = SimpleLazyObject(lambda: Cart(request))
+    return {'cart': cart, 'cart_quantity': SimpleLazyObject(lambda: len(cart))}
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from shop.models import ProductProxy
+
+
+# Every virtual customer repeats this add, update, delete cycle, so the
+# cart is empty again at the end of each cycle.
+CART_CYCLE = (
+    ('cart:add-to-cart', {'product_quantity': 1}),
+    ('cart:update-to-cart', {'product_quantity': 2}),
+    ('cart:delete-to-cart', {}),
+)
+
+
+def _percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the throughput of the cart AJAX endpoints served by the sync views '
+        'through WSGI and by the async views through ASGI at the same concurrency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=100, help='Number of simultaneous customers.')
+        parser.add_argument('--cycles', type=int, default=10, help='Add, update, delete cycles per customer.')
+        parser.add_argument('--product', type=int, default=None, help='Id of the product to put in the carts.')
+        parser.add_argument('--only', choices=('wsgi', 'asgi'), default=None)
+
+    def handle(self, *args, **options):
+        products = ProductProxy.objects.order_by('pk')
+        if options['product'] is not None:
+            products = products.filter(pk=options['product'])
+        product_id = products.values_list('pk', flat=True).first()
+        if product_id is None:
+            raise CommandError('There is no product to put in the carts.')
+
+        steps = [
+            (reverse(name), {'action': 'post', 'product_id': product_id, **data})
+            for name, data in CART_CYCLE
+        ] * options['cycles']
+
+        # The test clients send requests to the 'testserver' host.
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            if options['only'] != 'asgi':
+                self.report('WSGI', *self.run_wsgi(steps, options['concurrency']))
+            if options['only'] != 'wsgi':
+                self.report('ASGI', *self.run_asgi(steps, options['concurrency']))
+
+    def run_wsgi(self, steps, concurrency):
+        """
+        Runs every customer in its own thread against the sync views, as
+        a threaded WSGI server would.
+        """
+        def customer():
+            client = Client(raise_request_exception=False)
+            latencies, errors = [], 0
+            try:
+                for path, data in steps:
+                    started = time.perf_counter()
+                    response = client.post(path, data)
+                    latencies.append(time.perf_counter() - started)
+                    errors += response.status_code != 200
+            finally:
+                connections.close_all()
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: customer(), range(concurrency)))
+        return results, time.perf_counter() - started
+
+    def run_asgi(self, steps, concurrency):
+        """
+        Runs every customer as a task on one event loop against the async
+        views, as an ASGI server would.
+        """
+        async def customer():
+            client = AsyncClient(raise_request_exception=False)
+            latencies, errors = [], 0
+            for path, data in steps:
+                started = time.perf_counter()
+                response = await client.post(path, data)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+            return latencies, errors
+
+        async def run():
+            return await asyncio.gather(*(customer() for _ in range(concurrency)))
+
+        with override_settings(ROOT_URLCONF='bigcorp.urls_async'):
+            started = time.perf_counter()
+            results = asyncio.run(run())
+            elapsed = time.perf_counter() - started
+        connections.close_all()
+        return results, elapsed
+
+    def report(self, label, results, elapsed):
+        latencies = sorted(latency for customer_latencies, _ in results for latency in customer_latencies)
+        errors = sum(customer_errors for _, customer_errors in results)
+        self.stdout.write(
+            f'{label}: {len(latencies)} requests in {elapsed:.2f}s, '
+            f'{len(latencies) / elapsed:.1f} req/s, '
+            f'p50 {_percentile(latencies, 0.5) * 1000:.1f}ms, '
+            f'p99 {_percentile(latencies, 0.99) * 1000:.1f}ms, '
+            f'{errors} errors'
+        )
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='price_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версия цены'),
+        ),
+    ]
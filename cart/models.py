@@ -1,3 +1,49 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class UserCart(models.Model):
+    """
+    The persistent cart of an authenticated user.
+
+    The totals are kept next to the items so the cart badge can be
+    rendered from this single row.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart', verbose_name='Пользователь'
+    )
+    quantity = models.PositiveIntegerField('Количество', default=0)
+    total = models.BigIntegerField('Сумма, коп.', default=0)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Корзина пользователя'
+        verbose_name_plural = 'Корзины пользователей'
+
+    def __str__(self):
+        return f'{self.user}: {self.quantity}'
+
+
+class CartItem(models.Model):
+    """
+    One product line of a persistent cart. The price is captured in
+    minor units together with the product's price version when the
+    product is added.
+    """
+    cart = models.ForeignKey(UserCart, on_delete=models.CASCADE, related_name='items', verbose_name='Корзина')
+    product = models.ForeignKey(
+        'shop.Product', on_delete=models.CASCADE, related_name='+', verbose_name='Товар'
+    )
+    quantity = models.PositiveIntegerField('Количество')
+    price = models.BigIntegerField('Цена, коп.')
+    price_version = models.PositiveIntegerField('Версия цены', default=0)
+
+    class Meta:
+        verbose_name = 'Позиция корзины'
+        verbose_name_plural = 'Позиции корзины'
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='cart_item_cart_product_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} x {self.quantity}'
@@ -0,0 +1,19 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .stores import DatabaseCartStore, SessionCartStore
+
+
+@receiver(user_logged_in, dispatch_uid='cart_merge_on_login')
+def merge_session_cart(sender, request, user, **kwargs):
+    """
+    Moves the anonymous session cart into the user's persistent cart
+    and clears it from the session.
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    session_store = SessionCartStore(request.session)
+    items = session_store.load_items()
+    if items:
+        DatabaseCartStore(user).merge(items)
+        session_store.clear()
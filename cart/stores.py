@@ -0,0 +1,220 @@
+"""
+Storage backends of the cart.
+
+Both stores exchange the same compact representation with ``Cart``:
+items as ``{product_id (str): [quantity, price, price_version]}`` with
+prices in integer minor units, and a ``[quantity, total]`` summary.
+"""
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F, Sum
+
+from shop.models import Product
+
+from .models import CartItem, UserCart
+
+
+CART_SESSION_KEY = "session_key"
+CART_SUMMARY_SESSION_KEY = "cart_summary"
+
+
+def to_minor_units(amount):
+    """
+    Converts a price to an integer number of kopecks/cents.
+    """
+    return int((Decimal(str(amount)) * 100).to_integral_value())
+
+
+def from_minor_units(value):
+    """
+    Converts an integer number of kopecks/cents back to a Decimal price.
+    """
+    return Decimal(value).scaleb(-2)
+
+
+class SessionCartStore:
+    """
+    Keeps the cart of an anonymous visitor in their session.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def load_items(self):
+        """
+        Returns the items, converting legacy ``{"quantity", "price"}``
+        payloads and unversioned lines to the compact form. Converted
+        lines get price version 0, so they are re-priced on the next
+        check.
+        """
+        items = self.session.get(CART_SESSION_KEY) or {}
+        if any(isinstance(item, dict) for item in items.values()):
+            items = {
+                product_id: [item["quantity"], to_minor_units(item["price"]), 0]
+                for product_id, item in items.items()
+            }
+        elif any(len(item) < 3 for item in items.values()):
+            items = {product_id: [*item[:2], 0] for product_id, item in items.items()}
+        return items
+
+    def load_summary(self):
+        """
+        Returns the stored summary, or None when it has to be computed
+        from the items (legacy payloads have none).
+        """
+        summary = self.session.get(CART_SUMMARY_SESSION_KEY)
+        items = self.session.get(CART_SESSION_KEY) or {}
+        if not isinstance(summary, list) or any(isinstance(item, dict) for item in items.values()):
+            return None
+        return summary
+
+    def save(self, items, summary, changed):
+        if not items:
+            self.session.pop(CART_SESSION_KEY, None)
+            self.session.pop(CART_SUMMARY_SESSION_KEY, None)
+            return
+
+        self.session[CART_SESSION_KEY] = items
+        self.session[CART_SUMMARY_SESSION_KEY] = summary
+
+    def clear(self):
+        self.save({}, [0, 0], ())
+
+    # The session is resolved before a cart is created from an async view
+    # (see Cart.acreate), so these only touch the in-memory session data.
+
+    async def aload_items(self):
+        return self.load_items()
+
+    async def aload_summary(self):
+        return self.load_summary()
+
+    async def asave(self, items, summary, changed):
+        self.save(items, summary, changed)
+
+
+class DatabaseCartStore:
+    """
+    Keeps the cart of an authenticated user in UserCart and CartItem.
+
+    The summary comes from the UserCart row alone, so rendering the
+    badge costs one indexed lookup; the items are only read when the
+    cart is iterated or changed. The same lookup remembers the id of the
+    row, so writes do not look it up again.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._cart_id = None
+
+    def load_items(self):
+        return {
+            str(product_id): [quantity, price, price_version]
+            for product_id, quantity, price, price_version in CartItem.objects.filter(
+                cart__user=self.user).values_list('product_id', 'quantity', 'price', 'price_version')
+        }
+
+    def load_summary(self):
+        return self._summary(UserCart.objects.filter(user=self.user).values_list('id', 'quantity', 'total').first())
+
+    def _summary(self, row):
+        if row is None:
+            return [0, 0]
+        self._cart_id, quantity, total = row
+        return [quantity, total]
+
+    async def aload_items(self):
+        return {
+            str(product_id): [quantity, price, price_version]
+            async for product_id, quantity, price, price_version in CartItem.objects.filter(
+                cart__user=self.user).values_list('product_id', 'quantity', 'price', 'price_version')
+        }
+
+    async def aload_summary(self):
+        return self._summary(
+            await UserCart.objects.filter(user=self.user).values_list('id', 'quantity', 'total').afirst())
+
+    async def asave(self, items, summary, changed):
+        # Django 4.2 has no async transactions, so the write runs in a thread.
+        return await sync_to_async(self.save)(items, summary, changed)
+
+    def save(self, items, summary, changed):
+        """
+        Writes only the lines in ``changed``: present ones with a single
+        upsert, removed ones with a single delete.
+
+        The totals are recomputed from the stored lines in the same
+        transaction rather than taken from ``summary``, which was read
+        before the change, so carts edited from two devices at once do
+        not overwrite each other's totals.
+
+        Returns:
+            list: The ``[quantity, total]`` summary now stored.
+        """
+        with transaction.atomic():
+            cart = self._get_cart()
+
+            upserts, removed = [], []
+            for product_id in changed:
+                if product_id in items:
+                    quantity, price, price_version = items[product_id]
+                    upserts.append(CartItem(cart=cart, product_id=int(product_id), quantity=quantity,
+                                            price=price, price_version=price_version))
+                else:
+                    removed.append(int(product_id))
+
+            if upserts:
+                CartItem.objects.bulk_create(
+                    upserts, update_conflicts=True, unique_fields=['cart', 'product'],
+                    update_fields=['quantity', 'price', 'price_version'],
+                )
+            if removed:
+                CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+            return self._update_totals(cart)
+
+    def _get_cart(self):
+        if self._cart_id is None:
+            # Ignoring the conflict lets a concurrent first write of the
+            # same user win the insert instead of failing on the
+            # one-to-one constraint.
+            UserCart.objects.bulk_create([UserCart(user=self.user)], ignore_conflicts=True)
+            self._cart_id = UserCart.objects.filter(user=self.user).values_list('id', flat=True).get()
+        return UserCart(pk=self._cart_id, user=self.user)
+
+    def _update_totals(self, cart):
+        totals = CartItem.objects.filter(cart=cart).aggregate(
+            lines_quantity=Sum('quantity'), lines_total=Sum(F('quantity') * F('price')))
+        summary = [totals['lines_quantity'] or 0, totals['lines_total'] or 0]
+        UserCart.objects.filter(pk=cart.pk).update(quantity=summary[0], total=summary[1])
+        return summary
+
+    def merge(self, items):
+        """
+        Merges session cart items into the user's cart. Lines already in
+        the database take the session's quantity and price, since the
+        anonymous cart is the most recent one.
+
+        Runs a fixed number of queries however many lines are merged:
+        one check that the products still exist, one lookup or insert of
+        the cart, one bulk upsert of the lines and one aggregate plus one
+        update for the totals.
+        """
+        existing = set(Product.objects.filter(id__in=[int(product_id) for product_id in items]).values_list(
+            'id', flat=True))
+        items = {product_id: item for product_id, item in items.items() if int(product_id) in existing}
+        if not items:
+            return
+        with transaction.atomic():
+            cart, _ = UserCart.objects.get_or_create(user=self.user)
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart=cart, product_id=int(product_id), quantity=quantity, price=price,
+                             price_version=price_version)
+                    for product_id, (quantity, price, price_version) in items.items()
+                ],
+                update_conflicts=True, unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'price', 'price_version'],
+            )
+            self._update_totals(cart)
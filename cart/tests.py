@@ -1,17 +1,34 @@
+import io
 import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
 
-from django.test import Client, RequestFactory, TestCase
+from django.db import connection
+from django.test import AsyncRequestFactory, Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from bigcorp.replay import WorkerResult, read_log, replay, replay_partition, summarize
 from shop.models import Category, ProductProxy
 
+from . import async_views
+from .cart import Cart
+from .models import CartItem, UserCart
+from .stores import DatabaseCartStore
 from .views import cart_add, cart_delete, cart_update, cart_view
 
 
-
-
 class CartViewTest(TestCase):
 
     def setUp(self):
@@ -166,4 +183,483 @@ class CartUpdateViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.content)
         self.assertEqual(data['total'], '50.00')
-        self.assertEqual(data['quantity'], 5)
\ No newline at end of file
+        self.assertEqual(data['quantity'], 5)
+
+class CartSessionTestCase(TestCase):
+
+    def setUp(self):
+        """
+        Set up a category and a product to add to the cart and start
+        from an empty cache.
+        """
+        cache.clear()
+        self.category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(title='Example Product', price=10.0, category=self.category)
+
+    def test_anonymous_page_view_creates_no_session(self):
+        """
+        Test that browsing without a cart neither saves a session nor
+        sets a session cookie.
+        """
+        response = self.client.get(reverse('shop:products'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_badge_uses_cached_summary(self):
+        """
+        Test that the cart summary is kept in the session so the count
+        and total do not need the items.
+        """
+        self.client.post(reverse('cart:add-to-cart'), {
+            'action': 'post', 'product_id': self.product.id, 'product_quantity': 3})
+
+        session = self.client.session
+        self.assertEqual(session['cart_summary'], [3, 3000])
+        self.assertEqual(session['session_key'], {str(self.product.id): [3, 1000, 1]})
+
+        response = self.client.get(reverse('shop:products'))
+        self.assertEqual(len(response.context['cart']), 3)
+
+        self.client.post(reverse('cart:delete-to-cart'), {'action': 'post', 'product_id': self.product.id})
+        self.assertNotIn('cart_summary', self.client.session)
+
+    def test_totals_are_maintained_incrementally(self):
+        """
+        Test that add, update and delete move the totals without
+        re-reading the items, and that old session payloads still load.
+        """
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(request)
+        request.session['session_key'] = {
+            str(self.product.id): {'quantity': 2, 'price': '10.00'},
+            '999': {'quantity': 1, 'price': '0.99'},
+        }
+
+        cart = Cart(request)
+        self.assertEqual((len(cart), cart.get_total_price()), (3, Decimal('20.99')))
+
+        cart.update(product=self.product.id, quantity=5)
+        cart.delete(product=999)
+        self.assertEqual((len(cart), cart.get_total_price()), (5, Decimal('50.00')))
+
+        cart.cart.clear()
+        self.assertEqual((len(cart), cart.get_total_price()), (5, Decimal('50.00')))
+
+    def test_iteration_is_memoized_and_read_only(self):
+        """
+        Test that iterating the cart twice through two Cart instances
+        costs one query and leaves the session payload untouched.
+        """
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(request)
+        request.session['session_key'] = {str(self.product.id): [2, 1000]}
+        request.session['cart_summary'] = [2, 2000]
+        request.session.modified = False
+
+        with self.assertNumQueries(1):
+            lines = list(Cart(request))
+            list(Cart(request))
+
+        self.assertEqual(lines[0].product, self.product)
+        self.assertEqual(lines[0].total_price, Decimal('20.00'))
+        with self.assertRaises(AttributeError):
+            lines[0].quantity = 5
+        self.assertEqual(request.session['session_key'], {str(self.product.id): [2, 1000]})
+        self.assertFalse(request.session.modified)
+
+    def test_stale_lines_are_repriced(self):
+        """
+        Test that a price change bumps the product's price version and
+        that the cart re-prices only the stale line, in one query.
+        """
+        other = ProductProxy.objects.create(title='Other Product', price=4, category=self.category)
+        for product, quantity in ((self.product, 2), (other, 1)):
+            self.client.post(reverse('cart:add-to-cart'), {
+                'action': 'post', 'product_id': product.id, 'product_quantity': quantity})
+
+        self.product.price = Decimal('12.50')
+        self.product.save()
+        self.assertEqual(self.product.price_version, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart:cart-view'))
+        self.assertEqual(len([query for query in queries if 'shop_product' in query['sql']]), 1)
+
+        self.assertEqual(
+            [(change.product, change.old_price, change.new_price) for change in response.context['repriced']],
+            [(self.product, Decimal('10.00'), Decimal('12.50'))],
+        )
+        self.assertContains(response, 'Цены на некоторые товары изменились')
+        self.assertEqual(self.client.session['cart_summary'], [3, 2900])
+        self.assertEqual(self.client.session['session_key'][str(other.id)], [1, 400, 1])
+
+        response = self.client.post(reverse('cart:update-to-cart'), {
+            'action': 'post', 'product_id': other.id, 'product_quantity': 2})
+        self.assertEqual(json.loads(response.content), {'quantity': 4, 'total': '33.00', 'repriced': []})
+
+    def test_ajax_changes_reprice_only_their_line(self):
+        """
+        Test that the AJAX endpoints fetch and re-price only the product
+        they change, leaving the other stale lines to the cart page.
+        """
+        other = ProductProxy.objects.create(title='Other Product', price=4, category=self.category)
+        for product in (self.product, other):
+            self.client.post(reverse('cart:add-to-cart'), {
+                'action': 'post', 'product_id': product.id, 'product_quantity': 1})
+        for product in (self.product, other):
+            product.price = Decimal('5.00')
+            product.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('cart:update-to-cart'), {
+                'action': 'post', 'product_id': other.id, 'product_quantity': 2})
+        product_queries = [query['sql'] for query in queries if 'shop_product' in query['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertIn(f'IN ({other.id})', product_queries[0])
+        self.assertEqual(json.loads(response.content)['repriced'], [
+            {'product_id': other.id, 'title': 'Other Product', 'old_price': '4.00', 'new_price': '5.00'}])
+        self.assertEqual(self.client.session['session_key'][str(self.product.id)], [1, 1000, 1])
+
+    def test_concurrent_price_changes_each_bump_the_version(self):
+        """
+        Test that two saves of copies loaded before either one changed
+        the price both move the version, and that an instance built by
+        hand is compared with its stored row.
+        """
+        first, second = ProductProxy.objects.get(pk=self.product.pk), ProductProxy.objects.get(pk=self.product.pk)
+        first.price, second.price = Decimal('11.00'), Decimal('12.00')
+        first.save()
+        second.save()
+        self.assertEqual(second.price_version, 3)
+
+        ProductProxy(pk=self.product.pk, slug=self.product.slug, price=Decimal('13.00')).save(update_fields=['price'])
+        self.assertEqual(ProductProxy.objects.get(pk=self.product.pk).price_version, 4)
+
+    def test_unrelated_save_keeps_the_price_version(self):
+        """
+        Test that saving a new product again without touching its price,
+        whether it was given as a float or a string, keeps the version.
+        """
+        for price in (10.0, '7.5'):
+            product = ProductProxy.objects.create(title='Fresh Product', price=price, category=self.category)
+            product.title = 'Renamed Product'
+            product.save()
+            self.assertEqual(product.price_version, 1)
+            self.assertEqual(ProductProxy.objects.get(pk=product.pk).price_version, 1)
+
+
+
+class CartBatchViewTestCase(TestCase):
+
+    def setUp(self):
+        """
+        Set up two available products and one unavailable product.
+        """
+        self.category = Category.objects.create(name='Category 1')
+        self.first = ProductProxy.objects.create(title='First', price=10.0, category=self.category)
+        self.second = ProductProxy.objects.create(title='Second', price=2.5, category=self.category)
+        self.hidden = ProductProxy.objects.create(title='Hidden', price=1, category=self.category, available=False)
+
+    def post(self, operations):
+        return self.client.post(
+            reverse('cart:batch-cart'), json.dumps({'operations': operations}), content_type='application/json')
+
+    def test_operations_are_applied_together(self):
+        """
+        Test that a batch of operations is applied with one product
+        query and returns the new totals.
+        """
+        self.post([{'op': 'add', 'product_id': self.second.id, 'quantity': 1}])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([
+                {'op': 'add', 'product_id': self.first.id, 'quantity': 3},
+                {'op': 'update', 'product_id': self.second.id, 'quantity': 4},
+                {'op': 'delete', 'product_id': self.first.id},
+                {'op': 'add', 'product_id': self.first.id, 'quantity': 1},
+            ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'quantity': 5, 'total': '20.00', 'repriced': []})
+        statements = [query['sql'] for query in queries]
+        self.assertEqual(len([sql for sql in statements if 'shop_product' in sql]), 1)
+        self.assertEqual(len([sql for sql in statements if sql.startswith('UPDATE "django_session"')]), 1)
+
+    def test_invalid_batch_changes_nothing(self):
+        """
+        Test that one invalid operation rejects the whole batch.
+        """
+        response = self.post([
+            {'op': 'add', 'product_id': self.first.id, 'quantity': 1},
+            {'op': 'add', 'product_id': self.hidden.id, 'quantity': 1},
+            {'op': 'update', 'product_id': self.first.id, 'quantity': 0},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(json.loads(response.content)['errors']), 2)
+        self.assertNotIn('session_key', self.client.session)
+
+
+
+class UserCartTestCase(TestCase):
+
+    def setUp(self):
+        """
+        Set up a user and a few products.
+        """
+        self.user = User.objects.create_user(username='buyer', password='secret-password')
+        self.category = Category.objects.create(name='Category 1')
+        self.products = [
+            ProductProxy.objects.create(title=f'Product {index}', price=index + 1, category=self.category)
+            for index in range(12)
+        ]
+
+    def test_login_merges_session_cart(self):
+        """
+        Test that logging in moves the session cart into the user's
+        cart, the session lines winning over the stored ones.
+        """
+        first, second, third = self.products[:3]
+        cart = UserCart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=first, quantity=7, price=100)
+        CartItem.objects.create(cart=cart, product=third, quantity=1, price=300)
+
+        for product, quantity in ((first, 2), (second, 1)):
+            self.client.post(reverse('cart:add-to-cart'), {
+                'action': 'post', 'product_id': product.id, 'product_quantity': quantity})
+        self.client.login(username='buyer', password='secret-password')
+
+        self.assertNotIn('session_key', self.client.session)
+        self.assertEqual(
+            set(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')),
+            {(first.id, 2), (second.id, 1), (third.id, 1)},
+        )
+        cart.refresh_from_db()
+        self.assertEqual((cart.quantity, cart.total), (4, 200 + 200 + 300))
+
+    def test_merge_query_count_is_bounded(self):
+        """
+        Test that merging does not issue more queries for more lines.
+        """
+        UserCart.objects.create(user=self.user)
+
+        def merge(products):
+            items = {str(product.id): [1, 100, 1] for product in products}
+            with CaptureQueriesContext(connection) as queries:
+                DatabaseCartStore(self.user).merge(items)
+            return len(queries)
+
+        self.assertEqual(merge(self.products[:2]), merge(self.products))
+
+    def test_authenticated_cart_is_stored_in_database(self):
+        """
+        Test that an authenticated user's cart bypasses the session and
+        keeps the same API for views and templates.
+        """
+        self.client.force_login(self.user)
+        product = self.products[4]
+
+        self.client.post(reverse('cart:add-to-cart'), {
+            'action': 'post', 'product_id': product.id, 'product_quantity': 3})
+        self.client.post(reverse('cart:update-to-cart'), {
+            'action': 'post', 'product_id': product.id, 'product_quantity': 2})
+
+        self.assertNotIn('session_key', self.client.session)
+        self.assertEqual(UserCart.objects.values_list('quantity', 'total').get(user=self.user), (2, 1000))
+
+        response = self.client.get(reverse('cart:cart-view'))
+        lines = list(response.context['cart'])
+        self.assertEqual(len(response.context['cart']), 2)
+        self.assertEqual((lines[0].product, lines[0].total_price), (product, Decimal('10.00')))
+
+        self.client.post(reverse('cart:delete-to-cart'), {'action': 'post', 'product_id': product.id})
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_concurrent_devices_keep_totals_in_sync(self):
+        """
+        Test that two carts loaded before either one saves do not
+        overwrite each other's totals.
+        """
+        first, second = self.products[:2]
+        request = RequestFactory().get('/')
+        request.user, request.session = self.user, {}
+        phone, laptop = Cart(request), Cart(request)
+
+        phone.add(product=first, quantity=2)
+        laptop.add(product=second, quantity=1)
+
+        self.assertEqual(UserCart.objects.values_list('quantity', 'total').get(user=self.user), (3, 400))
+        self.assertEqual((laptop.quantity, laptop.total), (3, 400))
+
+    def test_invalid_quantity_is_rejected(self):
+        """
+        Test that a negative or malformed quantity is a bad request.
+        """
+        self.client.force_login(self.user)
+        for quantity in (-1, 0, 'many'):
+            for url in ('cart:add-to-cart', 'cart:update-to-cart'):
+                response = self.client.post(reverse(url), {
+                    'action': 'post', 'product_id': self.products[0].id, 'product_quantity': quantity})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_invalid_product_id_is_rejected(self):
+        """
+        Test that deleting a missing or malformed product id is a bad
+        request.
+        """
+        self.client.force_login(self.user)
+        for data in ({}, {'product_id': ''}, {'product_id': 'abc'}):
+            response = self.client.post(reverse('cart:delete-to-cart'), {'action': 'post', **data})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), {'errors': ['An integer product_id is required.']})
+
+
+
+class AsyncCartViewTestCase(TestCase):
+
+    def setUp(self):
+        """
+        Set up a product and an anonymous request with a session.
+        """
+        self.category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(title='Example Product', price=10.0, category=self.category)
+        self.session = SessionMiddleware(lambda request: None)
+
+    def request(self, data):
+        request = AsyncRequestFactory().post('/cart/', data)
+        self.session.process_request(request)
+        request.user = AnonymousUser()
+        return request
+
+    async def test_async_views_share_the_session_cart(self):
+        """
+        Test that the async views keep the same session payload and
+        responses as the sync ones.
+        """
+        request = self.request({'action': 'post', 'product_id': self.product.id, 'product_quantity': 3})
+        response = await async_views.cart_add(request)
+        self.assertEqual(
+            json.loads(response.content), {'quantity': 3, 'product': 'Example Product', 'repriced': []})
+        self.assertEqual(request.session['session_key'], {str(self.product.id): [3, 1000, 1]})
+
+        request.POST = request.POST.copy()
+        request.POST['product_quantity'] = 5
+        response = await async_views.cart_update(request)
+        self.assertEqual(json.loads(response.content), {'quantity': 5, 'total': '50.00', 'repriced': []})
+        self.assertEqual(await sync_to_async(len)(Cart(request)), 5)
+
+        response = await async_views.cart_delete(request)
+        self.assertEqual(json.loads(response.content)['quantity'], 0)
+        self.assertNotIn('cart_summary', request.session)
+
+    async def test_async_delete_rejects_malformed_id(self):
+        """
+        Test that the async delete view answers a malformed id with 400.
+        """
+        response = await async_views.cart_delete(self.request({'action': 'post', 'product_id': 'abc'}))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_async_batch_rejects_get(self):
+        """
+        Test that the async batch view only accepts POST.
+        """
+        request = AsyncRequestFactory().get('/cart/batch/')
+        response = await async_views.cart_batch(request)
+        self.assertEqual(response.status_code, 405)
+
+
+class ReplayTestCase(TestCase):
+
+    def setUp(self):
+        """
+        Set up a product and an access log of two visitors.
+        """
+        self.category = Category.objects.create(name='Category 1')
+        self.product = ProductProxy.objects.create(title='Example Product', price=10.0, category=self.category)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'access.jsonl')
+        add = {'action': 'post', 'product_id': self.product.id, 'product_quantity': 1}
+        records = [
+            {'method': 'GET', 'path': '/cart/', 'session': 'first'},
+            {'method': 'POST', 'path': '/cart/add/', 'body': add, 'session': 'first'},
+            {'method': 'POST', 'path': '/cart/add/', 'body': {**add, 'product_quantity': 2}, 'session': 'first'},
+            {'method': 'POST', 'path': '/cart/add/', 'body': add, 'session': 'second'},
+            {'method': 'GET', 'path': '/missing/'},
+        ]
+        with open(self.path, 'w') as log:
+            log.writelines(json.dumps(record) + '\n' for record in records)
+            log.write('{"method": "GET", "path": \n')
+            log.write('["GET", "/cart/"]\n')
+
+    def test_sessions_keep_their_cookies(self):
+        """
+        Test that each recorded visitor keeps one session through its
+        cart flow, POSTs pass the CSRF check, errors are reported and
+        malformed lines are skipped.
+        """
+        with self.assertLogs('bigcorp.replay', 'WARNING'):
+            result = replay_partition(self.path, 0, 1, host='testserver')
+        self.assertEqual(result.statuses, {200: 4, 404: 1})
+        self.assertEqual(result.skipped, 2)
+
+        carts = [session.get_decoded().get('session_key') for session in Session.objects.all()]
+        self.assertCountEqual(carts, [
+            {str(self.product.id): [2, 1000, 1]},
+            {str(self.product.id): [1, 1000, 1]},
+        ])
+
+        report = summarize(result, 1.0)
+        self.assertEqual(report['requests'], 5)
+        self.assertEqual(report['skipped_lines'], 2)
+        self.assertEqual(report['error_rate']['4xx'], 0.2)
+        self.assertEqual(sum(report['histogram'].values()), 5)
+
+    def test_malformed_lines_are_skipped_by_one_worker(self):
+        """
+        Test that every malformed line is skipped and counted by exactly
+        one of the workers.
+        """
+        with self.assertLogs('bigcorp.replay', 'WARNING'):
+            records = [record for index in range(3) for record in read_log(self.path, index, 3)]
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records.count(None), 2)
+
+    def test_connections_are_closed_before_forking(self):
+        """
+        Test that the process pool is only started once the connections
+        of the parent process are closed.
+        """
+        calls = []
+        empty_log = os.path.join(os.path.dirname(self.path), 'empty.jsonl')
+        open(empty_log, 'w').close()
+
+        def executor(max_workers):
+            calls.append('pool')
+            return ThreadPoolExecutor(max_workers=max_workers)
+
+        with mock.patch('bigcorp.replay.ProcessPoolExecutor', executor), \
+                mock.patch('django.db.connections.close_all', lambda: calls.append('close')):
+            replay(empty_log, 2, mode='processes')
+        self.assertEqual(calls[:2], ['close', 'pool'])
+
+    def test_replay_log_command(self):
+        """
+        Test that the replay_log command prints the summary and writes
+        the JSON report.
+        """
+        result = WorkerResult()
+        result.latencies.extend([3.0, 40.0])
+        result.statuses.update({200: 2})
+        output = os.path.join(os.path.dirname(self.path), 'replay.json')
+        stdout = io.StringIO()
+        with mock.patch('bigcorp.management.commands.replay_log.replay', return_value=(result, 2.0)) as replay:
+            call_command('replay_log', self.path, '--concurrency', '2', '--output', output, stdout=stdout)
+
+        replay.assert_called_once_with(self.path, 2, 'threads', 'localhost')
+        self.assertIn('2 requests in 2.0s, 1.0 req/s', stdout.getvalue())
+        with open(output) as report:
+            self.assertEqual(json.load(report)['statuses'], {'200': 2})
@@ -1,13 +1,23 @@
 from django.urls import path
-from .views import cart_view, cart_add, cart_delete, cart_update
+
+from . import views
 
 
 app_name = 'cart'
 
 
-urlpatterns = [
-    path('', cart_view, name='cart-view'),
-    path('add/', cart_add, name= 'add-to-cart'),
-    path('delete/', cart_delete, name= 'delete-to-cart'),
-    path('update/', cart_update, name= 'update-to-cart'),
-]
+def build_urlpatterns(views):
+    """
+    Returns the routes of the app served by the given views module, so
+    the sync and async URLconfs share one list of routes.
+    """
+    return [
+        path('', views.cart_view, name='cart-view'),
+        path('add/', views.cart_add, name= 'add-to-cart'),
+        path('delete/', views.cart_delete, name= 'delete-to-cart'),
+        path('update/', views.cart_update, name= 'update-to-cart'),
+        path('batch/', views.cart_batch, name= 'batch-cart'),
+    ]
+
+
+urlpatterns = build_urlpatterns(views)
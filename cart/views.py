@@ -1,18 +1,52 @@
-from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+import json
+
+from django.shortcuts import render
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_POST
 
-from shop.models import ProductProxy
 from .cart import Cart
 
 
+def _repriced_json(repriced):
+    return [change.as_dict() for change in repriced]
+
+
+def _posted_line(request, with_quantity=True):
+    """
+    Reads the product id and quantity of the line an add or update form
+    posts. A delete form posts no quantity, so it passes
+    ``with_quantity=False`` and gets None as the quantity.
+
+    Returns:
+        tuple: ``(product_id, quantity)``, or None when either is not an
+        integer or the quantity is not positive.
+    """
+    try:
+        product_id = int(request.POST.get('product_id'))
+        quantity = int(request.POST.get('product_quantity')) if with_quantity else None
+    except (TypeError, ValueError):
+        return None
+    return (product_id, quantity) if quantity is None or quantity >= 1 else None
+
+
+INVALID_LINE_ERROR = 'product_id and a positive integer product_quantity are required.'
+
+INVALID_PRODUCT_ERROR = 'An integer product_id is required.'
+
+
 def cart_view(request):
     """
     A view function that renders the cart view.
+
+    Lines whose product price changed are re-priced first and listed
+    in ``repriced`` so the template can tell the customer.
     """
     cart = Cart(request)
+    repriced = cart.refresh_prices()
 
     context = {
-        'cart':cart
+        'cart':cart,
+        'repriced': repriced,
     }
 
     return render(request, 'cart/cart-view.html', context)
@@ -24,22 +58,31 @@ def cart_add(request):
 
     Returns:
         JsonResponse: A JSON response containing the quantity of 
-        items in the cart and the title of the added product.
+        items in the cart, the title of the added product and its
+        line if it was re-priced.
     """
     cart = Cart(request)
 
     if request.POST.get('action') == 'post':
 
-        product_id = int(request.POST.get('product_id'))
-        product_quantity = int(request.POST.get('product_quantity'))
+        line = _posted_line(request)
+        if line is None:
+            return JsonResponse({'errors': [INVALID_LINE_ERROR]}, status=400)
+        product_id, product_quantity = line
 
-        product = get_object_or_404(ProductProxy, id=product_id)
+        product = cart.get_product(product_id)
+        if product is None:
+            raise Http404('No product matches the given query.')
 
+        # Only the line being changed is checked, so the cost does not
+        # grow with the cart; the cart page checks all of them.
+        repriced = cart.refresh_price(product_id)
         cart.add(product=product, quantity=product_quantity)
 
         cart_quantity = cart.__len__()
 
-        responce = JsonResponse({'quantity': cart_quantity, 'product': product.title})
+        responce = JsonResponse({
+            'quantity': cart_quantity, 'product': product.title, 'repriced': _repriced_json(repriced)})
 
         return responce
 
@@ -54,11 +97,15 @@ def cart_delete(request):
     cart = Cart(request)
 
     if request.POST.get('action') == 'post':
-        product_id = int(request.POST.get('product_id'))
+        line = _posted_line(request, with_quantity=False)
+        if line is None:
+            return JsonResponse({'errors': [INVALID_PRODUCT_ERROR]}, status=400)
+        product_id, _ = line
+
         cart.delete(product = product_id)
         cart_quantity = cart.__len__()
         cart_total = cart.get_total_price()
-        responce = JsonResponse({'quantity': cart_quantity, 'total': cart_total})
+        responce = JsonResponse({'quantity': cart_quantity, 'total': cart_total, 'repriced': []})
 
         return responce
 
@@ -69,20 +116,98 @@ def cart_update(request):
 
     Returns:
         JsonResponse: A JSON response containing the updated cart 
-        quantity and total price.
+        quantity and total price and the updated line if it was
+        re-priced.
     """
     cart = Cart(request)
 
     if request.POST.get('action') == 'post':
-        product_id = int(request.POST.get('product_id'))
-        product_quantity = int(request.POST.get('product_quantity'))
+        line = _posted_line(request)
+        if line is None:
+            return JsonResponse({'errors': [INVALID_LINE_ERROR]}, status=400)
+        product_id, product_quantity = line
 
         cart.update(product = product_id, quantity = product_quantity)
+        repriced = cart.refresh_price(product_id)
 
         cart_quantity = cart.__len__()
         cart_total = cart.get_total_price()
        
         responce = JsonResponse(
-            {'quantity': cart_quantity, 'total': cart_total})
+            {'quantity': cart_quantity, 'total': cart_total, 'repriced': _repriced_json(repriced)})
 
         return responce
+
+
+CART_BATCH_OPERATIONS = ('add', 'update', 'delete')
+
+CART_BATCH_MAX_OPERATIONS = 200
+
+
+def _parse_batch(body):
+    """
+    Validates the JSON body of a batch request.
+
+    Returns:
+        tuple: The parsed ``(op, product_id, quantity)`` triples and a
+        list of error messages.
+    """
+    try:
+        operations = json.loads(body)['operations']
+    except (ValueError, KeyError, TypeError):
+        return [], ['Expected a JSON object with an "operations" list.']
+    if not isinstance(operations, list) or not operations:
+        return [], ['"operations" must be a non-empty list.']
+    if len(operations) > CART_BATCH_MAX_OPERATIONS:
+        return [], [f'At most {CART_BATCH_MAX_OPERATIONS} operations are allowed.']
+
+    parsed, errors = [], []
+    for index, operation in enumerate(operations):
+        try:
+            op = operation['op']
+            product_id = int(operation['product_id'])
+            quantity = int(operation.get('quantity', 0)) if op != 'delete' else 0
+        except (KeyError, TypeError, ValueError):
+            errors.append(f'Operation {index}: malformed.')
+            continue
+        if op not in CART_BATCH_OPERATIONS:
+            errors.append(f'Operation {index}: unknown op "{op}".')
+        elif op != 'delete' and quantity < 1:
+            errors.append(f'Operation {index}: quantity must be positive.')
+        else:
+            parsed.append((op, product_id, quantity))
+    return parsed, errors
+
+
+@require_POST
+def cart_batch(request):
+    """
+    Applies several add, update and delete operations in one request.
+
+    The body is JSON: ``{"operations": [{"op": "add", "product_id": 1,
+    "quantity": 2}, {"op": "delete", "product_id": 3}, ...]}``. Every
+    product being added is validated in the same single query that
+    re-prices the existing lines, and either all operations are applied
+    with one cart write or, on any error, none of them are. Stale lines
+    are re-priced afterwards, which takes a second write only when there
+    are any.
+
+    Returns:
+        JsonResponse: The new cart quantity and total with the re-priced
+        lines, or the list of errors with status 400.
+    """
+    parsed, errors = _parse_batch(request.body)
+
+    cart = Cart(request)
+    added_ids = {product_id for op, product_id, quantity in parsed if op == 'add'}
+    products = cart.get_products(added_ids)
+    errors += [f'Product {product_id} is not available.' for product_id in sorted(added_ids - products.keys())]
+
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    cart.apply([(op, product_id, quantity, products.get(product_id)) for op, product_id, quantity in parsed])
+    repriced = cart.refresh_prices()
+
+    return JsonResponse({'quantity': len(cart), 'total': cart.get_total_price(), 'repriced': _repriced_json(repriced)})
+
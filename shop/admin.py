@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.http import HttpRequest
 
+from .invalidation import batched
 from .models import Category, Product
 
 
@@ -12,6 +13,9 @@ class CategoryAdmin(admin.ModelAdmin):
     ordering = ('name',)
     search_fields = ('name',)
 
+    def delete_queryset(self, request, queryset):
+        with batched():
+            super().delete_queryset(request, queryset)
 
     def get_prepopulated_fields(self, request, object=None):
         return {
@@ -25,6 +29,10 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('available', 'created_at', 'updated_at')
     search_fields = ('title',)
 
+    def delete_queryset(self, request, queryset):
+        with batched():
+            super().delete_queryset(request, queryset)
+
     def get_prepopulated_fields(self, request, object=None):
         return {
             'slug': ('title',),
@@ -6,3 +6,6 @@ class ShopConfig(AppConfig):
     name = 'shop'
     verbose_name = 'Магазин'
     verbose_name_plural = 'Магазины'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,125 @@
+"""
+Async versions of the catalog views, served under ASGI.
+
+Data is read with the async ORM. Templates are rendered in a thread
+because the context processors (navigation tree, cart badge) may still
+query the database, which Django 4.2 only allows from sync code.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import render
+from django.utils.functional import SimpleLazyObject
+
+from .category_tree import get_ancestor_nodes
+from .conditional import (
+    catalog_page_etag,
+    catalog_page_last_modified,
+    conditional_page,
+    product_page_etag,
+    product_page_last_modified,
+)
+from .facets import aget_facets, filter_products
+from .feeds import FEED_CONTENT_TYPES, abuffered, afeed_lines
+from .models import Category, ProductProxy
+from .page_cache import cache_anonymous_page
+from .pagination import KeysetPaginator
+from .product_cache import aget_product_by_slug
+from .search import search_product_ids
+from .views import PRODUCTS_PER_PAGE, SEARCH_MAX_PAGES, SEARCH_RESULTS_PER_PAGE
+
+
+arender = sync_to_async(render)
+
+
+@cache_anonymous_page
+async def products_view(request):
+    """
+    Async version of shop.views.products_view.
+    """
+    products, selected = filter_products(ProductProxy.objects.all(), request.GET)
+    page = await KeysetPaginator(products, PRODUCTS_PER_PAGE).apaginate(request)
+    context = {
+        'products': page.object_list,
+        'page': page,
+        'facets': await aget_facets(),
+        'selected': selected,
+    }
+    return await arender(request, 'shop/products.html', context)
+
+
+async def search_view(request):
+    """
+    Async version of shop.views.search_view. The full-text query uses
+    a raw cursor, so it runs in a thread.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page = min(max(int(request.GET.get('page', 1)), 1), SEARCH_MAX_PAGES)
+    except ValueError:
+        page = 1
+
+    ids = await sync_to_async(search_product_ids)(
+        query, limit=SEARCH_RESULTS_PER_PAGE + 1, offset=(page - 1) * SEARCH_RESULTS_PER_PAGE)
+    has_next = len(ids) > SEARCH_RESULTS_PER_PAGE and page < SEARCH_MAX_PAGES
+    ids = ids[:SEARCH_RESULTS_PER_PAGE]
+
+    found = await ProductProxy.objects.ain_bulk(ids)
+    context = {
+        'query': query,
+        'products': [found[pk] for pk in ids if pk in found],
+        'page_number': page,
+        'has_next': has_next,
+    }
+    return await arender(request, 'shop/search.html', context)
+
+
+@conditional_page(etag_func=product_page_etag, last_modified_func=product_page_last_modified)
+@cache_anonymous_page
+async def product_detail_view(request, slug):
+    """
+    Async version of shop.views.product_detail_view.
+    """
+    product = await aget_product_by_slug(slug)
+    return await arender(request, 'shop/product_detail.html', {'product': product})
+
+
+@conditional_page(etag_func=catalog_page_etag, last_modified_func=catalog_page_last_modified)
+@cache_anonymous_page
+async def category_list(request, slug):
+    """
+    Async version of shop.views.category_list. The breadcrumbs are
+    resolved lazily while the template renders in its thread.
+    """
+    try:
+        category = await Category.objects.aget(slug=slug)
+    except Category.DoesNotExist:
+        raise Http404('No Category matches the given query.')
+
+    subtree = request.GET.get('subtree') == '1'
+    if subtree:
+        products = ProductProxy.objects.in_category_tree(category)
+    else:
+        products = ProductProxy.objects.filter(category=category)
+    products, selected = filter_products(products.select_related('category'), request.GET)
+    page = await KeysetPaginator(products, PRODUCTS_PER_PAGE).apaginate(request)
+    context = {
+        'category': category,
+        'breadcrumbs': SimpleLazyObject(lambda: get_ancestor_nodes(category)),
+        'subtree': subtree,
+        'products': page.object_list,
+        'page': page,
+        'facets': await aget_facets(category, subtree),
+        'selected': selected,
+    }
+    return await arender(request, 'shop/category_list.html', context)
+
+
+async def product_feed(request, fmt):
+    """
+    Async version of shop.views.product_feed, streaming from an async
+    iterator so the feed is never held in memory as a whole.
+    """
+    base_url = request.build_absolute_uri('/').rstrip('/')
+    response = StreamingHttpResponse(abuffered(afeed_lines(fmt, base_url)), content_type=FEED_CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+    return response
@@ -0,0 +1,350 @@
+"""
+Streaming bulk import of products from CSV or JSON Lines.
+
+Every record names its category by the full path of category names,
+joined with ``' -> '`` as in ``Category.__str__``. Missing categories
+are created on the fly. Products are matched by slug: known slugs are
+updated with ``bulk_update`` and new ones inserted with ``bulk_create``,
+one transaction per batch, so only a single batch is held in memory.
+Records without a slug get one derived from their category, title and
+brand, so importing the same file twice updates instead of duplicating.
+
+Bulk writes skip the model signals, so the importer maintains the
+search index per batch and leaves the facet counters and cache versions
+to ``finish()``.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .facets import rebuild_facets
+from .invalidation import CATALOG, CATEGORY_TREE, batched, bump, product_namespace
+from .models import Category, Product, transliterate
+from .search import index_products
+
+
+logger = logging.getLogger(__name__)
+
+
+CATEGORY_SEPARATOR = ' -> '
+
+IMPORT_FIELDS = ('title', 'brand', 'description', 'price', 'available', 'image')
+
+UPDATE_FIELDS = ('category', *IMPORT_FIELDS, 'price_version', 'renditions', 'updated_at')
+
+IMPORTED_IMAGES_DIR = 'products/imported'
+
+MAX_PRICE = Decimal('100000')
+
+_TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+_FALSE_VALUES = {'0', 'false', 'no', 'n'}
+
+MAX_LENGTHS = {
+    'title': Product._meta.get_field('title').max_length,
+    'brand': Product._meta.get_field('brand').max_length,
+    'slug': Product._meta.get_field('slug').max_length,
+    'category': Category._meta.get_field('name').max_length,
+}
+
+
+class InvalidRecord(ValueError):
+    """
+    Raised for a record that cannot be imported.
+    """
+
+
+def read_records(path, fmt=None):
+    """
+    Yields the records of a CSV file with a header row or of a JSON
+    Lines file one at a time, together with their line numbers. Lines
+    that are not valid JSON are yielded as None.
+    """
+    if fmt is None:
+        fmt = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+
+    with open(path, newline='', encoding='utf-8') as source:
+        if fmt == 'csv':
+            reader = csv.DictReader(source)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_num, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError:
+                    yield line_num, None
+
+
+def _short_hash(*parts):
+    return hashlib.sha1('\x1f'.join(parts).encode()).hexdigest()[:8]
+
+
+def _text(record, field, strip=True):
+    """
+    Returns the optional text field of a record, empty when missing.
+
+    Raises:
+        InvalidRecord: If the value is not a string.
+    """
+    value = record.get(field)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise InvalidRecord(f'The {field} must be a string.')
+    return value.strip() if strip else value
+
+
+def _check_length(field, value):
+    if len(value) > MAX_LENGTHS[field]:
+        raise InvalidRecord(f'The {field} is longer than {MAX_LENGTHS[field]} characters.')
+    return value
+
+
+def _slug_base(text, default):
+    return slugify(transliterate(text))[:180].strip('-') or default
+
+
+def _parse_available(value):
+    """
+    Returns the availability of a record. A missing or blank value means
+    available, as for a new product.
+
+    Raises:
+        InvalidRecord: If the value is present but not recognised.
+    """
+    if isinstance(value, bool):
+        return value
+    value = '' if value is None else str(value).strip().lower()
+    if not value or value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    raise InvalidRecord(f'Invalid availability {value!r}.')
+
+
+def _digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def copy_image(path):
+    """
+    Copies an image file into the storage under a name derived from its
+    content, so re-importing an unchanged image stores nothing.
+
+    Returns:
+        str: The stored name, or an empty string when the file cannot
+        be read.
+    """
+    try:
+        digest = _digest(path)[:24]
+        name = f'{IMPORTED_IMAGES_DIR}/{digest[:2]}/{digest}{os.path.splitext(path)[1].lower()}'
+        if not default_storage.exists(name):
+            with open(path, 'rb') as source:
+                default_storage.save(name, File(source))
+    except OSError:
+        logger.warning('Cannot import image %s', path)
+        return ''
+    return name
+
+
+class CatalogImporter:
+    """
+    Imports batches of records into the catalog.
+
+    Args:
+        images_dir (str): Directory that relative ``image`` paths of the
+            records are resolved against.
+        workers (int): Number of threads copying images.
+    """
+
+    def __init__(self, images_dir='.', workers=None):
+        self.images_dir = images_dir
+        self.workers = workers
+        self.created = self.updated = 0
+        self._categories = None
+        self._pool = None
+
+    def __enter__(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._pool.shutdown()
+
+    def _load_categories(self):
+        self._categories = {
+            (parent_id, name): pk
+            for pk, parent_id, name in Category.objects.values_list('pk', 'parent_id', 'name').iterator()
+        }
+
+    def resolve_category(self, category_path):
+        """
+        Returns the id of the category at the given path of names,
+        creating the missing ones. Known categories are looked up in
+        memory, so each one costs queries only when it is created.
+        """
+        if self._categories is None:
+            self._load_categories()
+
+        parent_id = None
+        names = [name.strip() for name in category_path.split(CATEGORY_SEPARATOR) if name.strip()]
+        if not names:
+            raise InvalidRecord('The category is empty.')
+        for name in names:
+            _check_length('category', name)
+        for depth, name in enumerate(names, 1):
+            pk = self._categories.get((parent_id, name))
+            if pk is None:
+                slug = f"{_slug_base(name, 'category')}-{_short_hash(*names[:depth])}"
+                category = Category(name=name, parent_id=parent_id, slug=slug)
+                category.save()
+                pk = self._categories[(parent_id, name)] = category.pk
+            parent_id = pk
+        return parent_id
+
+    def _parse(self, record):
+        try:
+            title = record['title'].strip()
+            category_path = record['category']
+        except (KeyError, TypeError, AttributeError):
+            raise InvalidRecord('The title and category are required.')
+        if not title:
+            raise InvalidRecord('The title is required.')
+        if not isinstance(category_path, str):
+            raise InvalidRecord('The category must be a string.')
+
+        _check_length('title', title)
+        brand = _check_length('brand', _text(record, 'brand'))
+        try:
+            price = Decimal(str(record.get('price') or 0)).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            price = None
+        # NaN passes quantize() and cannot be compared.
+        if price is None or not price.is_finite() or not 0 <= price < MAX_PRICE:
+            raise InvalidRecord(f'Invalid price {record.get("price")!r}.')
+
+        slug = _text(record, 'slug')
+        if slug:
+            _check_length('slug', slug)
+            try:
+                validate_slug(slug)
+            except ValidationError:
+                raise InvalidRecord(f'Invalid slug {slug!r}.')
+        else:
+            slug = f"{_slug_base(title, 'product')}-{_short_hash(category_path, title, brand)}"
+
+        image = _text(record, 'image')
+        if image:
+            image = os.path.join(self.images_dir, image)
+
+        return {
+            'slug': slug,
+            'category_id': self.resolve_category(category_path),
+            'title': title,
+            'brand': brand,
+            'description': _text(record, 'description', strip=False),
+            'price': price,
+            'available': _parse_available(record.get('available')),
+            'image': image,
+        }
+
+    def import_batch(self, records):
+        """
+        Writes one batch of records, including the categories it creates
+        and the search index rows, in a single transaction. The cache
+        bumps are applied once at the end of the batch.
+
+        Args:
+            records (list): ``(line_num, record)`` pairs.
+
+        Returns:
+            list: ``(line_num, message)`` pairs of the skipped records.
+        """
+        rows, errors = {}, []
+        try:
+            with batched(), transaction.atomic():
+                for line_num, record in records:
+                    try:
+                        row = self._parse(record)
+                    except InvalidRecord as error:
+                        errors.append((line_num, str(error)))
+                        continue
+                    # The last record with a slug wins, as it would one by one.
+                    rows[row['slug']] = row
+
+                if rows:
+                    self._write(rows)
+        except Exception:
+            # The categories created by the batch were rolled back.
+            self._categories = None
+            raise
+        return errors
+
+    def _write(self, rows):
+        image_paths = sorted({row['image'] for row in rows.values() if row['image']})
+        stored = dict(zip(image_paths, self._pool.map(copy_image, image_paths)))
+
+        existing = {
+            product.slug: product
+            for product in Product._base_manager.filter(slug__in=rows.keys()).only(
+                'pk', 'slug', 'price', 'price_version', 'image', 'renditions')
+        }
+
+        now = timezone.now()
+        created, updated = [], []
+        for slug, row in rows.items():
+            image = stored.get(row.pop('image'), '')
+            product = existing.get(slug)
+            if product is None:
+                created.append(Product(**row, image=image))
+                continue
+
+            if row['price'] != product.price:
+                product.price_version += 1
+            if image and image != product.image.name:
+                product.image = image
+                product.renditions = {}
+            for field, value in row.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            updated.append(product)
+
+        Product.objects.bulk_create(created)
+        Product._base_manager.bulk_update(updated, UPDATE_FIELDS)
+
+        product_ids = [product.pk for product in created + updated]
+        if created and created[0].pk is None:
+            # Backends that cannot return the ids of bulk inserts.
+            product_ids = Product._base_manager.filter(slug__in=rows.keys()).values_list('pk', flat=True)
+        index_products(product_ids)
+        bump(*(product_namespace(product.slug) for product in updated))
+
+        self.created += len(created)
+        self.updated += len(updated)
+
+    def finish(self):
+        """
+        Recomputes the facet counters and makes every cached catalog
+        page stale once the whole file is in.
+        """
+        rebuild_facets()
+        bump(CATALOG, CATEGORY_TREE)
@@ -0,0 +1,130 @@
+from django.core.cache import cache
+from django.urls import reverse
+
+from .invalidation import CATEGORY_TREE, bump, versioned_key
+from .models import Category
+
+
+CATEGORY_TREE_TIMEOUT = 60 * 60
+
+
+class CategoryNode:
+    """
+    A lightweight, picklable snapshot of a category used to render
+    navigation without touching the database.
+    """
+
+    __slots__ = ('id', 'name', 'slug', 'parent_id', 'url', 'children')
+
+    def __init__(self, id, name, slug, parent_id):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.url = reverse('shop:category_list', args=[str(slug)])
+        self.children = []
+
+    def get_absolute_url(self):
+        return self.url
+
+    @property
+    def subtree_url(self):
+        """
+        Returns the URL listing the products of this node and all of
+        its descendants.
+        """
+        return f'{self.url}?subtree=1'
+
+    def __str__(self):
+        return self.name
+
+
+class CategoryTree:
+    """
+    The whole category hierarchy held in memory.
+
+    Attributes:
+        roots (list): Top-level nodes ordered by name.
+        nodes (dict): Every node keyed by category id.
+    """
+
+    def __init__(self, roots, nodes):
+        self.roots = roots
+        self.nodes = nodes
+
+    def __iter__(self):
+        return iter(self.roots)
+
+    def __len__(self):
+        return len(self.roots)
+
+
+def build_category_tree():
+    """
+    Loads every category with a single query and links the rows
+    into a tree in Python.
+
+    Returns:
+        CategoryTree: The freshly built tree.
+    """
+    rows = Category.objects.order_by('name').values_list('id', 'name', 'slug', 'parent_id')
+
+    nodes = {}
+    for row in rows:
+        node = CategoryNode(*row)
+        nodes[node.id] = node
+
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node.parent_id)
+        if parent is None:
+            roots.append(node)
+        else:
+            parent.children.append(node)
+
+    return CategoryTree(roots, nodes)
+
+
+def get_category_tree():
+    """
+    Returns the category tree from the cache, building and storing
+    it on a miss.
+    """
+    key = versioned_key(CATEGORY_TREE)
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(key, tree, CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+def invalidate_category_tree():
+    """
+    Makes the cached tree stale in every process, so the next request
+    rebuilds it.
+    """
+    bump(CATEGORY_TREE)
+
+
+def get_ancestor_nodes(category):
+    """
+    Returns the nodes from the root down to the parent of the given
+    category, resolved from its materialized path against the cached
+    tree. A stale tree is rebuilt from the database if an ancestor is
+    missing.
+
+    Returns:
+        list: CategoryNode objects ordered from the root.
+    """
+    ancestor_ids = category.ancestor_ids
+    if not ancestor_ids:
+        return []
+
+    tree = get_category_tree()
+    if any(pk not in tree.nodes for pk in ancestor_ids):
+        # Inside a transaction the bump waits for the commit, so the
+        # cache would hand back the same stale tree; read it afresh.
+        invalidate_category_tree()
+        tree = build_category_tree()
+
+    return [tree.nodes[pk] for pk in ancestor_ids if pk in tree.nodes]
@@ -0,0 +1,110 @@
+"""
+Validators for conditional GET of catalog pages.
+
+ETags combine the catalog version, the URL and the per-visitor values
+of the page (user and cart count), so a 304 is only sent when the page
+the client holds is exactly what would be rendered. Last-Modified is
+only sent to visitors without a session, whose pages never differ from
+one another; everyone else revalidates with the ETag alone.
+
+Computing them takes no queries for category pages and one cached
+lookup for product pages, so repeat requests skip the view entirely.
+"""
+import asyncio
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .page_cache import get_catalog_modified, get_catalog_version, is_stateless_visitor, visitor_state
+from .product_cache import get_product_by_slug
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _product(slug):
+    try:
+        return get_product_by_slug(slug)
+    except Http404:
+        return None
+
+
+def catalog_page_etag(request, *args, **kwargs):
+    return _etag(get_catalog_version(), request.get_full_path(), visitor_state(request))
+
+
+def catalog_page_last_modified(request, *args, **kwargs):
+    if not is_stateless_visitor(request):
+        return None
+    return get_catalog_modified()
+
+
+def product_page_etag(request, slug):
+    """
+    Returns the ETag of a product page, or None for an unknown slug so
+    the view renders its 404.
+    """
+    product = _product(slug)
+    if product is None:
+        return None
+    return _etag(
+        product.pk, product.updated_at.isoformat(), get_catalog_version(),
+        request.get_full_path(), visitor_state(request),
+    )
+
+
+def product_page_last_modified(request, slug):
+    """
+    Returns the later of the product's ``updated_at`` and the last
+    catalog change, which covers the navigation rendered around it.
+    """
+    product = _product(slug)
+    if product is None or not is_stateless_visitor(request):
+        return None
+    return max(filter(None, (product.updated_at, get_catalog_modified())))
+
+
+def conditional_page(etag_func, last_modified_func):
+    """
+    Like Django's ``condition`` decorator, which in Django 4.2 only
+    supports sync views, but also accepts async views. Their
+    validators are computed in a thread since they may read the
+    session and the database.
+    """
+    def decorator(view):
+        if not asyncio.iscoroutinefunction(view):
+            return condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        def validators(request, args, kwargs):
+            etag = etag_func(request, *args, **kwargs)
+            last_modified = last_modified_func(request, *args, **kwargs)
+            return (
+                quote_etag(etag) if etag is not None else None,
+                int(last_modified.timestamp()) if last_modified is not None else None,
+            )
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+
+            etag, last_modified = await sync_to_async(validators)(request, args, kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+
+            if etag and not response.has_header('ETag'):
+                response.headers['ETag'] = etag
+            if last_modified and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(last_modified)
+            return response
+
+        return inner
+
+    return decorator
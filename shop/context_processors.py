@@ -1,20 +1,35 @@
-from .models import Category
+from .category_tree import get_category_tree
+from .page_cache import hole_context, is_page_cache_render
 
 
 def categories(request):
     """
-    Retrieves a list of top-level categories from the database and 
-    returns them as a dictionary.
+    Returns the cached category tree for the navigation menu.
 
     Parameters:
         request (HttpRequest): The HTTP request object.
 
     Returns:
         dict: A dictionary containing the top-level categories.
-        The keys are 'categories' and the values are a queryset of 
-        Category objects.
+        The key is 'categories' and the value is a CategoryTree whose
+        nodes already carry their children, so the template can walk
+        any depth without further queries.
     """
-    categories = Category.objects.filter(parent=None)
     return {
-        'categories': categories
-    }
\ No newline at end of file
+        'categories': get_category_tree()
+    }
+
+
+def page_cache_holes(request):
+    """
+    Replaces the per-visitor context values with markers while a page
+    is rendered for the page cache. Must come after the context
+    processors it overrides.
+
+    Returns:
+        dict: The markers keyed by the context variables they replace,
+        or an empty dict for a regular render.
+    """
+    if not is_page_cache_render(request):
+        return {}
+    return hole_context()
@@ -0,0 +1,187 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+
+from .models import FacetCount, Product
+
+
+PRICE_BANDS = (
+    (Decimal('0'), Decimal('50')),
+    (Decimal('50'), Decimal('100')),
+    (Decimal('100'), Decimal('500')),
+    (Decimal('500'), Decimal('1000')),
+    (Decimal('1000'), Decimal('5000')),
+    (Decimal('5000'), None),
+)
+
+FACET_FIELDS = ('category_id', 'brand', 'price', 'available')
+
+
+def band_key(low, high):
+    return f'{low}-{high}' if high is not None else f'{low}-'
+
+
+PRICE_BAND_KEYS = [band_key(low, high) for low, high in PRICE_BANDS]
+
+
+def price_band(price):
+    """
+    Returns the key of the price band the price falls into.
+    """
+    for low, high in PRICE_BANDS:
+        if high is None or Decimal(price) < high:
+            return band_key(low, high)
+
+
+def facet_keys(values):
+    """
+    Returns the (category_id, facet, value) keys a product contributes
+    to, given a mapping of its FACET_FIELDS. Unavailable products
+    contribute to nothing.
+    """
+    if not values or not values.get('available'):
+        return set()
+    brand = values['brand']
+    band = price_band(values['price'])
+    keys = set()
+    for category_id in (values['category_id'], None):
+        keys.add((category_id, FacetCount.BRAND, brand))
+        keys.add((category_id, FacetCount.PRICE, band))
+    return keys
+
+
+def _key_filter(keys):
+    condition = Q()
+    for category_id, facet, value in keys:
+        condition |= Q(category_id=category_id, facet=facet, value=value)
+    return condition
+
+
+def apply_delta(keys, delta):
+    """
+    Adds ``delta`` to the counters of the given keys with one UPDATE,
+    creating missing counters first when counting up.
+    """
+    if not keys:
+        return
+    with transaction.atomic():
+        if delta > 0:
+            FacetCount.objects.bulk_create(
+                [FacetCount(category_id=category_id, facet=facet, value=value) for category_id, facet, value in keys],
+                ignore_conflicts=True,
+            )
+        FacetCount.objects.filter(_key_filter(keys)).update(count=F('count') + delta)
+
+
+def update_product_facets(old_values, new_values):
+    """
+    Moves a product's contribution from its old facet keys to its new
+    ones, touching only the counters that actually changed.
+    """
+    old_keys, new_keys = facet_keys(old_values), facet_keys(new_values)
+    apply_delta(old_keys - new_keys, -1)
+    apply_delta(new_keys - old_keys, 1)
+
+
+def _price_band_expression():
+    whens = []
+    for low, high in PRICE_BANDS:
+        if high is not None:
+            whens.append(When(price__lt=high, then=Value(band_key(low, high))))
+    low, high = PRICE_BANDS[-1]
+    return Case(*whens, default=Value(band_key(low, high)))
+
+
+def rebuild_facets():
+    """
+    Recomputes every counter from scratch with grouped queries and
+    replaces the stored ones in a single transaction.
+    """
+    products = Product._base_manager.filter(available=True)
+    rows = []
+
+    for facet, expression in ((FacetCount.BRAND, F('brand')), (FacetCount.PRICE, _price_band_expression())):
+        grouped = products.annotate(facet_value=expression)
+        for category_id, value, total in (
+            grouped.values_list('category_id', 'facet_value').annotate(total=Count('id')).order_by()
+        ):
+            rows.append(FacetCount(category_id=category_id, facet=facet, value=value, count=total))
+        for value, total in grouped.values_list('facet_value').annotate(total=Count('id')).order_by():
+            rows.append(FacetCount(category_id=None, facet=facet, value=value, count=total))
+
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _facet_rows(category, subtree):
+    counts = FacetCount.objects.all()
+    if category is None:
+        counts = counts.filter(category__isnull=True)
+    elif subtree:
+        low, high = category.subtree_bounds()
+        counts = counts.filter(category__path__gte=low, category__path__lt=high)
+    else:
+        counts = counts.filter(category=category)
+    return counts.values_list('facet', 'value').annotate(total=Sum('count')).filter(total__gt=0).order_by()
+
+
+def _group_facets(rows):
+    facets = {FacetCount.BRAND: [], FacetCount.PRICE: []}
+    for facet, value, total in rows:
+        facets[facet].append((value, total))
+
+    facets[FacetCount.BRAND].sort(key=lambda item: (-item[1], item[0]))
+    facets[FacetCount.PRICE].sort(key=lambda item: PRICE_BAND_KEYS.index(item[0]))
+    return facets
+
+
+def get_facets(category=None, subtree=False):
+    """
+    Returns the facet counts for the filter sidebar with a single query.
+
+    Args:
+        category (Category): Restricts the counts to this category, or
+            to the whole catalog when None.
+        subtree (bool): Sums the counts of all descendant categories.
+
+    Returns:
+        dict: ``{'brand': [(value, count), ...], 'price': [...]}`` with
+        brands ordered by popularity and price bands in band order.
+    """
+    return _group_facets(_facet_rows(category, subtree))
+
+
+async def aget_facets(category=None, subtree=False):
+    """
+    Async version of get_facets().
+    """
+    return _group_facets([row async for row in _facet_rows(category, subtree)])
+
+
+def filter_products(queryset, params):
+    """
+    Narrows a product queryset by the ``brand`` and ``price`` GET
+    parameters. Unknown price bands are ignored.
+
+    Returns:
+        tuple: The filtered queryset and a dict of the selected values.
+    """
+    brands = [brand for brand in params.getlist('brand') if brand]
+    bands = [band for band in params.getlist('price') if band in PRICE_BAND_KEYS]
+
+    if brands:
+        queryset = queryset.filter(brand__in=brands)
+    if bands:
+        condition = Q()
+        for low, high in PRICE_BANDS:
+            if band_key(low, high) in bands:
+                band = Q(price__gte=low)
+                if high is not None:
+                    band &= Q(price__lt=high)
+                condition |= band
+        queryset = queryset.filter(condition)
+
+    return queryset, {FacetCount.BRAND: brands, FacetCount.PRICE: bands}
@@ -0,0 +1,189 @@
+"""
+Product feeds for marketplaces in CSV and JSON Lines.
+
+Rows are read with a server-side cursor and rendered one at a time, so
+the feed of the whole catalog is streamed in constant memory. The
+columns match the ones import_catalog reads, with the category given
+by its full path of names.
+
+The ``a``-prefixed functions are async iterators for ASGI. Django reads
+a sync iterator of a streaming response into a list before sending it
+under ASGI, which would hold the whole feed in memory.
+"""
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.urls import reverse
+
+from .catalog_import import CATEGORY_SEPARATOR
+from .category_tree import get_category_tree
+from .models import Product
+
+
+FEED_FIELDS = ('slug', 'category', 'title', 'brand', 'description', 'price', 'available', 'image', 'url')
+
+FEED_FORMATS = ('csv', 'jsonl')
+
+FEED_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+FEED_CHUNK_SIZE = 2000
+
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def slug_url_pattern(viewname):
+    """
+    Returns the ``(prefix, suffix)`` around the slug in the URL of the
+    view, so URLs of a million rows are built without reversing each.
+    """
+    prefix, suffix = reverse(viewname, args=['slug-placeholder']).split('slug-placeholder')
+    return prefix, suffix
+
+
+def category_paths():
+    """
+    Returns the full ``' -> '`` joined path of names of every category
+    keyed by id, built from the cached category tree.
+    """
+    paths = {}
+
+    def walk(nodes, prefix):
+        for node in nodes:
+            paths[node.id] = path = prefix + node.name
+            walk(node.children, path + CATEGORY_SEPARATOR)
+
+    walk(get_category_tree().roots, '')
+    return paths
+
+
+def feed_rows(base_url=''):
+    """
+    Yields a dict of FEED_FIELDS for every product ordered by id.
+
+    Args:
+        base_url (str): Scheme and host prepended to the page and image
+            URLs, without a trailing slash.
+    """
+    build_row = _row_builder(category_paths(), base_url)
+    for values in _feed_queryset().iterator(chunk_size=FEED_CHUNK_SIZE):
+        yield build_row(values)
+
+
+async def afeed_rows(base_url=''):
+    """
+    Async version of feed_rows().
+    """
+    build_row = _row_builder(await sync_to_async(category_paths)(), base_url)
+    # The plain values_list() iterable of Django 4.2 runs its query as
+    # soon as aiterator() starts it, in the event loop; the named one
+    # waits for the first chunk, which aiterator() fetches in a thread.
+    async for values in _feed_queryset(named=True).aiterator(chunk_size=FEED_CHUNK_SIZE):
+        yield build_row(values)
+
+
+def _feed_queryset(named=False):
+    return Product._base_manager.order_by('pk').values_list(
+        'slug', 'category_id', 'title', 'brand', 'description', 'price', 'available', 'image', named=named)
+
+
+def _row_builder(paths, base_url):
+    prefix, suffix = slug_url_pattern('shop:product_detail')
+
+    def build_row(values):
+        slug, category_id, title, brand, description, price, available, image = values
+        image_url = default_storage.url(image) if image else ''
+        return {
+            'slug': slug,
+            'category': paths.get(category_id, ''),
+            'title': title,
+            'brand': brand,
+            'description': description,
+            'price': price,
+            'available': available,
+            'image': base_url + image_url if image_url.startswith('/') else image_url,
+            'url': f'{base_url}{prefix}{slug}{suffix}',
+        }
+
+    return build_row
+
+
+class _Echo:
+    """
+    A file-like object whose write() returns what it is given, so the
+    csv module can render one line at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Echo(), FEED_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_line(row):
+    return json.dumps(row, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield jsonl_line(row)
+
+
+def feed_lines(fmt, base_url=''):
+    """
+    Returns an iterator over the lines of the feed in the given format.
+    """
+    rows = feed_rows(base_url)
+    return csv_lines(rows) if fmt == 'csv' else jsonl_lines(rows)
+
+
+async def afeed_lines(fmt, base_url=''):
+    """
+    Async version of feed_lines().
+    """
+    writer = csv.DictWriter(_Echo(), FEED_FIELDS)
+    if fmt == 'csv':
+        yield writer.writeheader()
+    async for row in afeed_rows(base_url):
+        yield writer.writerow(row) if fmt == 'csv' else jsonl_line(row)
+
+
+def buffered(lines, size=STREAM_BUFFER_SIZE):
+    """
+    Joins lines into chunks of about ``size`` characters, so a streamed
+    response is not written to the socket one short line at a time.
+    """
+    chunk, length = [], 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def abuffered(lines, size=STREAM_BUFFER_SIZE):
+    """
+    Async version of buffered().
+    """
+    chunk, length = [], 0
+    async for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
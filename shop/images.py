@@ -0,0 +1,96 @@
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+logger = logging.getLogger(__name__)
+
+
+RENDITIONS = {
+    'card': (320, 640),
+    'detail': (800, 1600),
+}
+
+RENDITIONS_DIR = 'renditions'
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpeg':
+        image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif fmt == 'png':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def _store(data, ext):
+    """
+    Saves rendition bytes under a name derived from their content, so
+    the file never changes once written and can be cached forever.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    name = f'{RENDITIONS_DIR}/{digest[:2]}/{digest}.{ext}'
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+def build_renditions(image_name):
+    """
+    Generates every rendition of a stored product image.
+
+    Each rendition kind is produced at its widths, capped at the width
+    of the original so nothing is upscaled, both in a fallback format
+    (JPEG, or PNG for images with transparency) and in WebP.
+
+    Returns:
+        dict: ``{kind: [[width, fallback_name, webp_name], ...]}``, or an
+        empty dict when the file is missing or not a readable image.
+    """
+    try:
+        with default_storage.open(image_name, 'rb') as source:
+            original = Image.open(source)
+            original.load()
+    except (OSError, UnidentifiedImageError, ValueError):
+        logger.warning('Cannot build renditions for %s', image_name)
+        return {}
+
+    original = ImageOps.exif_transpose(original)
+    has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+    original = original.convert('RGBA' if has_alpha else 'RGB')
+    fallback = 'png' if has_alpha else 'jpeg'
+
+    renditions = {}
+    for kind, widths in RENDITIONS.items():
+        entries = []
+        for width in widths:
+            if entries and width > original.width:
+                if entries[-1][0] >= original.width:
+                    break
+                width = original.width
+            resized = original.copy()
+            resized.thumbnail((width, width * 2), Image.LANCZOS)
+            entries.append([
+                resized.width,
+                _store(_encode(resized, fallback), 'jpg' if fallback == 'jpeg' else 'png'),
+                _store(_encode(resized, 'webp'), 'webp'),
+            ])
+        renditions[kind] = entries
+    return renditions
+
+
+def srcset(entries, index):
+    """
+    Formats rendition entries as an HTML ``srcset`` value using the
+    file at ``index`` (1 for the fallback format, 2 for WebP).
+    """
+    return ', '.join(f'{default_storage.url(entry[index])} {entry[0]}w' for entry in entries)
@@ -0,0 +1,123 @@
+"""
+Versioned cache invalidation shared by every worker process.
+
+Each kind of cached data belongs to a namespace with a version counter
+kept in the shared cache. Keys are derived from the current version, so
+bumping it makes every entry of the namespace unreachable at once, in
+every process, without scanning or deleting keys. Old entries simply
+expire.
+
+Model signals bump the affected namespaces. Inside ``batched()``, bumps
+are collected and applied once when the block exits, so a bulk update
+of thousands of rows costs one bump per namespace. Queryset deletes of
+categories and products, category cascades and the admin delete action
+run inside it.
+
+Inside a transaction a bump is applied when it commits. Bumping earlier
+would let another worker read the rows as they were before the commit
+and cache them under the new version, where they would stay until they
+expire.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+CATALOG = 'catalog'
+CATEGORY_TREE = 'category_tree'
+
+VERSION_KEY_PREFIX = 'shop:version:'
+MODIFIED_KEY_PREFIX = 'shop:modified:'
+
+_state = threading.local()
+
+
+def product_namespace(slug):
+    return f'product:{slug}'
+
+
+def _initial_version():
+    # Start from the clock rather than from 1, so a flushed cache never
+    # hands out a version that keys or ETags were already built from.
+    return time.time_ns() // 1000
+
+
+def get_version(namespace):
+    return cache.get_or_set(VERSION_KEY_PREFIX + namespace, _initial_version, None)
+
+
+async def aget_version(namespace):
+    return await cache.aget_or_set(VERSION_KEY_PREFIX + namespace, _initial_version, None)
+
+
+def get_modified(namespace):
+    """
+    Returns when the namespace was last bumped, or None when unknown.
+    """
+    return cache.get(MODIFIED_KEY_PREFIX + namespace)
+
+
+def versioned_key(namespace, *parts):
+    """
+    Builds a cache key that is only valid for the current version of
+    the namespace.
+    """
+    return ':'.join(['shop', namespace, str(get_version(namespace)), *(str(part) for part in parts)])
+
+
+async def aversioned_key(namespace, *parts):
+    """
+    Async version of versioned_key().
+    """
+    return ':'.join(['shop', namespace, str(await aget_version(namespace)), *(str(part) for part in parts)])
+
+
+def _bump_now(namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(VERSION_KEY_PREFIX + namespace)
+        except ValueError:
+            cache.add(VERSION_KEY_PREFIX + namespace, _initial_version(), None)
+    now = timezone.now()
+    cache.set_many({MODIFIED_KEY_PREFIX + namespace: now for namespace in namespaces}, None)
+
+
+def _bump_after_commit(namespaces):
+    # Runs right away outside of a transaction.
+    transaction.on_commit(lambda: _bump_now(namespaces))
+
+
+def bump(*namespaces):
+    """
+    Makes every key of the given namespaces stale once the current
+    transaction commits, or, inside ``batched()``, schedules that for
+    the end of the batch.
+    """
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.update(namespaces)
+    elif namespaces:
+        _bump_after_commit(set(namespaces))
+
+
+@contextmanager
+def batched():
+    """
+    Defers and deduplicates the bumps made inside the block. Nested
+    blocks join the outermost one.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        yield
+        return
+
+    _state.pending = set()
+    try:
+        yield
+    finally:
+        pending, _state.pending = _state.pending, None
+        if pending:
+            _bump_after_commit(pending)
@@ -0,0 +1,223 @@
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from shop.models import Category, ProductProxy
+
+
+SCENARIOS = (
+    'products', 'products-by-price', 'category', 'category-subtree', 'product-detail',
+    'cart-view', 'cart-add', 'cart-update', 'cart-delete', 'cart-batch',
+)
+
+CART_SIZE = 5
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of sorted values.
+    """
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the p50 and p99 latency and the queries per request of the catalog and cart views '
+        'against the current database, and saves the results as JSON for comparison between commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request.')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Run only these scenarios.')
+        parser.add_argument('--output', default=None, help='Path of the JSON results.')
+        parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with.')
+        parser.add_argument(
+            '--threshold', type=float, default=10.0, help='Percent of slowdown reported as a regression.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.categories = self.sample_categories(options['requests'])
+        self.products = self.sample_products(max(options['requests'], CART_SIZE + 1))
+        if not self.categories or len(self.products) < CART_SIZE + 1:
+            raise CommandError('The catalog is too small. Run generate_catalog first.')
+
+        results = {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'catalog': {
+                'categories': Category.objects.count(),
+                'products': ProductProxy.objects.count(),
+            },
+            'options': {key: options[key] for key in ('requests', 'warmup', 'seed', 'cold')},
+            'scenarios': {},
+        }
+
+        # The test client sends requests to the 'testserver' host.
+        with override_settings(ALLOWED_HOSTS=['testserver'], QUERY_BUDGETS_STRICT=False):
+            for name in options['scenario'] or SCENARIOS:
+                stats = self.run_scenario(name, options['requests'], options['warmup'], options['cold'])
+                results['scenarios'][name] = stats
+                self.stdout.write(
+                    f'{name:<18} p50 {stats["p50_ms"]:8.2f}ms  p99 {stats["p99_ms"]:8.2f}ms  '
+                    f'queries {stats["queries_mean"]:5.1f} (max {stats["queries_max"]})  '
+                    f'{stats["errors"]} errors')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Saved the results to {options["output"]}.'))
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline:
+                self.compare(json.load(baseline), results, options['threshold'])
+
+    def sample_categories(self, count):
+        slugs = list(Category.objects.order_by('pk').values_list('slug', flat=True)[:100_000])
+        return [self.rng.choice(slugs) for _ in range(count)] if slugs else []
+
+    def sample_products(self, count):
+        """
+        Picks available products by drawing random ids, which is cheap
+        however large the catalog is.
+        """
+        bounds = ProductProxy.objects.order_by('pk').values_list('pk', flat=True)
+        low, high = bounds.first(), bounds.last()
+        if low is None:
+            return []
+        products = []
+        for _ in range(10):
+            ids = [self.rng.randint(low, high) for _ in range(count * 2)]
+            found = ProductProxy.objects.in_bulk(ids)
+            products += [(found[pk].pk, found[pk].slug) for pk in ids if pk in found]
+            if len(products) >= count:
+                break
+        return products[:count]
+
+    def requests_for(self, name, client, index):
+        """
+        Returns the ``(method, path, data)`` to measure for the index-th
+        request of a scenario, making unmeasured requests first where the
+        scenario needs some cart state.
+        """
+        product_id, slug = self.products[index % len(self.products)]
+        category = self.categories[index % len(self.categories)]
+
+        if name == 'products':
+            return 'get', reverse('shop:products'), {}
+        if name == 'products-by-price':
+            return 'get', reverse('shop:products'), {'order': 'price'}
+        if name == 'category':
+            return 'get', reverse('shop:category_list', args=[category]), {}
+        if name == 'category-subtree':
+            return 'get', reverse('shop:category_list', args=[category]), {'subtree': '1'}
+        if name == 'product-detail':
+            return 'get', reverse('shop:product_detail', args=[slug]), {}
+        if name == 'cart-view':
+            return 'get', reverse('cart:cart-view'), {}
+
+        line = {'action': 'post', 'product_id': product_id, 'product_quantity': 2}
+        if name == 'cart-add':
+            return 'post', reverse('cart:add-to-cart'), line
+        if name == 'cart-update':
+            client.post(reverse('cart:add-to-cart'), {**line, 'product_quantity': 1})
+            return 'post', reverse('cart:update-to-cart'), line
+        if name == 'cart-delete':
+            client.post(reverse('cart:add-to-cart'), line)
+            return 'post', reverse('cart:delete-to-cart'), line
+        other_id = self.products[(index + 1) % len(self.products)][0]
+        body = json.dumps({'operations': [
+            {'op': 'add', 'product_id': product_id, 'quantity': 1},
+            {'op': 'update', 'product_id': product_id, 'quantity': 3},
+            {'op': 'delete', 'product_id': other_id},
+        ]})
+        return 'batch', reverse('cart:batch-cart'), body
+
+    def run_scenario(self, name, count, warmup, cold):
+        client = Client(raise_request_exception=False)
+        if name.startswith('cart-'):
+            operations = [
+                {'op': 'add', 'product_id': product_id, 'quantity': 1}
+                for product_id, slug in self.products[-CART_SIZE:]
+            ]
+            client.post(reverse('cart:batch-cart'), json.dumps({'operations': operations}),
+                        content_type='application/json')
+
+        cache.clear()
+        latencies, queries, errors = [], [], 0
+        for index in range(warmup + count):
+            method, path, data = self.requests_for(name, client, index)
+            if cold:
+                cache.clear()
+
+            started = time.perf_counter()
+            if method == 'batch':
+                response = client.post(path, data, content_type='application/json')
+            else:
+                response = getattr(client, method)(path, data)
+            elapsed = time.perf_counter() - started
+
+            if index < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            queries.append(response.metrics.queries)
+            errors += response.status_code != 200
+
+        latencies.sort()
+        return {
+            'requests': count,
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries_mean': round(statistics.fmean(queries), 2),
+            'queries_max': max(queries),
+        }
+
+    def compare(self, baseline, results, threshold):
+        self.stdout.write(f'Compared with {baseline.get("commit") or "the baseline"}:')
+        regressions = 0
+        for name, stats in results['scenarios'].items():
+            old = baseline.get('scenarios', {}).get(name)
+            if old is None:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p99_ms', 'queries_mean'):
+                change = (stats[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                changes.append(f'{key} {change:+.1f}%')
+                if change > threshold or (key == 'queries_mean' and stats[key] > old[key]):
+                    regressions += 1
+                    changes[-1] += ' REGRESSION'
+            self.stdout.write(f'{name:<18} ' + ', '.join(changes))
+
+        if regressions:
+            self.stdout.write(self.style.WARNING(f'{regressions} regressions over {threshold}%.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No regressions.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from shop.feeds import FEED_FORMATS, buffered, feed_lines
+
+
+class Command(BaseCommand):
+    help = 'Streams the product feed in CSV or JSON Lines to a file or to stdout using a server-side cursor.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FEED_FORMATS, default='csv')
+        parser.add_argument('--output', default=None, help='Path of the feed file. Defaults to stdout.')
+        parser.add_argument('--base-url', default='', help='Scheme and host prepended to the URLs.')
+
+    def handle(self, *args, **options):
+        lines = buffered(feed_lines(options['format'], options['base_url'].rstrip('/')))
+        if options['output'] is None:
+            for chunk in lines:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for chunk in lines:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Wrote the feed to {options["output"]}.'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.models import Category, Product
+from shop.synthetic import generate_catalog
+
+
+class Command(BaseCommand):
+    help = 'Fills an empty database with a reproducible synthetic catalog for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10_000)
+        parser.add_argument('--depth', type=int, default=5, help='Levels of the category tree.')
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if Category.objects.exists() or Product._base_manager.exists():
+            raise CommandError('The catalog is not empty. Point the settings at an empty database first.')
+        if options['categories'] < 1 or options['depth'] < 1:
+            raise CommandError('At least one category on one level is required.')
+
+        started = time.monotonic()
+        generate_catalog(
+            categories=options['categories'], depth=options['depth'], products=options['products'],
+            seed=options['seed'], progress=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {options["categories"]} categories and {options["products"]} products '
+            f'in {time.monotonic() - started:.1f}s.'))
@@ -0,0 +1,61 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from shop.images import build_renditions
+from shop.invalidation import CATALOG, batched, bump, product_namespace
+from shop.models import Product
+
+
+def _build(item):
+    pk, slug, image_name = item
+    return pk, slug, build_renditions(image_name)
+
+
+class Command(BaseCommand):
+    help = 'Builds the thumbnail and WebP renditions of product images in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild renditions that already exist.')
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        products = Product._base_manager.exclude(image='').order_by('pk')
+        if not options['all']:
+            products = products.filter(renditions={})
+
+        batch_size = options['batch_size']
+        done = 0
+        started = time.monotonic()
+        last_pk = 0
+
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            while True:
+                batch = list(products.filter(pk__gt=last_pk).values_list('pk', 'slug', 'image')[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+
+                now = timezone.now()
+                built = list(pool.map(_build, batch, chunksize=16))
+                Product._base_manager.bulk_update(
+                    [Product(pk=pk, renditions=renditions, updated_at=now) for pk, slug, renditions in built],
+                    ['renditions', 'updated_at'],
+                )
+                # The cached detail lookups still hold the products
+                # without their renditions.
+                with batched():
+                    bump(*(product_namespace(slug) for pk, slug, renditions in built))
+
+                done += len(batch)
+                self.stdout.write(f'{done} images, {done / (time.monotonic() - started):.1f}/s')
+
+        if done:
+            bump(CATALOG)
+        self.stdout.write(self.style.SUCCESS(f'Built renditions for {done} products.'))
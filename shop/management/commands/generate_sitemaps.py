@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.sitemaps import build_sitemaps
+
+
+class Command(BaseCommand):
+    help = 'Rewrites the sitemap chunks of the products and categories that changed since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rewrite every chunk.')
+        parser.add_argument('--base-url', default=settings.SITE_URL, help='Scheme and host of the site.')
+
+    def handle(self, *args, **options):
+        written, deleted = build_sitemaps(options['base_url'].rstrip('/'), full=options['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rewrote {len(written)} sitemap chunks and deleted {len(deleted)}.'))
@@ -0,0 +1,59 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_import import CatalogImporter, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams products from a CSV or JSON Lines file into the catalog in batches, '
+        'creating missing categories and updating products with known slugs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row, or a .jsonl file.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default=None, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--images-dir', default=None, help='Directory of the image files. Defaults to the directory of the file.')
+        parser.add_argument('--workers', type=int, default=None, help='Number of threads copying images.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'{path} does not exist.')
+        images_dir = options['images_dir'] or os.path.dirname(os.path.abspath(path))
+
+        batch_size = options['batch_size']
+        read = skipped = 0
+        started = time.monotonic()
+
+        with CatalogImporter(images_dir, options['workers']) as importer:
+            batch = []
+            for record in read_records(path, options['format']):
+                batch.append(record)
+                if len(batch) < batch_size:
+                    continue
+                read, skipped = self.import_batch(importer, batch, read, skipped, started)
+                batch = []
+            if batch:
+                read, skipped = self.import_batch(importer, batch, read, skipped, started)
+
+            importer.finish()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {read - skipped} rows in {elapsed:.1f}s ({read / elapsed if elapsed else 0:.0f} rows/s): '
+            f'{importer.created} created, {importer.updated} updated, {skipped} skipped. '
+            f'Run generate_renditions to build the thumbnails of new images.'
+        ))
+
+    def import_batch(self, importer, batch, read, skipped, started):
+        for line_num, message in importer.import_batch(batch):
+            self.stderr.write(f'Line {line_num}: {message}')
+            skipped += 1
+        read += len(batch)
+        self.stdout.write(f'{read} rows, {read / (time.monotonic() - started):.0f} rows/s')
+        return read, skipped
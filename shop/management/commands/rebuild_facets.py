@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from shop.facets import rebuild_facets
+from shop.invalidation import CATALOG, bump
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the brand and price band facet counters from the product table.'
+
+    def handle(self, *args, **options):
+        total = rebuild_facets()
+        bump(CATALOG)
+        self.stdout.write(self.style.SUCCESS(f'Stored {total} facet counters.'))
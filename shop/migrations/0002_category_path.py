@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_category_paths(apps, schema_editor):
+    """
+    Computes the materialized path and depth of every existing
+    category from the parent links and stores them in batches.
+    """
+    Category = apps.get_model('shop', 'Category')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def path_of(pk):
+        if pk not in paths:
+            chain = []
+            node = pk
+            while node is not None and node not in paths:
+                chain.append(node)
+                node = parents[node]
+            prefix = paths[node] if node is not None else ''
+            for item in reversed(chain):
+                prefix = paths[item] = f'{prefix}{item}/'
+        return paths[pk]
+
+    categories = []
+    for pk in parents:
+        path = path_of(pk)
+        categories.append(Category(pk=pk, path=path, depth=path.count('/') - 1))
+    Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ProductManager',
+        ),
+        migrations.AlterModelOptions(
+            name='category',
+            options={'verbose_name': 'Категорию', 'verbose_name_plural': 'Категории'},
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Уровень'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, verbose_name='Путь'),
+        ),
+        migrations.RunPython(backfill_category_paths, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='shop.category', verbose_name='Категория'),
+        ),
+    ]
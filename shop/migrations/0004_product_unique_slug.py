@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_product_slugs(apps, schema_editor):
+    """
+    Keeps the oldest product on every duplicated (or empty) slug and
+    suffixes the others with their id, so the unique index can be built.
+    """
+    Product = apps.get_model('shop', 'Product')
+    duplicated = (
+        Product.objects.values('slug')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('slug', flat=True)
+    )
+    renamed = []
+    taken = set()
+    for slug in list(duplicated) + ['']:
+        products = Product.objects.filter(slug=slug).order_by('id').only('id', 'slug')
+        if slug:
+            products = products[1:]
+        for product in products:
+            base = f'{slug or "product"}-{product.id}'[:200]
+            candidate, attempt = base, 1
+            while candidate in taken or Product.objects.filter(slug=candidate).exists():
+                attempt += 1
+                candidate = f'{base[:190]}-{attempt}'
+            taken.add(candidate)
+            product.slug = candidate
+            renamed.append(product)
+    Product.objects.bulk_update(renamed, ['slug'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_product_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(max_length=200, unique=True, verbose_name='URL'),
+        ),
+    ]
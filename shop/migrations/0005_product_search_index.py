@@ -0,0 +1,97 @@
+import re
+
+from django.db import migrations
+
+try:
+    import snowballstemmer
+except ImportError:
+    snowballstemmer = None
+
+
+# A frozen copy of the index structures and tokenizer in shop.search as of
+# this migration, so later changes to that module cannot change its effect.
+
+FTS_TABLE = 'shop_product_fts'
+
+PG_INDEX = 'shop_product_search_idx'
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('russian', title), 'A') || "
+    "setweight(to_tsvector('russian', brand), 'B') || "
+    "setweight(to_tsvector('russian', description), 'C') || "
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', brand), 'B') || "
+    "setweight(to_tsvector('english', description), 'C')"
+)
+
+INDEX_BATCH_SIZE = 2000
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC_RE = re.compile(r'[а-яё]')
+
+
+def _tokenizer():
+    if snowballstemmer is None:
+        return lambda text: ' '.join(_WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+    stemmers = {
+        'russian': snowballstemmer.stemmer('russian'),
+        'english': snowballstemmer.stemmer('english'),
+    }
+
+    def tokenize(text):
+        words = _WORD_RE.findall(text.lower().replace('ё', 'е'))
+        return ' '.join(
+            stemmers['russian' if _CYRILLIC_RE.search(word) else 'english'].stemWord(word) for word in words
+        )
+
+    return tokenize
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON shop_product USING GIN (({PG_DOCUMENT}))')
+            return
+        if connection.vendor != 'sqlite':
+            return
+
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            'title, brand, description, tokenize="unicode61 remove_diacritics 2")'
+        )
+        tokenize = _tokenizer()
+        last_id = 0
+        while True:
+            cursor.execute(
+                'SELECT id, title, brand, description FROM shop_product '
+                'WHERE id > %s ORDER BY id LIMIT %s', [last_id, INDEX_BATCH_SIZE])
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, title, brand, description) VALUES (%s, %s, %s, %s)',
+                [(pk, tokenize(title), tokenize(brand), tokenize(description)) for pk, title, brand, description in rows],
+            )
+            last_id = rows[-1][0]
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_product_unique_slug'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
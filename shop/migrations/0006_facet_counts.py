@@ -0,0 +1,76 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:56
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Value, When
+import django.db.models.deletion
+
+
+# A frozen copy of the price bands in shop.facets as of this migration.
+PRICE_BANDS = (
+    (Decimal('0'), Decimal('50')),
+    (Decimal('50'), Decimal('100')),
+    (Decimal('100'), Decimal('500')),
+    (Decimal('500'), Decimal('1000')),
+    (Decimal('1000'), Decimal('5000')),
+    (Decimal('5000'), None),
+)
+
+
+def band_key(low, high):
+    return f'{low}-{high}' if high is not None else f'{low}-'
+
+
+def backfill_facet_counts(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    FacetCount = apps.get_model('shop', 'FacetCount')
+
+    band = Case(
+        *(When(price__lt=high, then=Value(band_key(low, high))) for low, high in PRICE_BANDS if high is not None),
+        default=Value(band_key(*PRICE_BANDS[-1])),
+    )
+    products = Product._base_manager.filter(available=True)
+    rows = []
+    for facet, expression in (('brand', F('brand')), ('price', band)):
+        grouped = products.annotate(facet_value=expression)
+        for category_id, value, total in (
+            grouped.values_list('category_id', 'facet_value').annotate(total=Count('id')).order_by()
+        ):
+            rows.append(FacetCount(category_id=category_id, facet=facet, value=value, count=total))
+        for value, total in grouped.values_list('facet_value').annotate(total=Count('id')).order_by():
+            rows.append(FacetCount(category_id=None, facet=facet, value=value, count=total))
+    FacetCount.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('brand', 'Бренд'), ('price', 'Цена')], max_length=10, verbose_name='Фасет')),
+                ('value', models.CharField(max_length=200, verbose_name='Значение')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='shop.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фасета',
+                'verbose_name_plural': 'Счётчики фасетов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('category', 'facet', 'value'), name='facet_count_category_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('facet', 'value'), name='facet_count_catalog_unique'),
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
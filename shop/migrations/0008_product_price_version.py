@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_product_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='price_version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Версия цены'),
+        ),
+    ]
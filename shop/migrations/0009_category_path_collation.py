@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def use_bytewise_collation(apps, schema_editor):
+    # Locale collations of PostgreSQL, such as en_US, skip '/' when
+    # comparing, which breaks the path ranges of Category.subtree_bounds.
+    # SQLite compares bytes already.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE shop_category ALTER COLUMN path TYPE varchar(255) COLLATE "C"')
+
+
+def use_default_collation(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE shop_category ALTER COLUMN path TYPE varchar(255) COLLATE "default"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_price_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(use_bytewise_collation, use_default_collation),
+    ]
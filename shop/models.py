@@ -1,17 +1,54 @@
 import random
 import string
+from decimal import Decimal
 
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 from django.urls import reverse
 
+from .invalidation import batched
 
-def rand_slug():
+
+def rand_slug(length=3):
     """
-    Generate a random slug of 3 characters using a combination
-    of letters (both lowercase and uppercase) and digits.
+    Generate a random slug of ``length`` characters using a combination
+    of lowercase letters and digits.
     """
-    return ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(3))
+    return ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(length))
+
+
+CYRILLIC_TO_LATIN = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya', 'і': 'i', 'ї': 'yi', 'є': 'ye', 'ґ': 'g',
+})
+
+
+def transliterate(text):
+    """
+    Spells Cyrillic letters in Latin ones, so titles keep their words in
+    ASCII slugs, which the ``slug`` URL converter requires.
+    """
+    return text.lower().translate(CYRILLIC_TO_LATIN)
+
+
+PRODUCT_SLUG_SUFFIX_LENGTH = 6
+
+PRODUCT_SLUG_ATTEMPTS = 5
+
+
+class CatalogQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Deletes the rows with the cache bumps of their post_delete
+        signals batched, so each namespace is bumped once, not per row.
+        """
+        with batched():
+            return super().delete()
 
 
 class Category(models.Model):
@@ -23,8 +60,12 @@ class Category(models.Model):
         'self', on_delete=models.CASCADE, related_name='children', verbose_name='Родительская категория', blank=True, null=True
     )
     slug = models.SlugField('URL', max_length=200, unique=True, null=False, editable=True)
+    path = models.CharField('Путь', max_length=255, db_index=True, editable=False, blank=True)
+    depth = models.PositiveSmallIntegerField('Уровень', default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CatalogQuerySet.as_manager()
+
     class Meta:
         unique_together = (['slug', 'parent'])
         verbose_name = 'Категорию'
@@ -34,28 +75,118 @@ class Category(models.Model):
         """
         Returns a string representation of the object.
 
-        This method constructs a string representation of the object 
-        by traversing the parent-child hierarchy of the object and constructing 
-        a full path from the root to the current object. The full path is constructed 
-        by concatenating the names of each object in the hierarchy, separated by ' -> '.
-        The resulting string is returned.
-        """
-        full_path = [self.name]
-        k = self.parent
-        while k is not None:
-            full_path.append(k.name)
-            k = k.parent
-        return ' -> '.join(full_path[::-1])
-    
+        The full path from the root to the current object is built from
+        the materialized ``path`` and the cached category tree, so no
+        parent rows are fetched. The names are separated by ' -> '.
+        """
+        from .category_tree import get_ancestor_nodes
+
+        full_path = [node.name for node in get_ancestor_nodes(self)]
+        full_path.append(self.name)
+        return ' -> '.join(full_path)
+
+
+    @property
+    def ancestor_ids(self):
+        """
+        Returns the ids of the ancestors from the root down to the
+        parent, read straight from the materialized path.
+        """
+        return [int(pk) for pk in self.path.split('/')[:-2]]
+
+
+    def get_ancestors(self):
+        """
+        Returns a queryset of the ancestors ordered from the root.
+        """
+        return Category.objects.filter(pk__in=self.ancestor_ids).order_by('depth')
+
+
+    def get_descendants(self, include_self=False):
+        """
+        Returns a queryset of every category below this one.
+        """
+        low, high = self.subtree_bounds()
+        descendants = Category.objects.filter(path__gte=low, path__lt=high)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+
+    def subtree_bounds(self):
+        """
+        Returns the half-open ``[low, high)`` range of paths covering this
+        category and all of its descendants.
+
+        Every path in the subtree starts with ``self.path``, which ends
+        with '/'. The next character after '/' is '0', so replacing the
+        trailing slash with '0' gives the first path past the subtree.
+        This lets one indexed range scan on ``path`` answer the lookup.
+
+        The range needs ``path`` to be compared byte by byte, which is
+        how SQLite compares. On PostgreSQL migration 0009 gives the column
+        the "C" collation, since locale collations skip the slashes.
+        """
+        return self.path, self.path[:-1] + '0'
+
+
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the category with its subtree and products, bumping each
+        cache namespace once for the whole cascade.
+        """
+        with batched():
+            return super().delete(*args, **kwargs)
+
+
+    def clean(self):
+        """
+        Forbids moving a category under itself or one of its descendants.
+        """
+        if self.pk and self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first()
+            if parent_path and self.path and parent_path.startswith(self.path):
+                raise ValidationError({'parent': 'Категория не может быть вложена сама в себя.'})
+
 
     def save(self, *args, **kwargs):
         """
         Saves the object to the database.
+
+        After the row is written the materialized path is recomputed
+        from the parent. When the category is re-parented, the paths and
+        depths of the whole subtree are rewritten with a single UPDATE,
+        in the same transaction as the row.
         """
 
         if not self.slug:
             self.slug = slugify(rand_slug() + 'pickBetter' + self.name)
-        return super(Category, self).save(*args, **kwargs)
+
+        old_path, old_depth = self.path, self.depth
+        try:
+            with transaction.atomic():
+                super(Category, self).save(*args, **kwargs)
+                self._save_path()
+        except Exception:
+            self.path, self.depth = old_path, old_depth
+            raise
+
+    def _save_path(self):
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+        path = f'{parent_path}{self.pk}/'
+
+        if path != self.path:
+            old_path, old_depth = self.path, self.depth
+            self.path, self.depth = path, path.count('/') - 1
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
+            if old_path:
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - old_depth),
+                )
     
 
     def get_absolute_url(self):
@@ -75,23 +206,100 @@ class Product(models.Model):
     title = models.CharField('Наименование', max_length=200)
     brand = models.CharField('Бренд', max_length=200)
     description = models.TextField('Описание', blank=True)
-    slug = models.SlugField('URL', max_length=200)
+    slug = models.SlugField('URL', max_length=200, unique=True)
     price = models.DecimalField('Цена', max_digits=7, decimal_places=2, default=99.99)
+    price_version = models.PositiveIntegerField('Версия цены', default=1, editable=False)
     image = models.ImageField('Изображение', upload_to='products/%Y/%m/%d')
+    renditions = models.JSONField('Миниатюры', default=dict, blank=True, editable=False)
     available = models.BooleanField('Наличие', default=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
 
+    objects = CatalogQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_id_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_id_idx'),
+        ]
         
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the values loaded from the database so that signal
+        handlers can tell what changed on the next save.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def __str__(self):
         """
          Returns a string representation of the object.
         """
         return self.title
+
+    def _generate_slug(self):
+        """
+        Returns the transliterated title with a random suffix that no
+        other product has taken yet.
+        """
+        max_base = self._meta.get_field('slug').max_length - PRODUCT_SLUG_SUFFIX_LENGTH * 2 - 1
+        base = slugify(transliterate(self.title))[:max_base].strip('-') or 'product'
+        for _ in range(PRODUCT_SLUG_ATTEMPTS):
+            slug = f'{base}-{rand_slug(PRODUCT_SLUG_SUFFIX_LENGTH)}'
+            if not Product._base_manager.filter(slug=slug).exists():
+                return slug
+        # A run of collisions means the suffixes of this title are
+        # crowded, so fall back to a suffix twice as long.
+        return f'{base}-{rand_slug(PRODUCT_SLUG_SUFFIX_LENGTH * 2)}'
+
+    def _stored_price(self):
+        """
+        Returns the price stored for this product: the one it was loaded
+        with or, for an instance built by hand or loaded without its
+        price, the one read from its row. None when it has no row yet.
+        """
+        if self.pk is None:
+            return None
+        loaded_values = getattr(self, '_loaded_values', {})
+        if 'price' in loaded_values:
+            return loaded_values['price']
+        return Product._base_manager.filter(pk=self.pk).values_list('price', flat=True).first()
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the object to the database, generating a slug from the
+        title when none was given and bumping the price version when the
+        price changed, so carts can tell their captured price is stale.
+        The saved values become the new baseline for change tracking.
+
+        The version is incremented in the database, so two concurrent
+        price changes both count.
+        """
+        if not self.slug:
+            self.slug = self._generate_slug()
+
+        stored_price = self._stored_price()
+        price_changed = stored_price is not None and Decimal(str(self.price)) != stored_price
+        if price_changed:
+            self.price_version = F('price_version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'price_version'}
+
+        super(Product, self).save(*args, **kwargs)
+        if price_changed:
+            self.refresh_from_db(fields=['price_version'])
+        # Stored as from_db() would load them, so a float or string price
+        # set on the instance compares equal to the same price read back.
+        self._loaded_values = {
+            field.attname: field.to_python(getattr(self, field.attname)) for field in self._meta.concrete_fields
+        }
         
     def get_absolute_url(self):
         """
@@ -100,13 +308,21 @@ class Product(models.Model):
         return reverse('shop:product_detail', args=[str(self.slug)])
 
 
-class ProductManager(models.Manager):
+class ProductManager(models.Manager.from_queryset(CatalogQuerySet)):
     def get_queryset(self):
         """
         Returns a queryset of available objects.
         """
         return super(ProductManager, self).get_queryset().filter(available=True)
 
+    def in_category_tree(self, category):
+        """
+        Returns available products of the category and all of its
+        descendants, selected by the category path range.
+        """
+        low, high = category.subtree_bounds()
+        return self.get_queryset().filter(category__path__gte=low, category__path__lt=high)
+
 
 
 class ProductProxy(Product):
@@ -116,7 +332,38 @@ class ProductProxy(Product):
     class Meta:
         proxy = True
 
-        
 
 
+class FacetCount(models.Model):
+    """
+    A precomputed number of available products sharing one facet value.
+
+    Rows with an empty category hold the totals of the whole catalog.
+    """
+    BRAND = 'brand'
+    PRICE = 'price'
+    FACET_CHOICES = (
+        (BRAND, 'Бренд'),
+        (PRICE, 'Цена'),
+    )
+
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name='facet_counts', verbose_name='Категория', blank=True, null=True
+    )
+    facet = models.CharField('Фасет', max_length=10, choices=FACET_CHOICES)
+    value = models.CharField('Значение', max_length=200)
+    count = models.IntegerField('Количество', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчик фасета'
+        verbose_name_plural = 'Счётчики фасетов'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'facet', 'value'], name='facet_count_category_unique'),
+            models.UniqueConstraint(
+                fields=['facet', 'value'], condition=models.Q(category__isnull=True), name='facet_count_catalog_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.facet}={self.value}: {self.count}'
 
@@ -0,0 +1,185 @@
+"""
+Full-page cache for anonymous catalog pages.
+
+Catalog pages render the same HTML for every anonymous visitor except a
+few per-visitor "holes", such as the cart badge and the CSRF token.
+While a page is rendered for the cache, the ``page_cache_holes`` context
+processor replaces those values with markers. The stored HTML still
+contains the markers, and they are filled in for each visitor when the
+page is served.
+
+Pages are keyed by their full URL and the version of the catalog
+namespace, which the Product and Category signals bump, so a change
+makes every cached page unreachable at once without deleting keys.
+"""
+import asyncio
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .invalidation import CATALOG, get_modified, get_version, versioned_key
+
+
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+_holes = {}
+
+_varying_holes = set()
+
+
+def hole_marker(name):
+    return f'[[page-cache:{name}]]'
+
+
+def register_hole(name, fill, varies=True):
+    """
+    Registers a per-visitor value that is left out of cached pages.
+
+    Args:
+        name (str): The template context variable rendered as a marker.
+        fill (callable): Takes the request and returns the text that
+            replaces the marker when a page is served.
+        varies (bool): Whether a change of the value changes the page
+            for the visitor, so it must be part of its validators.
+    """
+    _holes[name] = fill
+    if varies:
+        _varying_holes.add(name)
+    else:
+        _varying_holes.discard(name)
+
+
+# Any masked token of the visitor's secret is valid, so a page kept by
+# the browser does not go stale when the token is re-masked.
+register_hole('csrf_token', get_token, varies=False)
+
+
+def hole_context():
+    """
+    Returns the markers that stand in for every registered hole.
+    """
+    return {name: hole_marker(name) for name in _holes}
+
+
+def get_catalog_version():
+    return get_version(CATALOG)
+
+
+def get_catalog_modified():
+    """
+    Returns when the catalog last changed, or None when unknown.
+    """
+    return get_modified(CATALOG)
+
+
+def page_cache_key(request):
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return versioned_key(CATALOG, 'page', digest)
+
+
+def is_page_cache_render(request):
+    return getattr(request, '_page_cache_render', False)
+
+
+def visitor_state(request):
+    """
+    Returns the per-visitor values a catalog page depends on: the user
+    and the value of every varying hole, such as the cart count.
+    """
+    user = getattr(request, 'user', None)
+    user_id = user.pk if user is not None and user.is_authenticated else ''
+    return ':'.join([str(user_id), *(str(_holes[name](request)) for name in sorted(_varying_holes))])
+
+
+def is_stateless_visitor(request):
+    """
+    Tells whether the request carries no session, so the page cannot
+    differ from what any other anonymous visitor gets.
+    """
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def fill_holes(request, content):
+    for name, fill in _holes.items():
+        marker = hole_marker(name)
+        if marker in content:
+            content = content.replace(marker, str(fill(request)))
+    return content
+
+
+def _lookup(request):
+    """
+    Returns the cache key of a cacheable request, or None, and the
+    cached response with its holes filled when there is one.
+    """
+    user = getattr(request, 'user', None)
+    if request.method not in ('GET', 'HEAD') or (user is not None and user.is_authenticated):
+        return None, None
+
+    key = page_cache_key(request)
+    content = cache.get(key)
+    if content is None:
+        return key, None
+    response = HttpResponse(fill_holes(request, content))
+    response['X-Page-Cache'] = 'hit'
+    return key, response
+
+
+def _store(request, key, response):
+    if response.status_code != 200 or response.streaming or not response['Content-Type'].startswith('text/html'):
+        return response
+
+    content = response.content.decode(response.charset)
+    cache.set(key, content, PAGE_CACHE_TIMEOUT)
+    response.content = fill_holes(request, content)
+    response['X-Page-Cache'] = 'miss'
+    return response
+
+
+def cache_anonymous_page(view):
+    """
+    Serves GET and HEAD requests of anonymous visitors from the page
+    cache, rendering and storing the page on a miss. Only successful
+    HTML responses are stored. Works with sync and async views.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # Resolving the user and filling holes read the session,
+            # which Django 4.2 only does synchronously.
+            key, response = await sync_to_async(_lookup)(request)
+            if key is None:
+                return await view(request, *args, **kwargs)
+            if response is not None:
+                return response
+
+            request._page_cache_render = True
+            try:
+                response = await view(request, *args, **kwargs)
+            finally:
+                request._page_cache_render = False
+            return await sync_to_async(_store)(request, key, response)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, response = _lookup(request)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if response is not None:
+            return response
+
+        request._page_cache_render = True
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            request._page_cache_render = False
+        return _store(request, key, response)
+
+    return wrapper
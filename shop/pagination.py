@@ -0,0 +1,221 @@
+import base64
+import binascii
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import BadRequest
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+# Ordering terms as passed to order_by(), a leading '-' sorting descending.
+ORDERINGS = {
+    'new': ('-created_at', '-id'),
+    'price': ('price', 'id'),
+}
+
+DEFAULT_ORDERING = 'new'
+
+_PARSERS = {
+    'created_at': parse_datetime,
+    'price': Decimal,
+    'id': int,
+}
+
+
+def encode_cursor(direction, ordering, values):
+    """
+    Packs a keyset position into an opaque, URL-safe token.
+
+    Args:
+        direction (str): 'n' for the next page, 'p' for the previous one.
+        ordering (str): A key of ORDERINGS.
+        values (tuple): The ordering values of the boundary row.
+    """
+    payload = json.dumps([direction, ordering, [str(value) for value in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Unpacks a token produced by encode_cursor.
+
+    Raises:
+        BadRequest: If the token is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, ordering, raw_values = json.loads(base64.urlsafe_b64decode(padded))
+        fields = ORDERINGS[ordering]
+        values = tuple(_PARSERS[_field(term)](raw) for term, raw in zip(fields, raw_values, strict=True))
+    except (binascii.Error, ValueError, TypeError, KeyError, InvalidOperation) as exc:
+        raise BadRequest('Invalid cursor.') from exc
+
+    if direction not in ('n', 'p') or None in values:
+        raise BadRequest('Invalid cursor.')
+    return direction, ordering, values
+
+
+def _field(term):
+    return term.lstrip('-')
+
+
+def _keyset_filter(terms, values, forward):
+    """
+    Builds ``(a, b) > (x, y)`` as portable OR-ed conditions, comparing
+    each field with ``>`` or ``<`` by its direction in the ordering and
+    flipping them all when seeking backwards.
+    """
+    condition = Q()
+    for index, term in enumerate(terms):
+        lookup = 'lt' if term.startswith('-') == forward else 'gt'
+        step = Q(**{_field(previous): value for previous, value in zip(terms[:index], values[:index])})
+        step &= Q(**{f'{_field(term)}__{lookup}': values[index]})
+        condition |= step
+    return condition
+
+
+class KeysetPage:
+    """
+    One page of a keyset-paginated listing.
+
+    Attributes:
+        object_list (list): The rows on this page, in display order.
+        next_cursor (str): Token for the following page, or None.
+        previous_cursor (str): Token for the preceding page, or None.
+    """
+
+    def __init__(self, object_list, ordering, next_cursor, previous_cursor, params):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self._params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def _query(self, cursor):
+        params = self._params.copy()
+        params['cursor'] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor)
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor)
+
+    @property
+    def alternate_ordering(self):
+        return 'price' if self.ordering == 'new' else 'new'
+
+    @property
+    def alternate_ordering_query(self):
+        """
+        Returns the query string of the first page in the other ordering,
+        keeping every other parameter such as filters.
+        """
+        params = self._params.copy()
+        params['order'] = self.alternate_ordering
+        return params.urlencode()
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by seeking past the last seen ordering key
+    instead of using OFFSET, so every page costs the same index range
+    scan no matter how deep it is.
+    """
+
+    def __init__(self, queryset, per_page=20):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def _parse(self, request):
+        """
+        Reads the ``order`` and ``cursor`` GET parameters.
+
+        Returns:
+            tuple: ``(ordering, direction, values, params)`` where
+            ``values`` is None for the first page.
+        """
+        ordering = request.GET.get('order', DEFAULT_ORDERING)
+        if ordering not in ORDERINGS:
+            ordering = DEFAULT_ORDERING
+
+        params = request.GET.copy()
+        params.pop('cursor', None)
+
+        cursor = request.GET.get('cursor')
+        if not cursor:
+            return ordering, 'n', None, params
+
+        direction, cursor_ordering, values = decode_cursor(cursor)
+        if cursor_ordering != ordering:
+            raise BadRequest('Cursor does not match the requested ordering.')
+        return ordering, direction, values, params
+
+    def paginate(self, request):
+        """
+        Returns the KeysetPage selected by the ``order`` and ``cursor``
+        GET parameters of the request.
+        """
+        return self.page(*self._parse(request))
+
+    async def apaginate(self, request):
+        """
+        Async version of paginate(), reading the rows with the async ORM.
+        """
+        return await self.apage(*self._parse(request))
+
+    def _queryset(self, ordering, direction, values):
+        terms = ORDERINGS[ordering]
+        forward = direction == 'n'
+        queryset = self.queryset
+        if forward:
+            queryset = queryset.order_by(*terms)
+        else:
+            queryset = queryset.order_by(*(_field(term) if term.startswith('-') else f'-{term}' for term in terms))
+        if values is not None:
+            queryset = queryset.filter(_keyset_filter(terms, values, forward))
+        return queryset[:self.per_page + 1]
+
+    def _build_page(self, rows, ordering, direction, values, params):
+        fields = ORDERINGS[ordering]
+        forward = direction == 'n'
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        has_next = has_more if forward else True
+        has_previous = values is not None if forward else has_more
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor('n', ordering, [getattr(rows[-1], _field(term)) for term in fields])
+        if rows and has_previous:
+            previous_cursor = encode_cursor('p', ordering, [getattr(rows[0], _field(term)) for term in fields])
+
+        return KeysetPage(rows, ordering, next_cursor, previous_cursor, params)
+
+    def page(self, ordering, direction, values, params):
+        rows = list(self._queryset(ordering, direction, values))
+        return self._build_page(rows, ordering, direction, values, params)
+
+    async def apage(self, ordering, direction, values, params):
+        rows = [row async for row in self._queryset(ordering, direction, values)]
+        return self._build_page(rows, ordering, direction, values, params)
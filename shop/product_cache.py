@@ -0,0 +1,59 @@
+from django.core.cache import cache
+from django.http import Http404
+
+from .invalidation import aversioned_key, bump, product_namespace, versioned_key
+from .models import ProductProxy
+
+
+PRODUCT_CACHE_TIMEOUT = 60 * 15
+
+
+def product_cache_key(slug):
+    return versioned_key(product_namespace(slug))
+
+
+def get_product_by_slug(slug):
+    """
+    Returns the available product with the given slug, reading it
+    from the cache and falling back to a unique-index lookup.
+
+    Raises:
+        Http404: If no available product has this slug.
+    """
+    key = product_cache_key(slug)
+    product = cache.get(key)
+    if product is None:
+        try:
+            product = ProductProxy.objects.get(slug=slug)
+        except ProductProxy.DoesNotExist:
+            raise Http404('No product matches the given query.')
+        cache.set(key, product, PRODUCT_CACHE_TIMEOUT)
+    return product
+
+
+async def aget_product_by_slug(slug):
+    """
+    Async version of get_product_by_slug(), using the async cache API
+    and falling back to the async ORM on a miss.
+    """
+    key = await aversioned_key(product_namespace(slug))
+    product = await cache.aget(key)
+    if product is None:
+        try:
+            product = await ProductProxy.objects.aget(slug=slug)
+        except ProductProxy.DoesNotExist:
+            raise Http404('No product matches the given query.')
+        await cache.aset(key, product, PRODUCT_CACHE_TIMEOUT)
+    return product
+
+
+def invalidate_product(product):
+    """
+    Makes the cached entries for the current slug of the product and
+    for the slug it was loaded with, in case it was renamed, stale.
+    """
+    slugs = {product.slug}
+    loaded_values = getattr(product, '_loaded_values', None)
+    if loaded_values and 'slug' in loaded_values:
+        slugs.add(loaded_values['slug'])
+    bump(*(product_namespace(slug) for slug in slugs))
@@ -0,0 +1,195 @@
+"""
+Full-text product search.
+
+On SQLite the index is an FTS5 table holding pre-stemmed copies of
+``title``, ``brand`` and ``description`` keyed by the product id. It is
+kept up to date from the Product signals. On PostgreSQL it is a GIN
+expression index over weighted Russian and English ``tsvector``s, which
+the database maintains on its own.
+
+Russian and English stemming on SQLite uses the optional
+``snowballstemmer`` package. Without it, terms are indexed as they are
+and queries fall back to prefix matching.
+"""
+import re
+import threading
+from functools import lru_cache
+
+from django.db import connection
+
+try:
+    import snowballstemmer
+except ImportError:
+    snowballstemmer = None
+
+
+FTS_TABLE = 'shop_product_fts'
+
+PG_INDEX = 'shop_product_search_idx'
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('russian', title), 'A') || "
+    "setweight(to_tsvector('russian', brand), 'B') || "
+    "setweight(to_tsvector('russian', description), 'C') || "
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', brand), 'B') || "
+    "setweight(to_tsvector('english', description), 'C')"
+)
+
+TITLE_WEIGHT, BRAND_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 5.0, 1.0
+
+INDEX_BATCH_SIZE = 2000
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC_RE = re.compile(r'[а-яё]')
+
+# Stemmers keep the word being stemmed on the instance, so every thread
+# gets its own pair.
+_STEMMERS = threading.local() if snowballstemmer is not None else None
+
+
+def _stemmer(language):
+    stemmer = getattr(_STEMMERS, language, None)
+    if stemmer is None:
+        stemmer = snowballstemmer.stemmer(language)
+        setattr(_STEMMERS, language, stemmer)
+    return stemmer
+
+
+@lru_cache(maxsize=100_000)
+def _stem(word):
+    # Catalog vocabularies are small, so bulk indexing mostly hits the cache.
+    return _stemmer('russian' if _CYRILLIC_RE.search(word) else 'english').stemWord(word)
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase words and stems each one with the
+    Russian or English stemmer depending on its alphabet.
+    """
+    words = _WORD_RE.findall(text.lower().replace('ё', 'е'))
+    if _STEMMERS is None:
+        return words
+    return [_stem(word) for word in words]
+
+
+def _fts_query(text):
+    """
+    Builds an FTS5 MATCH expression requiring every query term.
+    """
+    suffix = '' if _STEMMERS is not None else '*'
+    return ' '.join('"{}"{}'.format(term.replace('"', '""'), suffix) for term in tokenize(text))
+
+
+def create_index(connection):
+    """
+    Creates the backend-specific index structures.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+                'title, brand, description, tokenize="unicode61 remove_diacritics 2")'
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON shop_product USING GIN (({PG_DOCUMENT}))')
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+
+
+def _index_rows(cursor, rows):
+    cursor.executemany(
+        f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, title, brand, description) VALUES (%s, %s, %s, %s)',
+        [
+            (pk, ' '.join(tokenize(title)), ' '.join(tokenize(brand)), ' '.join(tokenize(description)))
+            for pk, title, brand, description in rows
+        ],
+    )
+
+
+def index_products(product_ids=None, connection=connection):
+    """
+    (Re)indexes the given products, or the whole catalog when no ids
+    are passed. Rows are read and written in batches so memory use
+    stays flat. A no-op outside SQLite.
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        if product_ids is None:
+            last_id = 0
+            while True:
+                cursor.execute(
+                    'SELECT id, title, brand, description FROM shop_product '
+                    'WHERE id > %s ORDER BY id LIMIT %s', [last_id, INDEX_BATCH_SIZE])
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                _index_rows(cursor, rows)
+                last_id = rows[-1][0]
+            return
+
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+            batch = product_ids[start:start + INDEX_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                f'SELECT id, title, brand, description FROM shop_product WHERE id IN ({placeholders})', batch)
+            _index_rows(cursor, cursor.fetchall())
+
+
+def index_product(product):
+    """
+    Writes a single saved product into the index.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        _index_rows(cursor, [(product.pk, product.title, product.brand, product.description)])
+
+
+def unindex_product(product_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def search_product_ids(text, limit=20, offset=0):
+    """
+    Returns the ids of available products matching every term of the
+    query, best matches first.
+
+    Returns:
+        list: Product ids ordered by relevance.
+    """
+    if not text or not tokenize(text):
+        return []
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f'SELECT {FTS_TABLE}.rowid FROM {FTS_TABLE} '
+                f'JOIN shop_product ON shop_product.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s AND shop_product.available '
+                f'ORDER BY bm25({FTS_TABLE}, %s, %s, %s) LIMIT %s OFFSET %s',
+                [_fts_query(text), TITLE_WEIGHT, BRAND_WEIGHT, DESCRIPTION_WEIGHT, limit, offset],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f'SELECT id FROM shop_product, '
+                f"(SELECT plainto_tsquery('russian', %s) || plainto_tsquery('english', %s) AS query) AS q "
+                f'WHERE ({PG_DOCUMENT}) @@ q.query AND available '
+                f'ORDER BY ts_rank(({PG_DOCUMENT}), q.query) DESC, id LIMIT %s OFFSET %s',
+                [text, text, limit, offset],
+            )
+        else:
+            return []
+        return [row[0] for row in cursor.fetchall()]
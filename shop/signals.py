@@ -0,0 +1,122 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .facets import FACET_FIELDS, update_product_facets
+from .images import build_renditions
+from .invalidation import CATALOG, CATEGORY_TREE, batched, bump
+from .models import Category, Product, ProductProxy
+from .product_cache import invalidate_product
+from .search import index_product, unindex_product
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    """
+    Makes the navigation tree and every catalog page stale whenever a
+    category is created, edited or removed.
+    """
+    bump(CATALOG, CATEGORY_TREE)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductProxy)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductProxy)
+def product_changed(sender, instance, **kwargs):
+    """
+    Makes the cached detail lookup of a product and every catalog page
+    stale whenever the product is saved or removed.
+    """
+    with batched():
+        invalidate_product(instance)
+        bump(CATALOG)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductProxy)
+def product_saved(sender, instance, raw=False, **kwargs):
+    """
+    Writes the saved product into the full-text index.
+    """
+    if not raw:
+        index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductProxy)
+def product_deleted(sender, instance, **kwargs):
+    """
+    Removes the deleted product from the full-text index.
+    """
+    unindex_product(instance.pk)
+
+
+def _facet_values_before_save(instance):
+    """
+    Returns the facet-relevant values the product was loaded with, or
+    the ones fetched by remember_facet_values when they were not loaded.
+    """
+    loaded = getattr(instance, '_loaded_values', {})
+    if all(field in loaded for field in FACET_FIELDS):
+        return {field: loaded[field] for field in FACET_FIELDS}
+    return getattr(instance, '_facet_values', None)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductProxy)
+def remember_facet_values(sender, instance, raw=False, **kwargs):
+    """
+    Fetches the stored facet values of a product that is being updated
+    without having been loaded from the database in full.
+    """
+    if raw or instance.pk is None or _facet_values_before_save(instance) is not None:
+        return
+    instance._facet_values = (
+        Product._base_manager.filter(pk=instance.pk).values(*FACET_FIELDS).first()
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductProxy)
+def product_facets_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Moves the product between facet counters when its category, brand,
+    price or availability changed.
+    """
+    if raw:
+        return
+    old_values = None if created else _facet_values_before_save(instance)
+    update_product_facets(old_values, {field: getattr(instance, field) for field in FACET_FIELDS})
+    instance.__dict__.pop('_facet_values', None)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductProxy)
+def product_facets_deleted(sender, instance, **kwargs):
+    """
+    Removes the deleted product from its facet counters.
+    """
+    old_values = _facet_values_before_save(instance)
+    if old_values is None:
+        old_values = {field: getattr(instance, field) for field in FACET_FIELDS}
+    update_product_facets(old_values, None)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductProxy)
+def product_image_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Builds the image renditions when a product gets a new image.
+    """
+    if raw or not instance.image:
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if not created and loaded.get('image') == instance.image.name and instance.renditions:
+        return
+    instance.renditions = build_renditions(instance.image.name)
+    # Moving updated_at as well retires cards cached without the renditions.
+    instance.updated_at = timezone.now()
+    Product._base_manager.filter(pk=instance.pk).update(
+        renditions=instance.renditions, updated_at=instance.updated_at)
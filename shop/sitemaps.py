@@ -0,0 +1,183 @@
+"""
+A sitemap of every available product and every category, split into
+chunk files listed by a sitemap index.
+
+Products are chunked by fixed ranges of ids, so a chunk keeps its
+members as the catalog grows. Each chunk has a signature: the number of
+products and the latest ``updated_at`` for product chunks, a hash of
+the slugs for category chunks. The signatures of the last build are
+kept in a manifest, and a rebuild only rewrites the chunks whose
+signature changed, which takes one grouped query to find out.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Count, DateTimeField, F, Max, Value
+from django.urls import reverse
+
+from .feeds import slug_url_pattern
+from .models import Category, ProductProxy
+
+
+SITEMAP_DIR = 'sitemaps'
+
+SITEMAP_INDEX = f'{SITEMAP_DIR}/sitemap.xml'
+
+SITEMAP_MANIFEST = f'{SITEMAP_DIR}/manifest.json'
+
+# Well below the limit of 50,000 URLs per sitemap file.
+SITEMAP_CHUNK_SIZE = 10000
+
+SITEMAP_QUERY_CHUNK_SIZE = 2000
+
+_URLSET_OPEN = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+_URLSET_CLOSE = '</urlset>\n'
+
+
+def sitemap_path(name):
+    return f'{SITEMAP_DIR}/{name}.xml'
+
+
+def _url_entry(loc, lastmod=None):
+    lastmod = f'<lastmod>{lastmod.date().isoformat()}</lastmod>' if lastmod else ''
+    return f'<url><loc>{escape(loc)}</loc>{lastmod}</url>\n'
+
+
+def product_chunk_signatures():
+    """
+    Returns ``{chunk: (signature, updated_at)}`` for every product chunk
+    with a single grouped query.
+    """
+    chunks = (
+        ProductProxy.objects.annotate(chunk=F('id') / SITEMAP_CHUNK_SIZE)
+        .values_list('chunk').annotate(count=Count('id'), modified=Max('updated_at')).order_by()
+    )
+    return {
+        f'products-{chunk}': (f'{count}:{modified.isoformat()}', modified)
+        for chunk, count, modified in chunks
+    }
+
+
+def category_chunk_signatures():
+    """
+    Returns ``{chunk: (signature, None)}`` for every category chunk.
+    Categories have no modification time, so the signature is a hash
+    of their slugs.
+    """
+    hashes = {}
+    for pk, slug in Category.objects.order_by('pk').values_list('pk', 'slug').iterator(
+            chunk_size=SITEMAP_QUERY_CHUNK_SIZE):
+        hashes.setdefault(f'categories-{pk // SITEMAP_CHUNK_SIZE}', hashlib.sha1()).update(f'{slug}\n'.encode())
+    return {name: (sha.hexdigest(), None) for name, sha in hashes.items()}
+
+
+def _chunk_bounds(name):
+    chunk = int(name.rsplit('-', 1)[1])
+    return chunk * SITEMAP_CHUNK_SIZE, (chunk + 1) * SITEMAP_CHUNK_SIZE
+
+
+def _chunk_entries(name, base_url):
+    low, high = _chunk_bounds(name)
+    if name.startswith('products-'):
+        prefix, suffix = slug_url_pattern('shop:product_detail')
+        rows = ProductProxy.objects.values_list('slug', 'updated_at')
+    else:
+        # Categories only have a creation time, which is no lastmod.
+        prefix, suffix = slug_url_pattern('shop:category_list')
+        rows = Category.objects.values_list('slug', Value(None, output_field=DateTimeField()))
+
+    rows = rows.filter(id__gte=low, id__lt=high).order_by('id')
+    for slug, lastmod in rows.iterator(chunk_size=SITEMAP_QUERY_CHUNK_SIZE):
+        yield _url_entry(f'{base_url}{prefix}{slug}{suffix}', lastmod)
+
+
+def _replace(path, content):
+    """
+    Puts the content at ``path``. On the local filesystem it is written
+    under a temporary name and renamed over the old file, so the sitemap
+    is never missing while it is rebuilt. Storages without local paths
+    have no rename, so the old file is deleted first.
+    """
+    try:
+        local_path = default_storage.path(path)
+    except NotImplementedError:
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, content)
+        return
+    temporary = default_storage.save(f'{path}.tmp', content)
+    os.replace(default_storage.path(temporary), local_path)
+
+
+def write_chunk(name, base_url):
+    """
+    Streams the URLs of one chunk into its file through a temporary
+    file, so a chunk is never held in memory as a whole.
+    """
+    with tempfile.TemporaryFile() as output:
+        output.write(_URLSET_OPEN.encode())
+        for entry in _chunk_entries(name, base_url):
+            output.write(entry.encode())
+        output.write(_URLSET_CLOSE.encode())
+        output.seek(0)
+        _replace(sitemap_path(name), File(output))
+
+
+def _read_manifest():
+    try:
+        with default_storage.open(SITEMAP_MANIFEST) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_sitemaps(base_url, full=False):
+    """
+    Rewrites the chunks whose signature changed since the last build,
+    deletes the chunks that became empty and rewrites the index.
+
+    Args:
+        base_url (str): Scheme and host of the site, without a trailing
+            slash.
+        full (bool): Rewrites every chunk.
+
+    Returns:
+        tuple: The names of the rewritten and of the deleted chunks.
+    """
+    manifest = _read_manifest()
+    previous = {} if full or manifest.get('base_url') != base_url else manifest.get('chunks', {})
+    chunks = {**product_chunk_signatures(), **category_chunk_signatures()}
+
+    written = []
+    for name, (signature, modified) in sorted(chunks.items()):
+        if previous.get(name, {}).get('signature') != signature or not default_storage.exists(sitemap_path(name)):
+            write_chunk(name, base_url)
+            written.append(name)
+
+    deleted = sorted(set(manifest.get('chunks', {})) - set(chunks))
+    for name in deleted:
+        if default_storage.exists(sitemap_path(name)):
+            default_storage.delete(sitemap_path(name))
+
+    index = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    ]
+    for name, (signature, modified) in sorted(chunks.items()):
+        loc = escape(base_url + reverse('sitemap-chunk', args=[name]))
+        lastmod = f'<lastmod>{modified.isoformat()}</lastmod>' if modified else ''
+        index.append(f'<sitemap><loc>{loc}</loc>{lastmod}</sitemap>\n')
+    index.append('</sitemapindex>\n')
+    _replace(SITEMAP_INDEX, ContentFile(''.join(index).encode()))
+
+    _replace(SITEMAP_MANIFEST, ContentFile(json.dumps({
+        'base_url': base_url,
+        'chunks': {name: {'signature': signature} for name, (signature, modified) in chunks.items()},
+    }).encode()))
+    return written, deleted
@@ -0,0 +1,125 @@
+"""
+Reproducible synthetic catalogs for benchmarks.
+
+The same seed always produces the same categories and products, so
+benchmark results of different commits are comparable. Rows are written
+with bulk inserts in batches and the search index and facet counters
+are rebuilt once at the end, as after a bulk import.
+"""
+import random
+from decimal import Decimal
+
+from django.db import transaction
+
+from .facets import rebuild_facets
+from .invalidation import CATALOG, CATEGORY_TREE, bump
+from .models import Category, Product
+from .search import index_products
+
+
+BRANDS = [f'Brand {index:02d}' for index in range(60)]
+
+WORDS = (
+    'classic', 'winter', 'summer', 'light', 'heavy', 'waterproof', 'cotton', 'wool', 'leather', 'sport',
+    'urban', 'travel', 'slim', 'oversized', 'kids', 'pro', 'basic', 'premium', 'vintage', 'eco',
+)
+
+NOUNS = (
+    'jacket', 'boots', 'scarf', 'backpack', 'shirt', 'trousers', 'sneakers', 'hat', 'gloves', 'coat',
+    'hoodie', 'dress', 'belt', 'socks', 'sweater',
+)
+
+SYNTHETIC_BATCH_SIZE = 5000
+
+
+def branching_factor(categories, depth):
+    """
+    Returns the smallest number of children per category for which a
+    tree of the given depth holds the requested number of categories.
+    """
+    factor = 2
+    while sum(factor ** level for level in range(1, depth + 1)) < categories:
+        factor += 1
+    return factor
+
+
+def generate_categories(count, depth, progress=None):
+    """
+    Creates ``count`` categories in a tree ``depth`` levels deep, level
+    by level, and fills in their materialized paths.
+
+    Returns:
+        list: The ids of the created categories.
+    """
+    factor = branching_factor(count, depth)
+    created = []
+    parents = [(None, '')]
+
+    for level in range(depth):
+        if len(created) >= count:
+            break
+        rows = []
+        for parent_id, parent_path in parents:
+            for _ in range(factor):
+                if len(created) + len(rows) >= count:
+                    break
+                number = len(created) + len(rows)
+                rows.append(Category(
+                    name=f'Category {level + 1}.{number}', slug=f'category-{number}', parent_id=parent_id,
+                    path=parent_path))
+
+        with transaction.atomic():
+            Category.objects.bulk_create(rows, batch_size=SYNTHETIC_BATCH_SIZE)
+            for category in rows:
+                category.path = f'{category.path}{category.pk}/'
+                category.depth = level
+            Category.objects.bulk_update(rows, ['path', 'depth'], batch_size=SYNTHETIC_BATCH_SIZE)
+
+        created += [category.pk for category in rows]
+        parents = [(category.pk, category.path) for category in rows]
+        if progress is not None:
+            progress(f'Level {level + 1}: {len(rows)} categories')
+    return created
+
+
+def generate_products(count, category_ids, rng, progress=None):
+    """
+    Creates ``count`` products spread over the given categories.
+    """
+    done = 0
+    while done < count:
+        rows = []
+        for number in range(done, min(done + SYNTHETIC_BATCH_SIZE, count)):
+            title = f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(NOUNS)} {number}'
+            rows.append(Product(
+                category_id=rng.choice(category_ids),
+                title=title,
+                brand=rng.choice(BRANDS),
+                description=' '.join(rng.choice(WORDS) for _ in range(12)),
+                slug=f'product-{number}',
+                price=Decimal(rng.randrange(100, 1_000_000)) / 100,
+                available=rng.random() > 0.05,
+            ))
+        with transaction.atomic():
+            Product.objects.bulk_create(rows)
+        done += len(rows)
+        if progress is not None:
+            progress(f'{done} products')
+
+
+def generate_catalog(categories=10_000, depth=5, products=1_000_000, seed=0, progress=None):
+    """
+    Fills an empty database with a synthetic catalog.
+
+    Args:
+        progress (callable): Called with a line of progress after every
+            level of categories and every batch of products.
+    """
+    rng = random.Random(seed)
+    category_ids = generate_categories(categories, depth, progress)
+    generate_products(products, category_ids, rng, progress)
+
+    with transaction.atomic():
+        index_products()
+    rebuild_facets()
+    bump(CATALOG, CATEGORY_TREE)
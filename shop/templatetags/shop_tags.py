@@ -0,0 +1,82 @@
+from django import template
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from shop.images import srcset
+
+
+register = template.Library()
+
+
+PRODUCT_CARD_TEMPLATE = 'shop/includes/product_card.html'
+
+PRODUCT_CARD_TIMEOUT = 60 * 60 * 24
+
+
+def product_card_key(product, variant):
+    """
+    Returns the cache key of a rendered card. It changes whenever the
+    product is saved, so stale cards are never read and simply expire.
+    The active language is part of it since prices are localized.
+    """
+    return f'shop:card:{variant}:{get_language()}:{product.pk}:{product.updated_at.timestamp()}'
+
+
+@register.inclusion_tag('shop/includes/picture.html')
+def product_picture(product, kind='card', css_class='img-fluid', sizes='100vw'):
+    """
+    Renders a ``<picture>`` for the product image with WebP and fallback
+    ``srcset``s of the given rendition kind. Products without renditions
+    fall back to the original upload.
+    """
+    entries = product.renditions.get(kind) if product.renditions else None
+    context = {
+        'product': product,
+        'css_class': css_class,
+        'sizes': sizes,
+        'src': product.image.url if product.image else '',
+        'srcset': '',
+        'webp_srcset': '',
+    }
+    if entries:
+        context.update({
+            'src': default_storage.url(entries[0][1]),
+            'srcset': srcset(entries, 1),
+            'webp_srcset': srcset(entries, 2),
+        })
+    return context
+
+
+@register.simple_tag
+def product_cards(products, variant='listing'):
+    """
+    Renders the cards of all the given products, reading every card
+    cached for the product's current ``updated_at`` with one
+    ``get_many`` and storing the ones it had to render with one
+    ``set_many``.
+
+    Args:
+        products: The products, in display order.
+        variant (str): 'catalog' for the large cards of the products
+            page, 'listing' for category and search results.
+    """
+    keys = [product_card_key(product, variant) for product in products]
+    cached = cache.get_many(keys)
+
+    card_template = None
+    rendered = {}
+    cards = []
+    for key, product in zip(keys, products):
+        html = cached.get(key)
+        if html is None:
+            if card_template is None:
+                card_template = get_template(PRODUCT_CARD_TEMPLATE)
+            html = rendered[key] = card_template.render({'product': product, 'variant': variant})
+        cards.append(html)
+
+    if rendered:
+        cache.set_many(rendered, PRODUCT_CARD_TIMEOUT)
+    return mark_safe(''.join(cards))
@@ -1,8 +1,51 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipIf
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import QuerySet
+from django.db.models.functions import Concat
+from django.template import Context, Template
+from django.test import AsyncRequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
+from django.utils.html import escape
+from PIL import Image
+
+from bigcorp.metrics import QueryBudgetExceeded, reset_stats
+from bigcorp.profiling import make_token, recent_profiles
+
+from . import async_views, search
+from .management.commands.bench_catalog import SCENARIOS
+from .catalog_import import CatalogImporter
+from .category_tree import get_ancestor_nodes, get_category_tree
+from .facets import get_facets, rebuild_facets
+from .invalidation import CATALOG, CATEGORY_TREE, batched, bump, get_version, versioned_key
+from .pagination import decode_cursor
+from .product_cache import aget_product_by_slug, get_product_by_slug, product_cache_key
+from .search import search_product_ids, snowballstemmer
+from .sitemaps import build_sitemaps
+from .models import FacetCount, Product, Category, ProductProxy
 
-from .models import Product, Category, ProductProxy
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
 
 
 class ProductViewTest(TestCase):
@@ -58,8 +101,8 @@ class ProductViewTest(TestCase):
         response = self.client.get(reverse("shop:products"))
         
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.context["products"].count(), 2)
-        self.assertEqual(list(response.context["products"]), [product_1, product_2])
+        self.assertEqual(len(response.context["products"]), 2)
+        self.assertEqual(list(response.context["products"]), [product_2, product_1])
         self.assertContains(response, product_1)
         self.assertContains(response, product_2)
 
@@ -117,6 +160,7 @@ class CategoryListViewTest(TestCase):
         Set up the test environment by creating a test category 
         and a test product.
         """
+        cache.clear()
         small_gif = (
         b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
         b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
@@ -159,13 +203,1064 @@ class CategoryListViewTest(TestCase):
         response = self.client.get(
             reverse("shop:category_list", args=[self.category.slug]))
         self.assertEqual(response.context["category"], self.category)
-        self.assertEqual(response.context["products"].first(), self.product)
-        
+        self.assertEqual(response.context["products"][0], self.product)
 
 
-        
-       
-        
+class CategoryTreeTest(TestCase):
+    def setUp(self):
+        """
+        Set up a three level category hierarchy and start from an
+        empty cache.
+        """
+        cache.clear()
+        self.root = Category.objects.create(name="Root", slug="root")
+        self.child = Category.objects.create(name="Child", slug="child", parent=self.root)
+        self.leaf = Category.objects.create(name="Leaf", slug="leaf", parent=self.child)
+
+    def test_tree_is_built_with_one_query(self):
+        """
+        Test that the whole hierarchy is loaded with a single query
+        and that a cached tree needs none.
+        """
+        with self.assertNumQueries(1):
+            tree = get_category_tree()
+        with self.assertNumQueries(0):
+            tree = get_category_tree()
+
+        self.assertEqual([node.name for node in tree], ["Root"])
+        self.assertEqual(tree.roots[0].children[0].children[0].name, "Leaf")
+
+    def test_tree_is_invalidated_on_save_and_delete(self):
+        """
+        Test that saving or deleting a category drops the cached tree.
+        """
+        get_category_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name="Other", slug="other")
+        self.assertEqual([node.name for node in get_category_tree()], ["Other", "Root"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.leaf.delete()
+        self.assertEqual(get_category_tree().roots[1].children[0].children, [])
+
+    def test_menu_renders_without_category_queries(self):
+        """
+        Test that rendering the navigation does not issue a query
+        per category once the tree is cached.
+        """
+        get_category_tree()
+        response = self.client.get(reverse("shop:products"))
+        self.assertContains(response, self.leaf.get_absolute_url())
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("shop:products"))
+        self.assertFalse(
+            [query for query in queries if 'shop_category' in query['sql']])
+
+
+class CategoryPathTest(TestCase):
+    def setUp(self):
+        """
+        Set up a small hierarchy and start from an empty cache.
+        """
+        cache.clear()
+        self.root = Category.objects.create(name="Root", slug="root")
+        self.child = Category.objects.create(name="Child", slug="child", parent=self.root)
+        self.leaf = Category.objects.create(name="Leaf", slug="leaf", parent=self.child)
+        self.other = Category.objects.create(name="Other", slug="other")
+
+    def test_path_is_maintained_on_save(self):
+        """
+        Test that new categories get their materialized path and depth.
+        """
+        self.assertEqual(self.leaf.path, f"{self.root.pk}/{self.child.pk}/{self.leaf.pk}/")
+        self.assertEqual(self.leaf.depth, 2)
+        self.assertEqual(self.leaf.ancestor_ids, [self.root.pk, self.child.pk])
+
+    def test_reparenting_rewrites_the_subtree(self):
+        """
+        Test that moving a category updates the paths of its descendants.
+        """
+        self.child.parent = self.other
+        self.child.save()
+
+        leaf = Category.objects.get(pk=self.leaf.pk)
+        self.assertEqual(leaf.path, f"{self.other.pk}/{self.child.pk}/{self.leaf.pk}/")
+        self.assertEqual(leaf.depth, 2)
+        self.assertEqual(list(self.root.get_descendants()), [])
+
+    def test_failed_subtree_rewrite_rolls_back_the_move(self):
+        """
+        Test that the category row and the paths of its descendants are
+        saved together or not at all.
+        """
+        update = QuerySet.update
+
+        def fail_subtree_update(queryset, **kwargs):
+            if isinstance(kwargs.get("path"), Concat):
+                raise DatabaseError("subtree update failed")
+            return update(queryset, **kwargs)
+
+        self.child.parent = self.other
+        with mock.patch.object(QuerySet, "update", fail_subtree_update):
+            with self.assertRaises(DatabaseError):
+                self.child.save()
+
+        self.assertEqual(self.child.path, f"{self.root.pk}/{self.child.pk}/")
+        self.assertEqual(Category.objects.get(pk=self.child.pk).parent_id, self.root.pk)
+        self.assertEqual(Category.objects.get(pk=self.leaf.pk).path, self.leaf.path)
+
+    def test_stale_tree_is_rebuilt_inside_a_transaction(self):
+        """
+        Test that ancestors created in the current transaction are found
+        although the tree bump waits for the commit.
+        """
+        get_category_tree()
+        middle = Category.objects.create(name="Middle", slug="middle", parent=self.other)
+        bottom = Category.objects.create(name="Bottom", slug="bottom", parent=middle)
+        self.assertEqual(str(bottom), "Other -> Middle -> Bottom")
+
+    def test_str_does_not_walk_parents(self):
+        """
+        Test that the string representation is answered from the
+        path and the cached tree.
+        """
+        leaf = Category.objects.get(pk=self.leaf.pk)
+        str(leaf)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(leaf), "Root -> Child -> Leaf")
+
+
+class CategorySubtreeListTest(TestCase):
+    def setUp(self):
+        """
+        Set up a parent and a child category with one product each,
+        plus a sibling whose product must never be listed.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        self.parent = Category.objects.create(name="Parent", slug="parent")
+        self.child = Category.objects.create(name="Child", slug="child", parent=self.parent)
+        self.sibling = Category.objects.create(name="Sibling", slug="sibling")
+        self.parent_product = Product.objects.create(
+            title="Parent product", category=self.parent, image=uploaded, slug="parent-product")
+        self.child_product = Product.objects.create(
+            title="Child product", category=self.child, image=uploaded, slug="child-product")
+        Product.objects.create(
+            title="Sibling product", category=self.sibling, image=uploaded, slug="sibling-product")
+
+    def test_exact_category_by_default(self):
+        """
+        Test that only the products of the category itself are listed
+        without the subtree option.
+        """
+        response = self.client.get(reverse("shop:category_list", args=[self.parent.slug]))
+        self.assertEqual(list(response.context["products"]), [self.parent_product])
+
+    def test_subtree_lists_descendant_products(self):
+        """
+        Test that the subtree option lists the products of the
+        descendants with one query.
+        """
+        self.assertEqual(
+            set(ProductProxy.objects.in_category_tree(self.parent)),
+            {self.parent_product, self.child_product})
+
+        response = self.client.get(
+            reverse("shop:category_list", args=[self.parent.slug]), {"subtree": "1"})
+        self.assertEqual(
+            set(response.context["products"]), {self.parent_product, self.child_product})
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        """
+        Set up a category holding more products than fit on one page.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        category = Category.objects.create(name="Paged", slug="paged")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {index}", category=category, image=uploaded,
+                slug=f"product-{index}", price=100 - index)
+            for index in range(25)
+        ]
+
+    def test_pages_follow_cursors(self):
+        """
+        Test that following next and previous cursors walks the
+        catalog newest first without gaps or duplicates.
+        """
+        first = self.client.get(reverse("shop:products"))
+        self.assertEqual(list(first.context["products"]), self.products[:4:-1])
+        self.assertFalse(first.context["page"].has_previous())
+
+        second = self.client.get(reverse("shop:products"), {"cursor": first.context["page"].next_cursor})
+        self.assertEqual(list(second.context["products"]), self.products[4::-1])
+        self.assertFalse(second.context["page"].has_next())
+
+        back = self.client.get(reverse("shop:products"), {"cursor": second.context["page"].previous_cursor})
+        self.assertEqual(list(back.context["products"]), self.products[:4:-1])
+
+    def test_price_ordering(self):
+        """
+        Test that ordering by price pages through the cheapest first.
+        """
+        first = self.client.get(reverse("shop:products"), {"order": "price"})
+        self.assertEqual(first.context["products"][0], self.products[-1])
+        self.assertEqual(decode_cursor(first.context["page"].next_cursor)[1], "price")
+
+        second = self.client.get(f'{reverse("shop:products")}?{first.context["page"].next_query}')
+        self.assertEqual(list(second.context["products"]), self.products[4::-1])
+
+    def test_invalid_cursor(self):
+        """
+        Test that a tampered cursor is rejected with a 400 response.
+        """
+        response = self.client.get(reverse("shop:products"), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductSlugCacheTest(TestCase):
+    def setUp(self):
+        """
+        Set up a product and start from an empty cache.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        category = Category.objects.create(name="Cached", slug="cached")
+        self.product = Product.objects.create(
+            title="Cached product", category=category, image=uploaded, slug="cached-product")
+
+    def test_lookup_is_read_through(self):
+        """
+        Test that the second lookup of a slug is served from the cache.
+        """
+        get_product_by_slug("cached-product")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_product_by_slug("cached-product"), self.product)
+
+    def test_rename_and_unpublish_invalidate(self):
+        """
+        Test that saving a product drops both its old and new slugs.
+        """
+        get_product_by_slug("cached-product")
+        product = Product.objects.get(pk=self.product.pk)
+        product.slug = "renamed-product"
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        self.assertEqual(
+            self.client.get(reverse("shop:product_detail", args=["cached-product"])).status_code, 404)
+        self.assertEqual(get_product_by_slug("renamed-product").pk, self.product.pk)
+
+        product.available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(
+            self.client.get(reverse("shop:product_detail", args=["renamed-product"])).status_code, 404)
+
+    def test_slug_is_generated(self):
+        """
+        Test that a product saved without a slug gets one from its
+        transliterated title, and that a suffix already taken is drawn
+        again.
+        """
+        product = ProductProxy.objects.create(title="No slug", category=self.product.category)
+        self.assertRegex(product.slug, r"^no-slug-[a-z0-9]{6}$")
+
+        with mock.patch("shop.models.rand_slug", side_effect=["x1z9q0", "x1z9q0", "k2m4p6"]):
+            first = ProductProxy.objects.create(title="Куртка зимняя", category=self.product.category)
+            second = ProductProxy.objects.create(title="Куртка зимняя", category=self.product.category)
+        self.assertEqual(first.slug, "kurtka-zimnyaya-x1z9q0")
+        self.assertEqual(second.slug, "kurtka-zimnyaya-k2m4p6")
+        self.assertEqual(self.client.get(second.get_absolute_url()).status_code, 200)
+
+
+@skipIf(snowballstemmer is None, "stemmed search needs the snowballstemmer package")
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        """
+        Set up a few products with Russian and English texts.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        category = Category.objects.create(name="Search", slug="search-category")
+        self.boots = Product.objects.create(
+            title="Красные кроссовки", brand="Runner", category=category, image=uploaded,
+            slug="red-sneakers", description="Running shoes for the city")
+        self.jacket = Product.objects.create(
+            title="Куртка", brand="Kross", category=category, image=uploaded,
+            slug="jacket", description="Тёплая куртка для бега в кроссовках")
+
+    def test_stemmed_russian_and_english_terms(self):
+        """
+        Test that inflected words match and title hits rank first.
+        """
+        self.assertEqual(search_product_ids("кроссовками"), [self.boots.pk, self.jacket.pk])
+        self.assertEqual(search_product_ids("red shoe"), [])
+        self.assertEqual(search_product_ids("run"), [self.boots.pk])
+        self.assertEqual(search_product_ids("красная кроссовка"), [self.boots.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        """
+        Test that edits, unpublishing and deletion reach the index.
+        """
+        self.jacket.title = "Синяя куртка"
+        self.jacket.save()
+        self.assertEqual(search_product_ids("синий"), [self.jacket.pk])
+
+        self.jacket.available = False
+        self.jacket.save()
+        self.assertEqual(search_product_ids("синий"), [])
+
+        self.boots.delete()
+        self.assertEqual(search_product_ids("кроссовки"), [])
+
+    def test_stemming_is_thread_safe(self):
+        """
+        Test that threads stemming new words at once get the same stems
+        as one thread does.
+        """
+        words = [f"{prefix}{stem}" for prefix in "abcdefghijklmnop"
+                 for stem in ("scarves", "booting", "шапками", "куртках")]
+        search._stem.cache_clear()
+        expected = [search.tokenize(word) for word in words]
+        search._stem.cache_clear()
+        # Switch threads as often as possible to interleave the stemmers.
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            self.assertEqual(list(pool.map(search.tokenize, words)), expected)
+
+    def test_search_view(self):
+        """
+        Test that the search page renders the matching products.
+        """
+        response = self.client.get(reverse("shop:search"), {"q": "куртки"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "shop/search.html")
+        self.assertEqual(response.context["products"], [self.jacket])
+
+
+class FacetTest(TestCase):
+    def setUp(self):
+        """
+        Set up a parent and a child category with products of two
+        brands in different price bands.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        self.parent = Category.objects.create(name="Shoes", slug="shoes")
+        self.child = Category.objects.create(name="Boots", slug="boots", parent=self.parent)
+        self.cheap = Product.objects.create(
+            title="Cheap", brand="Acme", price=20, category=self.parent, image=uploaded, slug="cheap")
+        self.dear = Product.objects.create(
+            title="Dear", brand="Lux", price=700, category=self.child, image=uploaded, slug="dear")
+        self.other = Product.objects.create(
+            title="Other", brand="Acme", price=70, category=self.child, image=uploaded, slug="other")
+
+    def test_counts_are_maintained_incrementally(self):
+        """
+        Test that saves and deletes keep the counters equal to a full
+        rebuild.
+        """
+        product = Product.objects.get(pk=self.other.pk)
+        product.brand = "Lux"
+        product.price = 30
+        product.save()
+        self.dear.available = False
+        self.dear.save()
+        self.cheap.delete()
+
+        incremental = get_facets(self.parent, subtree=True)
+        self.assertEqual(incremental, {"brand": [("Lux", 1)], "price": [("0-50", 1)]})
+
+        rebuild_facets()
+        self.assertEqual(get_facets(self.parent, subtree=True), incremental)
+
+    def test_facets_are_read_with_one_query(self):
+        """
+        Test that the sidebar counts for a subtree and the catalog are
+        each answered with a single query.
+        """
+        with self.assertNumQueries(1):
+            facets = get_facets(self.parent, subtree=True)
+        self.assertEqual(facets["brand"], [("Acme", 2), ("Lux", 1)])
+        self.assertEqual(facets["price"], [("0-50", 1), ("50-100", 1), ("500-1000", 1)])
+        self.assertEqual(get_facets(self.child)["brand"], [("Acme", 1), ("Lux", 1)])
+        self.assertEqual(FacetCount.objects.get(category=None, facet="brand", value="Acme").count, 2)
+
+    def test_filters_narrow_the_listing(self):
+        """
+        Test that brand and price filters narrow the product listing.
+        """
+        response = self.client.get(reverse("shop:products"), {"brand": "Acme", "price": "50-100"})
+        self.assertEqual(list(response.context["products"]), [self.other])
+        self.assertEqual(response.context["selected"], {"brand": ["Acme"], "price": ["50-100"]})
+
+
+class ProductRenditionTest(TestCase):
+    def setUp(self):
+        """
+        Set up a product with a real 1000x500 PNG image.
+        """
+        cache.clear()
+        buffer = io.BytesIO()
+        Image.new("RGB", (1000, 500), "red").save(buffer, "PNG")
+        uploaded = SimpleUploadedFile("large.png", buffer.getvalue(), content_type="image/png")
+        category = Category.objects.create(name="Images", slug="images")
+        self.product = Product.objects.create(
+            title="Pictured", category=category, image=uploaded, slug="pictured")
+
+    def test_renditions_are_built_on_upload(self):
+        """
+        Test that card and detail renditions are stored under content
+        hashed names and are never upscaled.
+        """
+        renditions = Product.objects.get(pk=self.product.pk).renditions
+        self.assertEqual([entry[0] for entry in renditions["card"]], [320, 640])
+        self.assertEqual([entry[0] for entry in renditions["detail"]], [800, 1000])
+        self.assertRegex(renditions["card"][0][2], r"^renditions/[0-9a-f]{2}/[0-9a-f]{24}\.webp$")
+
+    def test_listing_uses_srcset(self):
+        """
+        Test that listing cards reference the renditions instead of the
+        original upload.
+        """
+        response = self.client.get(reverse("shop:products"))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, " 640w")
+        self.assertNotContains(response, self.product.image.url)
+
+    def test_backfill_command(self):
+        """
+        Test that the management command rebuilds missing renditions
+        and makes the cached detail lookups stale.
+        """
+        Product.objects.filter(pk=self.product.pk).update(renditions={})
+        self.assertEqual(get_product_by_slug(self.product.slug).renditions, {})
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("generate_renditions", workers=1, stdout=io.StringIO())
+        self.assertIn("card", Product.objects.get(pk=self.product.pk).renditions)
+        self.assertIn("card", get_product_by_slug(self.product.slug).renditions)
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        """
+        Set up a product and start from an empty cache.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        category = Category.objects.create(name="Paged", slug="paged")
+        self.product = Product.objects.create(
+            title="Paged product", category=category, image=uploaded, slug="paged-product", price=5)
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        """
+        Test that a repeated anonymous request is served without
+        touching the catalog tables.
+        """
+        self.assertEqual(self.client.get(reverse("shop:products"))["X-Page-Cache"], "miss")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("shop:products"))
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertContains(response, "Paged product")
+        self.assertFalse([query for query in queries if "shop_" in query["sql"]])
+
+    def test_holes_are_filled_per_visitor(self):
+        """
+        Test that the cart badge and CSRF token of a cached page belong
+        to the visitor it is served to.
+        """
+        url = self.product.get_absolute_url()
+        self.client.get(url)
+        self.client.post(reverse("cart:add-to-cart"), {
+            "action": "post", "product_id": self.product.id, "product_quantity": 3})
+
+        response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertNotContains(response, "[[page-cache:")
+        self.assertRegex(response.content.decode(), r"lblCartCount[^>]*>\s*3\s*<")
+        self.assertIn("csrftoken", response.cookies)
+
+        response = self.client_class().get(url)
+        self.assertRegex(response.content.decode(), r"lblCartCount[^>]*>\s*0\s*<")
 
+    def test_catalog_changes_invalidate_pages(self):
+        """
+        Test that saving a product makes cached pages stale, and that
+        authenticated users are never served from the cache.
+        """
+        self.client.get(reverse("shop:products"))
+        self.product.title = "Renamed product"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        response = self.client.get(reverse("shop:products"))
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "Renamed product")
+
+        self.client.force_login(User.objects.create_user(username="member"))
+        self.assertNotIn("X-Page-Cache", self.client.get(reverse("shop:products")))
 
 
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        """
+        Set up a product in a category and start from an empty cache.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(name="Conditional", slug="conditional")
+            self.product = Product.objects.create(
+                title="Conditional product", category=self.category, image=uploaded, slug="conditional-product")
+
+    def test_repeat_request_gets_not_modified(self):
+        """
+        Test that a matching ETag is answered with 304 without touching
+        the catalog tables, and that saving the product changes it.
+        """
+        url = self.product.get_absolute_url()
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if "shop_" in query["sql"]])
+
+        self.product.price = 10
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cart_change_invalidates_etag(self):
+        """
+        Test that the page is revalidated once the visitor's cart count
+        changes, and that Last-Modified is withheld from session holders.
+        """
+        url = reverse("shop:category_list", args=[self.category.slug])
+        etag = self.client.get(url)["ETag"]
+        self.client.post(reverse("cart:add-to-cart"), {
+            "action": "post", "product_id": self.product.id, "product_quantity": 1})
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_if_modified_since(self):
+        """
+        Test that a visitor without a session is answered with 304 from
+        the Last-Modified date.
+        """
+        url = reverse("shop:category_list", args=[self.category.slug])
+        last_modified = self.client.get(url)["Last-Modified"]
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+
+class ProductCardCacheTest(TestCase):
+    def setUp(self):
+        """
+        Set up a few products and start from an empty cache.
+        """
+        cache.clear()
+        category = Category.objects.create(name="Cards", slug="cards")
+        self.products = [
+            Product.objects.create(
+                title=f"card {index}", category=category, slug=f"card-{index}",
+                image=SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif"))
+            for index in range(3)
+        ]
+        self.template = Template("{% load shop_tags %}{% product_cards products 'listing' %}")
+
+    def render(self):
+        return self.template.render(Context({"products": Product.objects.order_by("id")}))
+
+    def test_cards_are_read_with_one_round_trip(self):
+        """
+        Test that a rendered page of cards is read back with a single
+        get_many and without rendering any card again.
+        """
+        first = self.render()
+        self.assertIn(self.products[0].get_absolute_url(), first)
+        self.assertIn("Card 2", first)
+
+        with mock.patch.object(cache, "get_many", wraps=cache.get_many) as get_many, \
+                mock.patch("shop.templatetags.shop_tags.get_template") as get_template:
+            self.assertEqual(self.render(), first)
+        get_many.assert_called_once()
+        get_template.assert_not_called()
+
+    def test_saved_product_is_rerendered(self):
+        """
+        Test that saving a product moves its card to a new key.
+        """
+        self.render()
+        self.products[1].title = "renamed card"
+        self.products[1].save()
+        self.assertIn("Renamed card", self.render())
+
+
+class InvalidationTest(TestCase):
+    def setUp(self):
+        """
+        Set up a category and start from an empty cache.
+        """
+        cache.clear()
+        self.category = Category.objects.create(name="Versioned", slug="versioned")
+
+    def test_bump_moves_keys(self):
+        """
+        Test that a bump changes the keys of its namespace only.
+        """
+        key, other = versioned_key(CATALOG, "page"), versioned_key(CATEGORY_TREE)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump(CATALOG)
+        self.assertNotEqual(versioned_key(CATALOG, "page"), key)
+        self.assertEqual(versioned_key(CATEGORY_TREE), other)
+
+    def test_batch_bumps_each_namespace_once(self):
+        """
+        Test that saving many products inside a batch bumps the catalog
+        version once, when the batch ends.
+        """
+        version = get_version(CATALOG)
+        with mock.patch.object(cache, "incr", wraps=cache.incr) as incr, \
+                self.captureOnCommitCallbacks(execute=True):
+            with batched():
+                for index in range(5):
+                    Product.objects.create(
+                        title=f"batched {index}", category=self.category, slug=f"batched-{index}",
+                        image=SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif"))
+                self.assertEqual(get_version(CATALOG), version)
+
+        self.assertEqual(get_version(CATALOG), version + 1)
+        catalog_bumps = [call for call in incr.call_args_list if call.args[0].endswith(CATALOG)]
+        self.assertEqual(len(catalog_bumps), 1)
+
+    def test_bulk_deletes_bump_each_namespace_once(self):
+        """
+        Test that deleting many products with a queryset, through the
+        admin action or by cascade from their category bumps the
+        catalog version once per delete.
+        """
+        def create_products():
+            return [
+                Product.objects.create(
+                    title=f"deleted {index}", category=self.category,
+                    image=SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif"))
+                for index in range(3)
+            ]
+
+        admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+        deletes = (
+            lambda products: Product.objects.filter(pk__in=[product.pk for product in products]).delete(),
+            lambda products: self.client.post(reverse("admin:shop_product_changelist"), {
+                "action": "delete_selected", "post": "yes",
+                "_selected_action": [product.pk for product in products]}),
+            lambda products: self.category.delete(),
+        )
+        for delete in deletes:
+            products = create_products()
+            with mock.patch.object(cache, "incr", wraps=cache.incr) as incr, \
+                    self.captureOnCommitCallbacks(execute=True):
+                delete(products)
+            self.assertFalse(Product.objects.filter(pk__in=[product.pk for product in products]).exists())
+            catalog_bumps = [call for call in incr.call_args_list if call.args[0].endswith(CATALOG)]
+            self.assertEqual(len(catalog_bumps), 1)
+
+    def test_category_change_bumps_tree(self):
+        """
+        Test that saving a category makes the cached tree stale.
+        """
+        version = get_version(CATEGORY_TREE)
+        self.category.name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertGreater(get_version(CATEGORY_TREE), version)
+
+    def test_bump_waits_for_commit(self):
+        """
+        Test that a bump inside a transaction is applied when it
+        commits, so no other worker caches the uncommitted rows under
+        the new version.
+        """
+        version = get_version(CATALOG)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump(CATALOG)
+            self.assertEqual(get_version(CATALOG), version)
+        self.assertEqual(get_version(CATALOG), version + 1)
+
+
+class AsyncViewTest(TestCase):
+    def setUp(self):
+        """
+        Set up a product in a category and start from an empty cache.
+        """
+        cache.clear()
+        uploaded = SimpleUploadedFile("small.gif", SMALL_GIF, content_type="image/gif")
+        self.category = Category.objects.create(name="Async", slug="async")
+        self.product = Product.objects.create(
+            title="Async product", category=self.category, image=uploaded, slug="async-product", price=5)
+
+    def get(self, path, headers=None):
+        request = AsyncRequestFactory().get(path, headers=headers)
+        SessionMiddleware(lambda request: None).process_request(request)
+        request.user = AnonymousUser()
+        return request
+
+    async def test_catalog_pages_use_page_cache(self):
+        """
+        Test that the async catalog views render the same pages and go
+        through the page cache.
+        """
+        response = await async_views.products_view(self.get("/shop/"))
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "Async product")
+
+        response = await async_views.category_list(self.get("/shop/search/async/"), slug="async")
+        self.assertContains(response, "Async product")
+
+        response = await async_views.products_view(self.get("/shop/"))
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertNotContains(response, "[[page-cache:")
+
+    async def test_product_detail_is_conditional(self):
+        """
+        Test that the async product page sends an ETag and answers a
+        matching one with 304.
+        """
+        path = "/shop/async-product/"
+        response = await async_views.product_detail_view(self.get(path), slug="async-product")
+        self.assertContains(response, "Async product")
+
+        request = self.get(path, headers={"If-None-Match": response["ETag"]})
+        response = await async_views.product_detail_view(request, slug="async-product")
+        self.assertEqual(response.status_code, 304)
+
+    async def test_async_lookup_shares_the_product_cache(self):
+        """
+        Test that the async slug lookup reads and fills the same cache
+        entries as the sync one.
+        """
+        product = await aget_product_by_slug("async-product")
+        self.assertEqual(product, self.product)
+        self.assertEqual(await sync_to_async(cache.get)(product_cache_key("async-product")), product)
+        with mock.patch.object(type(ProductProxy.objects), "aget", side_effect=AssertionError):
+            self.assertEqual(await aget_product_by_slug("async-product"), product)
+
+
+class ImportCatalogTest(TestCase):
+    def setUp(self):
+        """
+        Set up a CSV file with an image next to it.
+        """
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        with open(os.path.join(self.directory.name, "pixel.gif"), "wb") as image:
+            image.write(SMALL_GIF)
+        self.path = os.path.join(self.directory.name, "catalog.csv")
+
+    def write(self, rows):
+        with open(self.path, "w", newline="", encoding="utf-8") as output:
+            writer = csv.DictWriter(output, ["category", "title", "brand", "price", "available", "image"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def test_import_creates_and_updates(self):
+        """
+        Test that the command creates the category path, indexes and
+        counts the products, and updates them on a second run.
+        """
+        self.write([
+            {"category": "Clothes -> Jackets", "title": "Rain jacket", "brand": "Acme", "price": "70",
+             "available": "1", "image": "pixel.gif"},
+            {"category": "Clothes", "title": "Scarf", "brand": "Acme", "price": "20", "available": "0"},
+            {"category": "Clothes", "title": "", "price": "20"},
+        ])
+        stderr = io.StringIO()
+        call_command("import_catalog", self.path, stdout=io.StringIO(), stderr=stderr)
+
+        self.assertIn("Line 4", stderr.getvalue())
+        jacket = Product.objects.get(title="Rain jacket")
+        self.assertEqual(str(jacket.category), "Clothes -> Jackets")
+        self.assertTrue(jacket.image.name.startswith("products/imported/"))
+        self.assertEqual(search_product_ids("jacket"), [jacket.pk])
+        self.assertEqual(get_facets()["brand"], [("Acme", 1)])
+
+        self.write([{"category": "Clothes -> Jackets", "title": "Rain jacket", "brand": "Acme", "price": "80",
+                     "available": "1", "image": "pixel.gif"}])
+        call_command("import_catalog", self.path, stdout=io.StringIO())
+
+        updated = Product.objects.get(pk=jacket.pk)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(updated.price, 80)
+        self.assertEqual(updated.price_version, jacket.price_version + 1)
+        self.assertEqual(updated.image.name, jacket.image.name)
+
+    def test_malformed_records_are_skipped(self):
+        """
+        Test that a price that is not a finite number and text fields
+        that are not strings skip their record instead of the import.
+        """
+        records = [
+            (1, {"category": "Hats", "title": "Cap", "price": "nan"}),
+            (2, {"category": "Hats", "title": "Beret", "price": "inf"}),
+            (3, {"category": "Hats", "title": "Fedora", "brand": 7}),
+            (4, {"category": "Hats", "title": "Bowler", "slug": ["bowler"]}),
+            (5, {"category": "Hats", "title": "Trilby", "slug": "bad slug/ok"}),
+            (6, {"category": "Hats", "title": "T" * 201}),
+            (7, {"category": "Hats", "title": "Beanie", "brand": "B" * 201}),
+            (8, {"category": "H" * 201, "title": "Boater"}),
+            (9, {"category": "Hats", "title": "Cloche", "available": "maybe"}),
+            (10, {"category": "Hats", "title": "Panama", "price": "15"}),
+        ]
+        with CatalogImporter() as importer:
+            errors = importer.import_batch(records)
+        self.assertEqual([line_num for line_num, message in errors], [1, 2, 3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(list(Product.objects.values_list("title", flat=True)), ["Panama"])
+        self.assertEqual(list(Category.objects.values_list("name", flat=True)), ["Hats"])
+
+    def test_generated_slugs_and_default_availability(self):
+        """
+        Test that generated slugs spell Cyrillic titles in Latin letters
+        and that a blank availability means available.
+        """
+        records = [(1, {"category": "Шапки", "title": "Шапка зимняя", "available": ""})]
+        with CatalogImporter() as importer:
+            importer.import_batch(records)
+        product = Product.objects.get()
+        self.assertTrue(product.slug.startswith("shapka-zimnyaya-"))
+        self.assertTrue(product.category.slug.startswith("shapki-"))
+        self.assertTrue(product.available)
+
+    def test_rolled_back_batch_forgets_its_categories(self):
+        """
+        Test that categories created by a batch that failed are created
+        again by the next batch.
+        """
+        with CatalogImporter() as importer:
+            with mock.patch.object(importer, "_write", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    importer.import_batch([(1, {"category": "Gloves", "title": "Mittens"})])
+            self.assertFalse(Category.objects.filter(name="Gloves").exists())
+
+            importer.import_batch([(1, {"category": "Gloves", "title": "Mittens"})])
+        self.assertEqual(Product.objects.get(title="Mittens").category.name, "Gloves")
+
+
+class FeedAndSitemapTest(TestCase):
+    def setUp(self):
+        """
+        Set up two products in a nested category and a media root of
+        their own.
+        """
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        parent = Category.objects.create(name="Clothes", slug="clothes")
+        self.category = Category.objects.create(name="Jackets", slug="jackets", parent=parent)
+        self.jacket = Product.objects.create(
+            title="Rain jacket", brand="Acme", category=self.category, slug="rain-jacket", price=70)
+        self.scarf = Product.objects.create(
+            title="Scarf", brand="Acme", category=self.category, slug="scarf", price=20)
+
+    def test_csv_feed_is_streamed(self):
+        """
+        Test that the CSV feed is streamed with the columns the importer
+        reads and absolute product URLs.
+        """
+        response = self.client.get(reverse("shop:feed-csv"))
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([row["slug"] for row in rows], ["rain-jacket", "scarf"])
+        self.assertEqual(rows[0]["category"], "Clothes -> Jackets")
+        self.assertEqual(rows[0]["url"], "http://testserver/shop/rain-jacket/")
+
+    async def test_async_feed_is_an_async_stream(self):
+        """
+        Test that the async feed view streams from an async iterator,
+        which ASGI sends chunk by chunk.
+        """
+        response = await async_views.product_feed(AsyncRequestFactory().get("/shop/feed/products.jsonl"), fmt="jsonl")
+        self.assertTrue(response.is_async)
+        content = "".join([chunk.decode() async for chunk in response.streaming_content])
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["slug"] for row in rows], ["rain-jacket", "scarf"])
+        self.assertEqual(rows[1]["category"], "Clothes -> Jackets")
+
+    def test_sitemaps_are_rebuilt_incrementally(self):
+        """
+        Test that only the chunks whose content changed are rewritten
+        and that the index links every chunk.
+        """
+        output = io.StringIO()
+        call_command("generate_sitemaps", base_url="http://shop.test", stdout=output)
+        self.assertIn("Rewrote 2 sitemap chunks", output.getvalue())
+
+        response = self.client.get(reverse("sitemap"))
+        index = b"".join(response.streaming_content).decode()
+        self.assertIn("http://shop.test/sitemaps/products-0.xml", index)
+        self.assertIn("http://shop.test/sitemaps/categories-0.xml", index)
+
+        self.assertEqual(build_sitemaps("http://shop.test"), ([], []))
+        self.scarf.price = 25
+        self.scarf.save()
+        # Files are replaced by a rename, so they never go missing.
+        with mock.patch.object(default_storage, "delete", side_effect=AssertionError):
+            self.assertEqual(build_sitemaps("http://shop.test"), (["products-0"], []))
+        self.assertEqual(sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, "sitemaps"))), [
+            "categories-0.xml", "manifest.json", "products-0.xml", "sitemap.xml"])
+
+        response = self.client.get(reverse("sitemap-chunk", args=["products-0"]))
+        chunk = b"".join(response.streaming_content).decode()
+        self.assertIn("<loc>http://shop.test/shop/scarf/</loc>", chunk)
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        """
+        Set up a product and empty per-view totals.
+        """
+        cache.clear()
+        reset_stats()
+        category = Category.objects.create(name="Metrics", slug="metrics")
+        Product.objects.create(title="Measured", category=category, slug="measured", price=5)
+
+    def test_response_reports_its_cost(self):
+        """
+        Test that a response carries its query count in Server-Timing
+        and in ``response.metrics``.
+        """
+        response = self.client.get(reverse("shop:products"))
+        self.assertIn(f'desc="{response.metrics.queries} queries"', response["Server-Timing"])
+        self.assertGreater(response.metrics.queries, 0)
+        self.assertGreater(response.metrics.template_time, 0)
+
+        response = self.client.get(reverse("shop:products"))
+        self.assertGreater(response.metrics.cache_hits, 0)
+
+    def test_strict_budget_fails_the_request(self):
+        """
+        Test that a view going over its budget raises in strict mode.
+        """
+        with override_settings(QUERY_BUDGETS={"shop:products": 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("shop:products"))
+
+    def test_metrics_endpoint(self):
+        """
+        Test that the per-view totals are exposed to local scrapers only.
+        """
+        self.client.get(reverse("shop:product_detail", args=["measured"]))
+        response = self.client.get(reverse("metrics"))
+        self.assertContains(response, 'bigcorp_view_requests_total{view="shop:product_detail"} 1')
+        self.assertContains(response, 'bigcorp_view_duration_seconds_count{view="shop:product_detail"} 1')
+
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 403)
+
+
+class BenchmarkTest(TestCase):
+    def test_synthetic_catalog_and_benchmark(self):
+        """
+        Test that the synthetic catalog is a well-formed tree of the
+        requested depth and that the benchmark saves a result for every
+        scenario.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("generate_catalog", categories=20, depth=3, products=40, stdout=io.StringIO())
+
+        self.assertEqual(Category.objects.count(), 20)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Category.objects.order_by("-depth").values_list("depth", flat=True).first(), 2)
+        for category in Category.objects.filter(depth=2)[:3]:
+            self.assertEqual(len(get_ancestor_nodes(category)), 2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command("bench_catalog", requests=3, warmup=1, output=path, stdout=io.StringIO())
+            with open(path) as results:
+                scenarios = json.load(results)["scenarios"]
+
+        self.assertEqual(set(scenarios), set(SCENARIOS))
+        self.assertTrue(all(stats["errors"] == 0 for stats in scenarios.values()))
+
+
+class RequestProfilingTest(TestCase):
+    def setUp(self):
+        """
+        Set up a product and an empty profiles directory.
+        """
+        cache.clear()
+        category = Category.objects.create(name="Profiled", slug="profiled")
+        Product.objects.create(title="Profiled", category=category, slug="profiled", price=5)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROFILING_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_requests_are_not_profiled_unless_asked(self):
+        """
+        Test that the query parameter needs a staff user and the header
+        a valid token.
+        """
+        response = self.client.get(reverse("shop:products"), {"profile": "cprofile"})
+        self.assertNotIn("X-Profile-Id", response)
+        response = self.client.get(reverse("shop:products"), HTTP_X_PROFILE="sample:forged")
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_signed_header_profiles_the_request(self):
+        """
+        Test that a signed token in the header writes collapsed stacks
+        and a summary of the request.
+        """
+        response = self.client.get(reverse("shop:products"), HTTP_X_PROFILE=make_token("sample"))
+        profile_id = response["X-Profile-Id"]
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"{profile_id}.collapsed")))
+
+        [profile] = recent_profiles()
+        self.assertEqual(profile["id"], profile_id)
+        self.assertEqual(profile["view"], "shop:products")
+        self.assertEqual(profile["mode"], "sample")
+
+    def test_staff_profiles_show_in_admin(self):
+        """
+        Test that a staff user can profile a page with cProfile and then
+        find its slowest frames and its pstats file in the admin.
+        """
+        staff = User.objects.create_user("staff", password="password", is_staff=True)
+
+        with override_settings(PROFILING_KEEP=1):
+            self.client.get(reverse("shop:product_detail", args=["profiled"]), HTTP_X_PROFILE=make_token())
+            self.client.force_login(staff)
+            response = self.client.get(reverse("shop:products"), {"profile": "cprofile"})
+        profile_id = response["X-Profile-Id"]
+        self.assertEqual(len(recent_profiles()), 1)
+
+        [profile] = recent_profiles()
+        self.assertTrue(profile["top_frames"])
+        self.assertEqual(profile["file"], f"{profile_id}.prof")
+
+        response = self.client.get(reverse("admin-profiles"))
+        self.assertContains(response, escape(profile["top_frames"][0]["frame"]))
+        response = self.client.get(reverse("admin-profile-download", args=[profile_id]))
+        self.assertEqual(response.status_code, 200)
+        response.close()
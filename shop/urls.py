@@ -1,11 +1,24 @@
 from django.urls import path
-from .views import products_view, product_detail_view, category_list
+
+from . import views
 
 
 app_name = 'shop'
 
-urlpatterns = [
-    path('', products_view, name='products'),
-    path('<slug:slug>/', product_detail_view, name='product_detail'),
-    path('search/<slug:slug>/', category_list, name='category_list'),
-]
+
+def build_urlpatterns(views):
+    """
+    Returns the routes of the app served by the given views module, so
+    the sync and async URLconfs share one list of routes.
+    """
+    return [
+        path('', views.products_view, name='products'),
+        path('search/', views.search_view, name='search'),
+        path('feed/products.csv', views.product_feed, {'fmt': 'csv'}, name='feed-csv'),
+        path('feed/products.jsonl', views.product_feed, {'fmt': 'jsonl'}, name='feed-jsonl'),
+        path('<slug:slug>/', views.product_detail_view, name='product_detail'),
+        path('search/<slug:slug>/', views.category_list, name='category_list'),
+    ]
+
+
+urlpatterns = build_urlpatterns(views)
@@ -1,38 +1,144 @@
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.views.decorators.http import condition
 
+from .category_tree import get_ancestor_nodes
+from .conditional import (
+    catalog_page_etag,
+    catalog_page_last_modified,
+    product_page_etag,
+    product_page_last_modified,
+)
+from .facets import filter_products, get_facets
+from .feeds import FEED_CONTENT_TYPES, buffered, feed_lines
 from .models import Category, ProductProxy
+from .page_cache import cache_anonymous_page
+from .pagination import KeysetPaginator
+from .product_cache import get_product_by_slug
+from .search import search_product_ids
+from .sitemaps import SITEMAP_INDEX, sitemap_path
 
 
+PRODUCTS_PER_PAGE = 20
 
+SEARCH_RESULTS_PER_PAGE = 20
+
+SEARCH_MAX_PAGES = 50
+
+
+@cache_anonymous_page
 def products_view(request):
     """
     Renders the 'shop/products.html'
-    template with a context containing all products.
+    template with a context containing one page of products.
+
+    Pages are selected with an opaque ``cursor`` and ordered newest
+    first (``?order=new``) or by price (``?order=price``).
+    Products can be narrowed with ``brand`` and ``price`` filters.
+    Anonymous visitors are served from the page cache.
+    """
+    products, selected = filter_products(ProductProxy.objects.all(), request.GET)
+    page = KeysetPaginator(products, PRODUCTS_PER_PAGE).paginate(request)
+    context = {
+        'products': page.object_list,
+        'page': page,
+        'facets': get_facets(),
+        'selected': selected,
+    }
+    return render(request, 'shop/products.html', context)
+
+def search_view(request):
     """
-    products = ProductProxy.objects.all()
-    return render(request, 'shop/products.html', {'products': products})
+    Renders the 'shop/search.html' template with the available products
+    matching the ``q`` GET parameter, best matches first.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page = min(max(int(request.GET.get('page', 1)), 1), SEARCH_MAX_PAGES)
+    except ValueError:
+        page = 1
+
+    ids = search_product_ids(
+        query, limit=SEARCH_RESULTS_PER_PAGE + 1, offset=(page - 1) * SEARCH_RESULTS_PER_PAGE)
+    has_next = len(ids) > SEARCH_RESULTS_PER_PAGE and page < SEARCH_MAX_PAGES
+    ids = ids[:SEARCH_RESULTS_PER_PAGE]
 
+    found = ProductProxy.objects.in_bulk(ids)
+    context = {
+        'query': query,
+        'products': [found[pk] for pk in ids if pk in found],
+        'page_number': page,
+        'has_next': has_next,
+    }
+    return render(request, 'shop/search.html', context)
+
+@condition(etag_func=product_page_etag, last_modified_func=product_page_last_modified)
+@cache_anonymous_page
 def product_detail_view(request, slug):
     """
     Renders the 'shop/product_detail.html' template with
     a context containing the product with the specified slug.
+    The product is read through the slug cache, and anonymous
+    visitors are served from the page cache. Repeat requests are
+    answered with 304 when the ETag or Last-Modified still match.
     """
-    product = get_object_or_404(ProductProxy, slug=slug)
+    product = get_product_by_slug(slug)
     return render(request, 'shop/product_detail.html', {'product': product})
 
+@condition(etag_func=catalog_page_etag, last_modified_func=catalog_page_last_modified)
+@cache_anonymous_page
 def category_list(request, slug):
     """
     Retrieves a category based on the provided slug, fetches all products associated
-    with that category, and renders the 'shop/category_list.html' template with the category
-    and products in the context.
+    with that category, and renders the 'shop/category_list.html' template with the category,
+    its breadcrumbs and products in the context.
+
+    Passing ``?subtree=1`` lists the products of every descendant
+    category as well. Products are paginated, filtered and cached
+    like in products_view, and repeat requests are answered with 304
+    when the catalog has not changed.
     """
     category = get_object_or_404(Category, slug=slug)
-    products = ProductProxy.objects.select_related('category').filter(category=category)
+    subtree = request.GET.get('subtree') == '1'
+    if subtree:
+        products = ProductProxy.objects.in_category_tree(category)
+    else:
+        products = ProductProxy.objects.filter(category=category)
+    products, selected = filter_products(products.select_related('category'), request.GET)
+    page = KeysetPaginator(products, PRODUCTS_PER_PAGE).paginate(request)
     context = {
         'category': category,
-        'products': products
+        'breadcrumbs': get_ancestor_nodes(category),
+        'subtree': subtree,
+        'products': page.object_list,
+        'page': page,
+        'facets': get_facets(category, subtree),
+        'selected': selected,
     }
     return render(request, 'shop/category_list.html', context)
 
 
+def product_feed(request, fmt):
+    """
+    Streams the feed of the whole catalog in CSV or JSON Lines for
+    marketplaces. Rows are read with a server-side cursor, so memory
+    use does not grow with the catalog.
+    """
+    base_url = request.build_absolute_uri('/').rstrip('/')
+    response = StreamingHttpResponse(buffered(feed_lines(fmt, base_url)), content_type=FEED_CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+    return response
+
 
+def sitemap_view(request, name=None):
+    """
+    Serves the sitemap index, or one of its chunks, from the files
+    written by the generate_sitemaps command.
+    """
+    path = SITEMAP_INDEX if name is None else sitemap_path(name)
+    try:
+        sitemap = default_storage.open(path)
+    except FileNotFoundError:
+        raise Http404('No sitemap matches the given query.')
+    return FileResponse(sitemap, content_type='application/xml')